@@ -0,0 +1,95 @@
+"""Run the benchmark suite and write the results as one JSON document.
+
+    python -m benchmarks [--quick] [--output results.json] [names...]
+
+names selects benchmarks among fish_socket, fish_binary, mesh_export and
+p2p_link (all by default). --quick uses small sizes, for a smoke test.
+The document holds the environment (package version, Python, NumPy,
+platform, git commit) and a list of result records, each tagged with its
+"benchmark" name, so runs from different releases can be compared.
+Progress messages of the connections go to stderr.
+"""
+
+from __future__ import print_function
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+
+import itasca
+from benchmarks import (bench_fish_binary, bench_fish_socket,
+                        bench_mesh_export, bench_p2p_link)
+
+# full and quick keyword arguments of each benchmark main()
+suite = {
+    "fish_socket": (bench_fish_socket.main,
+                    {}, {"round_trips": 1000, "sizes": (1000, 100000)}),
+    "fish_binary": (bench_fish_binary.main,
+                    {}, {"sizes": (1000, 100000), "mixed_size": 10000}),
+    "mesh_export": (bench_mesh_export.main,
+                    {}, {"edges": (10, 22)}),
+    "p2p_link": (bench_p2p_link.main,
+                 {}, {"round_trips": 1000, "sizes": (8000, 800000)}),
+}
+
+def _git_commit():
+    try:
+        # the commit of the itasca package measured, not of the current
+        # directory
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(itasca.__file__)),
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    """() -> dict. Versions and machine the benchmarks ran on."""
+    return {"itasca_version": itasca.__version__,
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds")}
+
+def run(names, quick=False):
+    """(names: [str], quick=False: bool) -> dict.
+    Run the named benchmarks and return the results document.
+    """
+    results = []
+    for name in names:
+        main, full, small = suite[name]
+        print("running", name, file=sys.stderr)
+        with contextlib.redirect_stdout(sys.stderr):
+            results.extend(main(**(small if quick else full)))
+    return {"environment": environment(), "quick": quick,
+            "results": results}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description=__doc__.splitlines()[0])
+    parser.add_argument("names", nargs="*",
+                        help="benchmarks to run, all by default: " +
+                        ", ".join(suite))
+    parser.add_argument("--quick", action="store_true",
+                        help="small sizes, for a smoke test")
+    parser.add_argument("--output", "-o",
+                        help="write the JSON document to this file")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(suite)
+    if unknown:
+        parser.error("unknown benchmarks: " + ", ".join(sorted(unknown)))
+    document = run(args.names or list(suite), args.quick)
+    text = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
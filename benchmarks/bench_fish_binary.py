@@ -0,0 +1,94 @@
+"""Throughput of FishBinaryWriter and FishBinaryReader against file size.
+
+Each size is written from a float array, then read back with asarray()
+(memory mapped), iter_chunks() and, for the smaller files, value by
+value with aslist(). A mixed file of floats and strings times the
+general path. Run from the repository root:
+
+    python -m benchmarks.bench_fish_binary [largest_size]
+"""
+
+from __future__ import print_function
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from itasca import FishBinaryReader, FishBinaryWriter
+
+def _timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def _result(operation, values, file_size, elapsed):
+    return {"benchmark": "fish_binary",
+            "operation": operation,
+            "values": values,
+            "file_bytes": file_size,
+            "seconds": elapsed,
+            "values_per_second": values / elapsed,
+            "megabytes_per_second": file_size / elapsed / 1e6}
+
+def bench_size(filename, n, list_limit=100000):
+    """(filename: str, n: int, list_limit=100000: int) -> [dict].
+    Write and read n floats. aslist() is only timed up to list_limit
+    values.
+    """
+    data = np.random.random(n)
+    write = _timed(lambda: FishBinaryWriter(filename, data))
+    file_size = os.path.getsize(filename)
+    results = [_result("write_array", n, file_size, write)]
+
+    def read_array():
+        assert len(FishBinaryReader(filename).asarray()) == n
+    results.append(_result("read_asarray", n, file_size,
+                           _timed(read_array)))
+
+    def read_chunks():
+        reader = FishBinaryReader(filename)
+        assert sum(len(c) for c in reader.iter_chunks(65536)) == n
+    results.append(_result("read_iter_chunks", n, file_size,
+                           _timed(read_chunks)))
+    if n <= list_limit:
+        def read_list():
+            assert len(FishBinaryReader(filename).aslist()) == n
+        results.append(_result("read_aslist", n, file_size,
+                               _timed(read_list)))
+    return results
+
+def bench_mixed(filename, n):
+    """(filename: str, n: int) -> [dict].
+    Write and read n values alternating between floats and strings.
+    """
+    data = [x if i % 2 else "value {}".format(i)
+            for i, x in enumerate(np.random.random(n).tolist())]
+    write = _timed(lambda: FishBinaryWriter(filename, data))
+    file_size = os.path.getsize(filename)
+
+    def read_list():
+        assert len(FishBinaryReader(filename).aslist()) == n
+    return [_result("write_mixed", n, file_size, write),
+            _result("read_mixed_aslist", n, file_size, _timed(read_list))]
+
+def main(sizes=(1000, 10000, 100000, 1000000, 10000000), mixed_size=100000):
+    """(sizes=(1000, ..., 10000000): [int], mixed_size=100000: int)
+        -> [dict].
+    Run the benchmark for each file size, in a temporary directory.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "bench.fish")
+        for n in sizes:
+            results.extend(bench_size(filename, n))
+        results.extend(bench_mixed(filename, mixed_size))
+    return results
+
+if __name__ == '__main__':
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    sizes = [n for n in (1000, 10000, 100000, 1000000, 10000000)
+             if n <= largest]
+    print(json.dumps(main(sizes), indent=2))
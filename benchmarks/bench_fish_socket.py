@@ -0,0 +1,92 @@
+"""Latency and throughput benchmark of the FISH socket connection.
+
+A FishStreamPeer plays the part of the Itasca code. Each round trip sends
+one value with send() and reads the echo with receive(). The throughput
+runs move arrays of floats with send_many() and receive_many(). Run from
+the repository root:
+
+    python -m benchmarks.bench_fish_socket [round_trips]
+"""
+
+from __future__ import print_function
+import contextlib
+import json
+import sys
+import time
+
+import numpy as np
+
+from itasca import FLAC_Connection
+from tests.mock_fish_peer import FishStreamPeer
+
+_float_message = 12  # bytes of one float on the FISH socket
+
+def bench_round_trips(connection, value, round_trips):
+    """(connection, value: any, round_trips: int) -> dict.
+    Time round_trips send/receive pairs of value.
+    """
+    start = time.perf_counter()
+    for _ in range(round_trips):
+        connection.send(value)
+        connection.receive()
+    elapsed = time.perf_counter() - start
+    return {"benchmark": "fish_socket_latency",
+            "value_type": type(value).__name__,
+            "round_trips": round_trips,
+            "seconds": elapsed,
+            "latency_us": 1e6 * elapsed / round_trips,
+            "messages_per_second": 2 * round_trips / elapsed}
+
+def _throughput(direction, n, elapsed):
+    return {"benchmark": "fish_socket_throughput",
+            "direction": direction,
+            "values": n,
+            "seconds": elapsed,
+            "values_per_second": n / elapsed,
+            "megabytes_per_second": n * _float_message / elapsed / 1e6}
+
+def bench_send(connection, n):
+    """(connection, n: int) -> dict.
+    Time sending n floats with send_many, up to the peer's receipt.
+    """
+    values = np.random.random(n)
+    start = time.perf_counter()
+    connection.send_many(["sink", n, values])
+    assert connection.receive() == n
+    return _throughput("send", n, time.perf_counter() - start)
+
+def bench_receive(connection, n):
+    """(connection, n: int) -> dict.
+    Time receiving n floats with receive_many.
+    """
+    start = time.perf_counter()
+    connection.send_many(["source", n])
+    values = connection.receive_many(n)
+    assert connection.receive() == n and len(values) == n
+    return _throughput("receive", n, time.perf_counter() - start)
+
+def main(round_trips=20000, sizes=(1000, 100000, 1000000),
+         fish_socket_id=5):
+    """(round_trips=20000: int, sizes=(1000, 100000, 1000000): [int],
+        fish_socket_id=5: int) -> [dict].
+    Run the latency and throughput benchmarks against a local peer.
+    """
+    connection = FLAC_Connection(fish_socket_id, timeout=30.0)
+    peer = FishStreamPeer(connection.server.port)
+    peer.start()
+    connection.attach()
+    results = [bench_round_trips(connection, value, round_trips)
+               for value in (1, 1.5, [1.0, 2.0, 3.0], "James")]
+    for n in sizes:
+        results.append(bench_send(connection, n))
+        results.append(bench_receive(connection, n))
+    connection.send(-1)
+    connection.end()
+    peer.join()
+    return results
+
+if __name__ == '__main__':
+    round_trips = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with contextlib.redirect_stdout(sys.stderr):  # connection messages
+        results = main(round_trips)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,95 @@
+"""meshConvert export benchmark on fake FLAC3D models of growing size.
+
+A FakeModel stands in for the FLAC3D Python environment. For each model
+size the mesh is read from the model (array and object paths) and written
+as ASCII and binary Gmsh, .npz and FLAC3D grid files. Run from the
+repository root:
+
+    python -m benchmarks.bench_mesh_export [largest_zone_count] [workers]
+"""
+
+from __future__ import print_function
+import json
+import os
+import sys
+import tempfile
+import time
+
+from itasca import meshConvert
+from tests.fake_itasca import FakeModel
+
+def _timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+def _result(operation, model, elapsed, filename=None, workers=None):
+    result = {"benchmark": "mesh_export",
+              "operation": operation,
+              "zones": len(model.zone_ids),
+              "gridpoints": len(model.positions),
+              "seconds": elapsed,
+              "zones_per_second": len(model.zone_ids) / elapsed}
+    if filename is not None:
+        result["file_bytes"] = os.path.getsize(filename)
+    if workers is not None:
+        result["workers"] = workers
+    return result
+
+def bench_model(directory, n, object_limit=100000, workers=None):
+    """(directory: str, n: int, object_limit=100000: int, workers=None: int)
+        -> [dict].
+    Time the exports of an n*n*n zone model. The object path, which
+    visits every gridpoint and zone, is only timed up to object_limit
+    zones.
+    """
+    results = []
+    model = FakeModel(n, n, n, arrays=False)
+    if len(model.zone_ids) <= object_limit:
+        with model:
+            elapsed, _ = _timed(meshConvert.FLAC3D_mesh)
+        results.append(_result("read_model_objects", model, elapsed))
+    model.arrays = True
+    with model:
+        elapsed, mesh = _timed(meshConvert.FLAC3D_mesh)
+    results.append(_result("read_model_arrays", model, elapsed))
+
+    writers = [("write_gmsh_ascii", "mesh.msh",
+                lambda f: meshConvert.write_gmsh(f, mesh)),
+               ("write_gmsh_binary", "mesh_binary.msh",
+                lambda f: meshConvert.write_gmsh(f, mesh, binary=True)),
+               ("write_npz", "mesh.npz",
+                lambda f: meshConvert.write_npz(f, mesh)),
+               ("write_f3grid", "mesh.f3grid",
+                lambda f: meshConvert.write_f3grid(f, mesh))]
+    if workers is not None and workers > 1:
+        writers.append(("write_gmsh_ascii", "mesh_parallel.msh",
+                        lambda f: meshConvert.write_gmsh(f, mesh,
+                                                         workers=workers)))
+    for operation, name, write in writers:
+        filename = os.path.join(directory, name)
+        elapsed, _ = _timed(lambda: write(filename))
+        results.append(_result(operation, model, elapsed, filename,
+                               workers if name == "mesh_parallel.msh"
+                               else None))
+    filename = os.path.join(directory, "mesh_binary.msh")
+    elapsed, _ = _timed(lambda: meshConvert.read_mesh(filename))
+    results.append(_result("read_gmsh_binary", model, elapsed, filename))
+    return results
+
+def main(edges=(10, 22, 47, 100), workers=None):
+    """(edges=(10, 22, 47, 100): [int], workers=None: int) -> [dict].
+    Run the benchmark for models of edge**3 zones (about a thousand to a
+    million zones).
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for n in edges:
+            results.extend(bench_model(directory, n, workers=workers))
+    return results
+
+if __name__ == '__main__':
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    edges = [n for n in (10, 22, 47, 100) if n ** 3 <= largest]
+    print(json.dumps(main(edges, workers), indent=2))
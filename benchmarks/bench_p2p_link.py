@@ -0,0 +1,107 @@
+"""Latency and array bandwidth of the Python to Python socket link.
+
+A MockP2PPeer connects to a p2pLinkServer from a background thread.
+Round trips echo small values; the bandwidth runs send float arrays of
+growing size, which the peer acknowledges with their byte count, and
+receive them back as echoes. Run from the repository root:
+
+    python -m benchmarks.bench_p2p_link [largest_array_bytes] [compression]
+"""
+
+from __future__ import print_function
+import contextlib
+import json
+import sys
+import time
+
+import numpy as np
+
+from itasca import p2pLinkServer
+from tests.mock_p2p_peer import MockP2PPeer
+
+def bench_round_trips(link, value, round_trips):
+    """(link: p2pLinkServer, value: any, round_trips: int) -> dict.
+    Time round_trips send/read pairs of value.
+    """
+    start = time.perf_counter()
+    for _ in range(round_trips):
+        link.send_data(value)
+        link.read_data()
+    elapsed = time.perf_counter() - start
+    return {"benchmark": "p2p_latency",
+            "value_type": type(value).__name__,
+            "round_trips": round_trips,
+            "seconds": elapsed,
+            "latency_us": 1e6 * elapsed / round_trips}
+
+def bench_array(link, array, repeats, compression):
+    """(link: p2pLinkServer, array: numpy array, repeats: int,
+        compression: str) -> dict.
+    Time sending array repeats times, each acknowledged by the peer with
+    its size, then echoing it back.
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        link.send_data(array)
+        assert link.read_data() == array.nbytes
+    send = time.perf_counter() - start
+    link.send_data("echo")
+    link.read_data()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        link.send_data(array)
+        link.read_data()
+    round_trip = time.perf_counter() - start
+    link.send_data("ack")
+    link.read_data()
+    megabytes = array.nbytes * repeats / 1e6
+    return {"benchmark": "p2p_bandwidth",
+            "array_bytes": array.nbytes,
+            "repeats": repeats,
+            "compression": compression,
+            "send_seconds": send,
+            "send_megabytes_per_second": megabytes / send,
+            "echo_seconds": round_trip,
+            "echo_megabytes_per_second": 2 * megabytes / round_trip}
+
+class _switchingPeer(MockP2PPeer):
+    """MockP2PPeer which acknowledges arrays with their size until told
+    "echo", and goes back to acknowledging on "ack".
+    """
+    def handle(self, value):
+        if type(value) is str and value in ("echo", "ack"):
+            self.echo = value == "echo"
+        return MockP2PPeer.handle(self, value)
+
+def main(round_trips=10000, sizes=(8 * 10 ** 3, 8 * 10 ** 5, 8 * 10 ** 7),
+         compression=None, port=5555):
+    """(round_trips=10000: int, sizes=(8e3, 8e5, 8e7): [int],
+        compression=None, port=5555: int) -> [dict].
+    Run the latency and bandwidth benchmarks. sizes are array sizes in
+    bytes, compression is passed to the link (random data compresses
+    poorly, smooth data well).
+    """
+    peer = _switchingPeer(port, echo=False, compression=compression)
+    peer.start()
+    link = p2pLinkServer(port, timeout=30.0, compression=compression)
+    link.start()
+    results = [bench_round_trips(link, value, round_trips)
+               for value in (1, 1.5, [1.0, 2.0, 3.0], "James",
+                             np.arange(10.0))]
+    for size in sizes:
+        array = np.linspace(0.0, 1.0, size // 8)
+        repeats = max(1, min(1000, 8 * 10 ** 7 // size))
+        results.append(bench_array(link, array, repeats, compression))
+    link.send_data(-1)
+    peer.join()
+    link.close()
+    return results
+
+if __name__ == '__main__':
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 8 * 10 ** 7
+    compression = sys.argv[2] if len(sys.argv) > 2 else None
+    sizes = [n for n in (8 * 10 ** 3, 8 * 10 ** 5, 8 * 10 ** 7)
+             if n <= largest]
+    with contextlib.redirect_stdout(sys.stderr):  # connection messages
+        results = main(sizes=sizes, compression=compression)
+    print(json.dumps(results, indent=2))
@@ -22,6 +22,10 @@ from .main import FishBinaryWriter
 from .main import FLAC_Connection
 from .main import UDEC_Connection
 from .main import ThreeDEC_Connection
+from .main import ModelPool, ItascaConnectionError
 from .main import UDECFishBinaryReader
 from .main import UDECFishBinaryWriter
 from .main import p2pLinkClient, p2pLinkServer
+from .main import AsyncP2PLink
+from .main import p2pLinkMultiServer, p2pLinkClientPool
+from .bridge import pfcBridge
@@ -0,0 +1,292 @@
+"""High level interface to PFC3D over a FISH socket.
+
+PFC3D runs the server loop in pfc_bridge_server.p3dat (see the tests
+folder) which answers these requests: 10 runs a command, 11 evaluates a
+FISH expression and returns its value, 12 executes a FISH assignment and
+13 and 14 read and write a ball quantity for all the balls at once.
+Pointers to balls, walls, clumps and measurement spheres are returned as
+strings like ":ball: 12" and are mapped to pfcObject instances.
+
+Requests are pipelined: many requests are written to the socket in one
+send and the replies are read back together, in order, so a batch costs
+one round trip instead of one per request.
+"""
+
+import re
+
+import numpy as np
+
+from .main import PFC3D_Connection
+
+# FISH prefix and lookup function of each pointer type
+_pointer_types = {"ball": ("b_", "find_ball"),
+                  "wall": ("w_", "find_wall"),
+                  "clump": ("cl_", "find_clump"),
+                  "meas": ("m_", "find_meas")}
+
+# values per ball of the quantities moved by the array requests (13, 14)
+_ball_arrays = {"positions": 3, "velocities": 3, "radii": 1, "ids": 1}
+
+# name = value, or name(index) = value, but not a name == value comparison
+_assignment = re.compile(r"^\s*[A-Za-z_][\w.]*(\(.*\))?\s*=(?!=)")
+
+class pfcObject(object):
+    """Proxy for a PFC ball, wall, clump or measurement sphere. FISH
+    properties are read and written by calling a method named after the
+    property without its prefix:
+
+    >>> ball.rad()       # b_rad(find_ball(id))
+    >>> ball.rad(0.123)  # b_rad(find_ball(id)) = 0.123
+    """
+    def __init__(self, bridge, kind, id):
+        """(bridge: pfcBridge, kind: str, id: int) -> pfcObject."""
+        self.bridge = bridge
+        self.kind = kind
+        self.id = id
+
+    def fish_name(self, attribute):
+        """(attribute: str) -> str.
+        FISH expression for a property of this object.
+        """
+        prefix, find = _pointer_types[self.kind]
+        return "{}{}({}({}))".format(prefix, attribute, find, self.id)
+
+    def __getattr__(self, attribute):
+        if attribute.startswith("_"):
+            raise AttributeError(attribute)
+
+        def accessor(*value):
+            if value:
+                return self.bridge.execute("{} = {}".format(
+                    self.fish_name(attribute), value[0]))
+            return self.bridge.eval(self.fish_name(attribute))
+        return accessor
+
+    def __eq__(self, other):
+        return (isinstance(other, pfcObject) and self.kind == other.kind
+                and self.id == other.id)
+
+    def __hash__(self):
+        return hash((self.kind, self.id))
+
+    def __repr__(self):
+        return "<pfc {} {}>".format(self.kind, self.id)
+
+class pfcBridge(object):
+    """Run commands and evaluate FISH in PFC3D from Python.
+
+    >>> pfc = pfcBridge()       # starts PFC3D with pfc_bridge_server.p3dat
+    >>> pfc.cmd("ball id 1 rad 1 x 0 y 0 z 0")
+    >>> pfc.eval("cos(1+2.2)")
+    >>> pfc.eval_many(["b_x(find_ball(1))", "b_y(find_ball(1))"])
+
+    Any other attribute is evaluated as a FISH function: pfc.time() and
+    pfc.ball_near3(0,0,0) evaluate time and ball_near3(0,0,0).
+    """
+    pipeline_depth = 1000  # requests written before the replies are read
+
+    def __init__(self, datafile="pfc_bridge_server.p3dat", connection=None):
+        """(datafile="pfc_bridge_server.p3dat": str,
+            connection=None: _ItascaSoftwareConnection) -> pfcBridge.
+        Launch PFC3D with the bridge server data file and connect to it, or
+        use an already connected connection.
+        """
+        if connection is None:
+            connection = PFC3D_Connection()
+            connection.start(datafile)
+            connection.connect()
+        self.connection = connection
+
+    def _request_many(self, requests):
+        """([(code: int, text: str)]) -> [any].
+        Send bridge requests in batches of pipeline_depth and return the
+        mapped replies in order.
+        """
+        results = []
+        for start in range(0, len(requests), self.pipeline_depth):
+            batch = requests[start:start + self.pipeline_depth]
+            values = []
+            for code, text in batch:
+                values.extend((code, text))
+            self.connection.send_many(values)
+            replies = self.connection.receive_many(len(batch))
+            if not isinstance(replies, list):
+                replies = replies.tolist()
+            results.extend(self._map_reply(reply) for reply in replies)
+        return results
+
+    def _map_reply(self, value):
+        """(value: any) -> any.
+        Convert pointer strings returned by the bridge server to
+        pfcObject instances (or None for null pointers).
+        """
+        if type(value) is str and value.startswith(":"):
+            if value == ":null:":
+                return None
+            kind, _, id = value[1:].partition(": ")
+            if kind in _pointer_types:
+                return pfcObject(self, kind, int(id))
+        return value
+
+    def cmd(self, command):
+        """(command: str) -> None.
+        Run a PFC command.
+        """
+        self.cmd_many([command])
+
+    def cmd_many(self, commands):
+        """(commands: [str]) -> None.
+        Run several PFC commands in one round trip.
+        """
+        self._request_many([(10, command) for command in commands])
+
+    def eval(self, expression):
+        """(expression: str) -> any.
+        Evaluate a FISH expression and return its value. Assignments
+        (name = value) are executed and return 0.
+        """
+        return self.eval_many([expression])[0]
+
+    def eval_many(self, expressions):
+        """(expressions: [str]) -> [any].
+        Evaluate several FISH expressions in one round trip.
+        """
+        return self._request_many([(12 if _assignment.match(e) else 11, e)
+                                   for e in expressions])
+
+    def execute(self, statement):
+        """(statement: str) -> int.
+        Execute a FISH statement, such as an assignment. Returns 0.
+        """
+        return self._request_many([(12, statement)])[0]
+
+    def get_many(self, objects, attribute):
+        """(objects: [pfcObject], attribute: str) -> [any].
+        Read one property of many objects in one round trip.
+
+        >>> pfc.get_many(pfc.ball_list(), "rad")
+        """
+        return self.eval_many([o.fish_name(attribute) for o in objects])
+
+    def set_many(self, objects, attribute, values):
+        """(objects: [pfcObject], attribute: str, values: [any]) -> None.
+        Set one property of many objects in one round trip. values can be a
+        sequence of the same length as objects or a single value.
+        """
+        objects = list(objects)
+        if not hasattr(values, "__len__") or type(values) is str:
+            values = [values] * len(objects)
+        self._request_many([(12, "{} = {}".format(o.fish_name(attribute), v))
+                            for o, v in zip(objects, values)])
+
+    def ball_list(self):
+        """() -> [pfcObject].
+        All the balls, in PFC list order.
+        """
+        return [pfcObject(self, "ball", int(ball_id))
+                for ball_id in self._get_ball_array("ids")]
+
+    def _get_ball_array(self, quantity):
+        """(quantity: str) -> numpy array.
+        Read a quantity of all the balls with one request. The server
+        replies with the ball count followed by the values as one stream
+        of FISH socket messages.
+        """
+        width = _ball_arrays[quantity]
+        self.connection.send_many([13, quantity])
+        count = self.connection.receive()
+        values = self.connection.receive_many(count * width)
+        self.connection.receive()
+        if not count:
+            values = np.zeros(0)
+        # a list if FISH sent ints and floats
+        values = np.asarray(values)
+        return values.reshape(count, width) if width > 1 else values
+
+    def _set_ball_array(self, quantity, values):
+        """(quantity: str, values: array like) -> None.
+        Write a quantity of all the balls with one request.
+        """
+        width = _ball_arrays[quantity]
+        values = np.asarray(values, dtype=np.float64)
+        if not values.size and width > 1:
+            values = values.reshape(0, width)  # no balls
+        if values.ndim != (2 if width > 1 else 1) or \
+           (width > 1 and values.shape[1] != width):
+            raise ValueError("ball {} must be an array of shape {}".format(
+                quantity, "(N,{})".format(width) if width > 1 else "(N,)"))
+        self.connection.send_many([14, quantity, len(values),
+                                   values.ravel()])
+        count = self.connection.receive()
+        if count != len(values):
+            raise ValueError("{} ball {} sent for {} balls".format(
+                len(values), quantity, count))
+
+    def ball_positions(self):
+        """() -> numpy array.
+        (N,3) array of the positions of all the balls, in PFC list order
+        (the order of ball_list and ball_ids).
+        """
+        return self._get_ball_array("positions")
+
+    def ball_velocities(self):
+        """() -> numpy array.
+        (N,3) array of the velocities of all the balls.
+        """
+        return self._get_ball_array("velocities")
+
+    def ball_radii(self):
+        """() -> numpy array.
+        Radii of all the balls.
+        """
+        return self._get_ball_array("radii")
+
+    def ball_ids(self):
+        """() -> numpy array.
+        Ids of all the balls, in the order of the other ball arrays.
+        """
+        return self._get_ball_array("ids")
+
+    def set_ball_positions(self, positions):
+        """(positions: (N,3) array) -> None.
+        Move all the balls. Raises ValueError if N is not the number of
+        balls.
+        """
+        self._set_ball_array("positions", positions)
+
+    def set_ball_velocities(self, velocities):
+        """(velocities: (N,3) array) -> None.
+        Set the velocities of all the balls.
+        """
+        self._set_ball_array("velocities", velocities)
+
+    def set_ball_radii(self, radii):
+        """(radii: (N,) array) -> None.
+        Set the radii of all the balls.
+        """
+        self._set_ball_array("radii", radii)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def fish_function(*args):
+            if not args:
+                return self.eval(name)
+            return self.eval("{}({})".format(name, ",".join(map(str, args))))
+        return fish_function
+
+    def quit(self):
+        """() -> None.
+        Exit PFC3D and close the connection.
+        """
+        self.connection.send(-2)
+        self.connection.end()
+
+    def close(self):
+        """() -> None.
+        Stop the bridge server loop and close the connection. PFC3D keeps
+        running.
+        """
+        self.connection.send(-1)
+        self.connection.end()
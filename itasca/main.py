@@ -8,6 +8,11 @@ itascacg.com/software
 FLAC, FLAC3D, PFC2D, PFC3D, UDEC & 3DEC"""
 
 from __future__ import print_function
+import ast
+import asyncio
+import collections
+import ctypes
+import io
 import json
 import struct
 import socket
@@ -15,27 +20,430 @@ import select
 import time
 import subprocess
 import os
+import queue
+import shutil
+import selectors
+import threading
+import contextlib
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    from multiprocessing import resource_tracker
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:  # Python before 3.8
+    SharedMemory = None
+
+_wait_slice = 0.5  # longest single select() call, keeps Ctrl-C responsive
+
+def _wait_for_socket(sock, write=False, timeout=None, alive=None):
+    """(sock: socket, write=False: bool, timeout=None: float,
+        alive=None: callable) -> None.
+    Block until sock is ready for reading (or writing when write is True)
+    without busy polling. The select() call releases the GIL so other
+    Python threads keep running. Raises TimeoutError if the socket is not
+    ready after timeout seconds, a timeout of None waits forever. alive()
+    is called between select() calls, ConnectionError is raised if it
+    returns False (the peer process has exited).
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait = _wait_slice
+        if deadline is not None:
+            wait = max(0.0, min(wait, deadline - time.monotonic()))
+        if write:
+            _, ready, _ = select.select([], [sock], [], wait)
+        else:
+            ready, _, _ = select.select([sock], [], [], wait)
+        if ready:
+            return
+        if alive is not None and not alive():
+            raise ConnectionError("peer process exited")
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError("socket not ready for {} after {} seconds"
+                               .format("writing" if write else "reading",
+                                       timeout))
+
+class _socketReceiveBuffer(object):
+    """Buffered reads from a socket connection. Data is received with
+    recv_into directly into a preallocated bytearray which grows
+    geometrically when a message does not fit, so reads take linear time.
+    Each recv takes everything that is queued on the socket (up to the
+    free buffer space). Large reads can go straight into the destination
+    buffer with read_into.
+    """
+    def __init__(self, sock, size=65536):
+        """(sock: socket, size=65536: int) -> None. Constructor."""
+        self.sock = sock
+        self._data = bytearray(size)
+        self._start = 0  # first unread byte
+        self._end = 0    # end of the received data
+        self.received = 0   # bytes read from the buffer so far
+        self.waited = 0.0   # seconds blocked waiting for the socket
+
+    def __len__(self):
+        return self._end - self._start
+
+    def _reserve(self, byte_count):
+        """(byte_count: int) -> None.
+        Make room for byte_count bytes from the first unread byte, moving
+        the unread data to a new (larger if needed) buffer.
+        """
+        if self._start + byte_count > len(self._data):
+            size = len(self._data)
+            while size < byte_count:
+                size *= 2
+            data = bytearray(size)
+            data[:len(self)] = memoryview(self._data)[self._start:self._end]
+            self._data, self._start, self._end = data, 0, len(self)
+
+    def _wait(self, timeout):
+        """(timeout: float) -> None.
+        Block until the socket is readable, adding the time to waited.
+        """
+        start = time.perf_counter()
+        try:
+            _wait_for_socket(self.sock, timeout=timeout)
+        finally:
+            self.waited += time.perf_counter() - start
+
+    def _recv(self):
+        """() -> None.
+        Receive into the free space at the end of the buffer.
+        """
+        with memoryview(self._data) as view:
+            count = self.sock.recv_into(view[self._end:])
+        if not count:
+            raise ConnectionError("socket connection closed by peer")
+        self._end += count
+
+    def fill(self, byte_count, timeout=None):
+        """(byte_count: int, timeout=None: float) -> None.
+        Receive until at least byte_count bytes are buffered.
+        """
+        self._reserve(byte_count)
+        while len(self) < byte_count:
+            self._wait(timeout)
+            self._recv()
+
+    def receive_available(self, byte_count=0):
+        """(byte_count=0: int) -> None.
+        Make one recv call, for use when the socket is known to be readable.
+        The buffer is first made large enough to hold byte_count bytes.
+        """
+        self._reserve(max(byte_count, len(self) + 1))
+        self._recv()
+
+    def peek(self, byte_count, timeout=None):
+        """(byte_count: int, timeout=None: float) -> memoryview.
+        Return a view of the next byte_count bytes without consuming them.
+        Release the view before the next call to fill.
+        """
+        self.fill(byte_count, timeout)
+        return memoryview(self._data)[self._start:self._start + byte_count]
+
+    def consume(self, byte_count):
+        """(byte_count: int) -> None.
+        Drop byte_count bytes from the front of the buffer.
+        """
+        assert byte_count <= len(self)
+        self._start += byte_count
+        self.received += byte_count
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def read(self, byte_count, timeout=None):
+        """(byte_count: int, timeout=None: float) -> bytes or bytearray.
+        Read exactly byte_count bytes.
+        """
+        if byte_count > len(self._data):
+            data = bytearray(byte_count)
+            self.read_into(data, timeout)
+            return data
+        self.fill(byte_count, timeout)
+        with memoryview(self._data) as view:  # one copy, into the bytes
+            data = bytes(view[self._start:self._start + byte_count])
+        self.consume(byte_count)
+        return data
+
+    def read_into(self, buffer, timeout=None):
+        """(buffer: writable buffer, timeout=None: float) -> None.
+        Fill buffer (a bytearray, NumPy array, ...) with the next bytes
+        from the socket. Bytes beyond the buffered data are received
+        directly into buffer.
+        """
+        with memoryview(buffer) as target:
+            view = target.cast("B")
+            count = min(len(self), len(view))
+            view[:count] = memoryview(self._data)[self._start:
+                                                  self._start + count]
+            self.consume(count)
+            while count < len(view):
+                self._wait(timeout)
+                received = self.sock.recv_into(view[count:])
+                if not received:
+                    raise ConnectionError("socket connection closed by peer")
+                count += received
+                self.received += received
+            view.release()
+
+class TransferStats(object):
+    """Traffic counters of one connection or link, created by its
+    enable_stats method. Messages sent and received are counted by type
+    code, with their size in bytes, and their time is split between
+    waiting for the socket, encoding, decoding and writing to the socket.
+    The time from the first message sent after a receive to the next
+    receive is a round trip; the round trip latencies are kept in a
+    histogram of power of two microsecond buckets.
+
+    hook, if given, is called with a dict for each send and receive:
+    direction ("send" or "receive"), messages ({type code: (count,
+    bytes)}), bytes, start, end and wait (seconds of time.perf_counter)
+    and latency (the round trip ended by a receive, or None). With trace
+    True the sends and receives are also kept as Chrome trace events, see
+    write_trace.
+    """
+    type_names = {1: "int", 2: "float", 3: "string", 5: "v2", 6: "v3",
+                  7: "array", 8: "dict", 9: "structure", 10: "compressed",
+                  11: "shared", 12: "release"}
+
+    def __init__(self, hook=None, trace=False):
+        """(hook=None: callable, trace=False: bool) -> TransferStats."""
+        self.hook = hook
+        self.trace_events = [] if trace else None
+        self.sent = {}      # type code -> [messages, bytes]
+        self.received = {}
+        self.wait_seconds = 0.0    # blocked on the socket
+        self.encode_seconds = 0.0
+        self.decode_seconds = 0.0  # includes copying out of the socket
+        self.send_seconds = 0.0    # writing to the socket, without waits
+        self.latency_histogram = {}  # bucket upper bound (us) -> count
+        self._request_start = None
+
+    @staticmethod
+    def _count(counters, messages):
+        for type_code, (count, byte_count) in messages.items():
+            counter = counters.setdefault(type_code, [0, 0])
+            counter[0] += count
+            counter[1] += byte_count
+
+    def record_send(self, messages, start, encoded, wait, end):
+        """(messages: dict, start: float, encoded: float, wait: float,
+            end: float) -> None.
+        Count one write of {type code: (count, bytes)} messages. Encoding
+        ran from start to encoded and writing from encoded to end, wait
+        seconds of it blocked on the socket.
+        """
+        self._count(self.sent, messages)
+        self.encode_seconds += encoded - start
+        self.wait_seconds += wait
+        self.send_seconds += end - encoded - wait
+        if self._request_start is None:
+            self._request_start = start
+        if self.hook is not None or self.trace_events is not None:
+            self._event("send", messages, start, end, wait, None)
+
+    def record_receive(self, messages, start, wait, end):
+        """(messages: dict, start: float, wait: float, end: float) -> None.
+        Count one read of {type code: (count, bytes)} messages which took
+        from start to end, wait seconds of it blocked on the socket.
+        """
+        self._count(self.received, messages)
+        self.wait_seconds += wait
+        self.decode_seconds += end - start - wait
+        latency = None
+        if self._request_start is not None:
+            latency = end - self._request_start
+            self._request_start = None
+            bucket = 1 << int(latency * 1e6).bit_length()
+            self.latency_histogram[bucket] = \
+                self.latency_histogram.get(bucket, 0) + 1
+        if self.hook is not None or self.trace_events is not None:
+            self._event("receive", messages, start, end, wait, latency)
+
+    def _event(self, direction, messages, start, end, wait, latency):
+        byte_count = sum(b for _, b in messages.values())
+        if self.hook is not None:
+            self.hook({"direction": direction, "messages": messages,
+                       "bytes": byte_count, "start": start, "end": end,
+                       "wait": wait, "latency": latency})
+        if self.trace_events is not None:
+            names = [self.type_names.get(code, str(code))
+                     for code in messages]
+            self.trace_events.append({
+                "name": "{} {}".format(direction, "/".join(names)),
+                "cat": direction, "ph": "X",
+                "ts": start * 1e6, "dur": (end - start) * 1e6,
+                "pid": os.getpid(), "tid": threading.get_ident(),
+                "args": {"bytes": byte_count, "wait_us": wait * 1e6,
+                         "messages": {name: count for name, (count, _)
+                                      in zip(names, messages.values())}}})
+
+    def as_dict(self):
+        """() -> dict.
+        The counters as plain Python types, ready for json.dumps.
+        """
+        def by_type(counters):
+            return {code: {"messages": count, "bytes": byte_count}
+                    for code, (count, byte_count) in sorted(counters.items())}
+        return {"sent": by_type(self.sent),
+                "received": by_type(self.received),
+                "wait_seconds": self.wait_seconds,
+                "encode_seconds": self.encode_seconds,
+                "decode_seconds": self.decode_seconds,
+                "send_seconds": self.send_seconds,
+                "round_trips": sum(self.latency_histogram.values()),
+                "latency_histogram": dict(sorted(
+                    self.latency_histogram.items()))}
+
+    def write_trace(self, filename):
+        """(filename: str) -> None.
+        Write the trace events in the Chrome trace JSON format, for
+        chrome://tracing or Perfetto.
+        """
+        if self.trace_events is None:
+            raise ValueError("enable_stats(trace=True) to record a trace")
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": self.trace_events,
+                       "displayTimeUnit": "ms"}, f)
+
+class _statsBase(object):
+    """Transfer statistics of a connection, kept in self._stats."""
+    _stats = None
+
+    def enable_stats(self, hook=None, trace=False):
+        """(hook=None: callable, trace=False: bool) -> TransferStats.
+        Start counting the traffic of this connection, from zero. See
+        TransferStats for hook and trace.
+        """
+        self._stats = TransferStats(hook, trace)
+        return self._stats
+
+    def stats(self):
+        """() -> dict.
+        Traffic counters since enable_stats was called, see
+        TransferStats.as_dict. None if statistics are not enabled.
+        """
+        return None if self._stats is None else self._stats.as_dict()
+
+    def write_trace(self, filename):
+        """(filename: str) -> None.
+        Write the send and receive timeline as a Chrome trace JSON file.
+        Requires enable_stats(trace=True).
+        """
+        if self._stats is None:
+            raise ValueError("enable_stats(trace=True) to record a trace")
+        self._stats.write_trace(filename)
+
+def _fish_frame(value):
+    """(value: any) -> bytes.
+    Pack value, with its type code, into a single FISH socket message.
+    value must be int, float, length two list of doubles, length three
+    list of doubles or a string.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        raise TypeError("FISH sockets have no bool type")
 
-class _ItascaFishSocketServer(object):
+    elif isinstance(value, (int, np.integer)):
+        return struct.pack("ii", 1, value)
+
+    elif isinstance(value, (float, np.floating)):
+        return struct.pack("=id", 2, value)
+
+    elif type(value) == list and len(value)==2:
+        return struct.pack("=idd", 5, float(value[0]), float(value[1]))
+
+    elif type(value) == list and len(value)==3:
+        return struct.pack("=iddd", 6, float(value[0]), float(value[1]),
+                           float(value[2]))
+
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        length = len(data)
+        buffer_length = 4*(1+(length-1)//4)
+        return struct.pack("ii", 3, length) + data.ljust(buffer_length, b" ")
+
+    raise Exception("unknown type in send_data")
+
+def _count_fish_frames(data, messages):
+    """(data: bytes, messages: dict) -> None.
+    Add the FISH socket messages in data to messages, a dict of type code
+    -> (message count, bytes). Runs of fixed size messages are counted
+    together, strings one by one.
+    """
+    offset = 0
+    while offset < len(data):
+        type_code, = struct.unpack_from("i", data, offset)
+        if type_code == 3:
+            length, = struct.unpack_from("i", data, offset + 4)
+            count, size = 1, 8 + 4*(1+(length-1)//4)
+        else:
+            record_dtype = _fish_record_dtype(type_code, 4)
+            records = np.frombuffer(
+                data, dtype=record_dtype, offset=offset,
+                count=(len(data) - offset) // record_dtype.itemsize)
+            count = _run_length(records["code"], type_code)
+            size = count * record_dtype.itemsize
+        total, byte_count = messages.get(type_code, (0, 0))
+        messages[type_code] = (total + count, byte_count + size)
+        offset += size
+
+class ItascaConnectionError(ConnectionError):
+    """The Itasca code could not be launched or did not connect to the
+    FISH socket."""
+
+def _fish_base_port():
+    """() -> int.
+    Port of FISH socket 0, 3333 unless set with the ITASCA_FISH_BASE_PORT
+    environment variable.
+    """
+    return int(os.environ.get("ITASCA_FISH_BASE_PORT", 3333))
+
+class _ItascaFishSocketServer(_statsBase):
     """Low level details of the Itasca FISH socket communication"""
-    def __init__(self, fish_socket_id=0):
-        assert type(fish_socket_id) is int and 0 <= fish_socket_id < 6
-        self.port = 3333 + fish_socket_id
+    def __init__(self, fish_socket_id=0, timeout=None, port=None, host=""):
+        """(fish_socket_id=0: int, timeout=None: float, port=None: int,
+            host="": str) -> Instance. Constructor.
+        Listen on port if it is given, otherwise on the base port (3333)
+        plus fish_socket_id. host is the interface to listen on, all
+        interfaces by default.
+        """
+        assert type(fish_socket_id) is int and fish_socket_id >= 0
+        if port is None:
+            port = _fish_base_port() + fish_socket_id
+        assert type(port) is int and 0 < port < 65536
+        self.port = port
+        self.host = host
+        self.timeout = timeout
 
-    def start(self):
-        """() -> None.
+    def start(self, alive=None):
+        """(alive=None: callable) -> None.
         Open the low level socket connection. Blocks but allows the Python thread
-        scheduler to run.
+        scheduler to run. Raises TimeoutError if the Itasca software does not
+        connect within the timeout, or ConnectionError if alive() returns
+        False while waiting (the launched software has exited).
         """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.bind(("", self.port))
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
         self.socket.listen(1)
-        while True:
-            connected, _, _ = select.select([self.socket], [], [], 0.0)
-            if connected: break
-            else: time.sleep(1e-8)
+        _wait_for_socket(self.socket, timeout=self.timeout, alive=alive)
         self.conn, addr = self.socket.accept()
+        # small replies and requests go out right away, not after Nagle
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # send() then takes what fits in the socket buffer instead of
+        # blocking until all of a large frame is written
+        self.conn.settimeout(self.timeout)
+        self._receive_buffer = _socketReceiveBuffer(self.conn)
         print('socket connection established by', addr)
 
     def send_data(self, value):
@@ -43,79 +451,118 @@ class _ItascaFishSocketServer(object):
         Send value to Itasca software. value must be int, float, length two list 
         of doubles, length three list of doubles or a string.
         """
-        while True:
-            _, write_ready, _ = select.select([], [self.conn], [], 0.0)
-            if write_ready: break
-            else: time.sleep(1e-8)
-
-        if type(value) == int:
-            self.conn.sendall(struct.pack("i", 1))
-            self.conn.sendall(struct.pack("i", value))
-
-        elif type(value) == float:
-            self.conn.sendall(struct.pack("i", 2))
-            self.conn.sendall(struct.pack("d", value))
-
-        elif type(value) == list and len(value)==2:
-            float_list = [float(x) for x in value]
-            self.conn.sendall(struct.pack("i", 5))
-            self.conn.sendall(struct.pack("dd", float_list[0], float_list[1]))
-
-        elif type(value) == list and len(value)==3:
-            float_list = [float(x) for x in value]
-            self.conn.sendall(struct.pack("i", 6))
-            self.conn.sendall(struct.pack("ddd", float_list[0],
-                                          float_list[1], float_list[2]))
-        elif type(value) == str:
-            length = len(value)
-            self.conn.sendall(struct.pack("ii", 3, length))
-            buffer_length = 4*(1+(length-1)/4) # this may be the wrong buffer length?
-            format_string = "%is" % buffer_length
-            value += " "*int(buffer_length - length)
-            self.conn.sendall(struct.pack(format_string, value.encode('utf-8')))
-        else:
-            raise Exception("unknown type in send_data")
+        start = time.perf_counter() if self._stats is not None else None
+        frame = _fish_frame(value)
+        self._send(frame, start, [frame])
+
+    def _send(self, frame, start, parts):
+        """(frame: bytes, start: float, parts: [bytes]) -> None.
+        Write frame, made of the parts (messages or runs of messages of
+        one type), and count it if statistics are enabled. Encoding
+        started at start.
+        """
+        if self._stats is None:
+            self._sendall(frame)
+            return
+        encoded = time.perf_counter()
+        waited = self._sendall(frame)
+        messages = {}
+        for part in parts:
+            _count_fish_frames(part, messages)
+        self._stats.record_send(messages, start, encoded, waited,
+                                time.perf_counter())
+
+    def _sendall(self, frame):
+        """(frame: bytes) -> float.
+        Write frame, waiting at most timeout seconds for the socket to take
+        each piece of it. Returns the seconds spent waiting. Raises
+        TimeoutError if the Itasca software stops reading.
+        """
+        waited = 0.0
+        with memoryview(frame) as view:
+            sent = 0
+            while sent < len(view):
+                start = time.perf_counter()
+                _wait_for_socket(self.conn, write=True, timeout=self.timeout)
+                waited += time.perf_counter() - start
+                sent += self.conn.send(view[sent:])
+        return waited
 
     def wait_for_data(self):
         """() -> None.
         Block until data is available. This call allows the Python thread scheduler 
-        to run.
+        to run. Raises TimeoutError if no data arrives within the timeout.
         """
-        while True:
-            input_ready, _, _ = select.select([self.conn],[],[], 0.0)
-            if input_ready: return
-            else: time.sleep(1e-8)
+        if not len(self._receive_buffer):
+            _wait_for_socket(self.conn, timeout=self.timeout)
+
+    def send_many(self, values):
+        """(values: iterable) -> None.
+        Send several values to Itasca software in one socket write. values
+        can be a sequence of the types accepted by send_data or a NumPy
+        array: 1-D int or float arrays are sent as ints or floats, (N,2) and
+        (N,3) arrays as v2 and v3 values. Arrays inside a sequence are sent
+        the same way, as their elements. FISH sockets have no bool type,
+        bool values and arrays raise TypeError.
+        """
+        start = time.perf_counter() if self._stats is not None else None
+        if isinstance(values, np.ndarray):
+            parts = [self._array_frame(values)]
+        else:
+            parts = [self._array_frame(value)
+                     if isinstance(value, np.ndarray)
+                     else _fish_frame(value) for value in values]
+        self._send(b"".join(parts), start, parts)
+
+    def _array_frame(self, values):
+        """(values: numpy array) -> bytes.
+        FISH socket messages for the elements of an array. Raises
+        TypeError for bool arrays, like send_data does for bool values.
+        """
+        if values.dtype.kind == "b":
+            raise TypeError("FISH sockets have no bool type")
+        records = _fish_array_records(values, 4)
+        if records is None:
+            return b"".join(_fish_frame(value) for value in values)
+        return records.tobytes()
 
     def read_type(self, type_string):
         """(type: str) -> any.
         This method should not be called directly. Use the read_data method.
         """
-        byte_count = struct.calcsize(type_string)
-        bytes_read = 0
-        data = b''
-        self.wait_for_data()
-        while bytes_read < byte_count:
-            data_in = self.conn.recv(byte_count - bytes_read)
-            data += data_in
-            bytes_read += len(data)
-        assert len(data)==byte_count, "bad packet data"
-        return data
+        return self._receive_buffer.read(struct.calcsize(type_string),
+                                         self.timeout)
 
     def read_data(self):
         """() -> any.
         Read the next item from the socket connection.
         """
+        if self._stats is None:
+            return self._read_value()[1]
+        buff = self._receive_buffer
+        start, waited, received = time.perf_counter(), buff.waited, \
+            buff.received
+        type_code, value = self._read_value()
+        self._stats.record_receive({type_code: (1, buff.received - received)},
+                                   start, buff.waited - waited,
+                                   time.perf_counter())
+        return value
+
+    def _read_value(self):
+        """() -> (int, any).
+        Read the next item, returns its type code and value.
+        """
         raw_data = self.read_type("i")
         type_code, = struct.unpack("i", raw_data)
         if type_code == 1:     # int
             raw_data = self.read_type("i")
             value, = struct.unpack("i", raw_data)
-            return value
+            return type_code, value
 
         elif type_code == 2:   # float
             raw_data = self.read_type("d")
             value, = struct.unpack("d", raw_data)
-            return value
+            return type_code, value
 
         elif type_code == 3:   # string
             length_data = self.read_type("i")
@@ -123,20 +570,86 @@ class _ItascaFishSocketServer(object):
             buffer_length = length + ((4 * (1 + length // 4) - length) % 4)
             format_string = "%is" % buffer_length
             data = self.read_type(format_string)
-            return data[:length].decode("utf-8")
+            return type_code, data[:length].decode("utf-8")
 
         elif type_code == 5:   # V2
             raw_data = self.read_type("dd")
             value0, value1 = struct.unpack("dd", raw_data)
-            return [value0, value1]
+            return type_code, [value0, value1]
 
         elif type_code == 6:   # V3
             raw_data = self.read_type("ddd")
             value0, value1, value3 = struct.unpack("ddd", raw_data)
-            return [value0, value1, value3]
+            return type_code, [value0, value1, value3]
 
         assert False, "Data read type error"
 
+    def read_many(self, n):
+        """(n: int) -> numpy array or list.
+        Read the next n items from the socket connection. Runs of int,
+        float, v2 and v3 values are decoded directly from the receive
+        buffer. A NumPy array is returned if all values have the same
+        type ((n,2) and (n,3) arrays for v2 and v3), otherwise a list.
+        """
+        buff = self._receive_buffer
+        if self._stats is not None:
+            start, waited, received = time.perf_counter(), buff.waited, \
+                buff.received
+        runs = []  # (type_code, values) pairs
+        while n > 0:
+            with buff.peek(4, self.timeout) as header:
+                type_code, = struct.unpack("i", header)
+            if type_code not in (1, 2, 5, 6):
+                runs.append((type_code, [self._read_value()[1]]))
+                n -= 1
+                continue
+            record_dtype = _fish_record_dtype(type_code, 4)
+            buff.fill(record_dtype.itemsize, self.timeout)
+            count = min(n, len(buff) // record_dtype.itemsize)
+            with buff.peek(count * record_dtype.itemsize) as view:
+                records = np.frombuffer(view, dtype=record_dtype)
+                mismatch = np.flatnonzero(records["code"] != type_code)
+                if len(mismatch):
+                    count = int(mismatch[0])
+                values = records["value"][:count].copy()
+                del records  # release the view
+            buff.consume(count * record_dtype.itemsize)
+            runs.append((type_code, values))
+            n -= count
+        if self._stats is not None:
+            self._record_runs(runs, start, buff.waited - waited,
+                              buff.received - received)
+        if not runs:
+            return np.array([])
+        if all(type_code == runs[0][0] for type_code, _ in runs):
+            if runs[0][0] in (1, 2, 5, 6):
+                return np.concatenate([values for _, values in runs])
+            return np.array([values[0] for _, values in runs])
+        result = []
+        for _, values in runs:
+            result.extend(values.tolist() if isinstance(values, np.ndarray)
+                          else values)
+        return result
+
+    def _record_runs(self, runs, start, wait, byte_count):
+        """(runs: [(int, values)], start: float, wait: float,
+            byte_count: int) -> None.
+        Count the values read by read_many. The bytes not taken by fixed
+        size records are those of the strings.
+        """
+        messages = {}
+        for type_code, values in runs:
+            count, _ = messages.get(type_code, (0, 0))
+            messages[type_code] = (count + len(values), 0)
+        for type_code, (count, _) in messages.items():
+            if type_code != 3:
+                size = count * _fish_record_dtype(type_code, 4).itemsize
+                messages[type_code] = (count, size)
+                byte_count -= size
+        if 3 in messages:
+            messages[3] = (messages[3][0], byte_count)
+        self._stats.record_receive(messages, start, wait, time.perf_counter())
+
     def get_handshake(self):
         """() -> int.
         Read the handshake packet from the socket.
@@ -149,9 +662,12 @@ class _ItascaFishSocketServer(object):
 
     def close(self):
         """() -> None.
-        Close the active socket connection.
+        Close the active socket connection and stop listening on the port.
         """
-        self.conn.close()
+        if hasattr(self, "conn"):
+            self.conn.close()
+        if hasattr(self, "socket"):
+            self.socket.close()
 
 
 class _ItascaSoftwareConnection(object):
@@ -160,13 +676,45 @@ class _ItascaSoftwareConnection(object):
     communication.
     """
 
-    def __init__(self, fish_socket_id=0):
-        """(fish_socket_id=0: int) -> Instance. Constructor."""
-        self.executable_name = None
-        self.server = _ItascaFishSocketServer(fish_socket_id)
+    default_executable = None      # installed location of the executable
+    executable_environment = None  # environment variable overriding it
+
+    def __init__(self, fish_socket_id=0, timeout=None, port=None, host="",
+                 executable=None):
+        """(fish_socket_id=0: int, timeout=None: float, port=None: int,
+            host="": str, executable=None: str) -> Instance. Constructor.
+        timeout is the number of seconds to wait for the Itasca software to
+        connect, send or accept data before TimeoutError is raised. None
+        waits forever. The socket listens on port if it is given, otherwise
+        on port 3333 (or ITASCA_FISH_BASE_PORT) plus fish_socket_id, on the
+        interface host (all interfaces by default). executable is the path
+        of the Itasca program, see find_executable for the default.
+        """
+        self.executable_name = executable or self.find_executable()
+        self.server = _ItascaFishSocketServer(fish_socket_id, timeout, port,
+                                              host)
         self.iteration = 0
         self.global_time = 0
         self.fishcode = 178278912
+        self.process = None
+
+    @classmethod
+    def find_executable(cls):
+        """() -> str.
+        Locate the Itasca program: the path in the environment variable
+        named by executable_environment if it is set, then the default
+        install location, then the program name on the PATH. Returns the
+        default install location if nothing is found.
+        """
+        environment = cls.executable_environment
+        if environment and environment in os.environ:
+            return os.environ[environment]
+        if cls.default_executable is None:
+            return None
+        if os.path.exists(cls.default_executable):
+            return cls.default_executable
+        name = cls.default_executable.replace("\\", "/").split("/")[-1]
+        return shutil.which(name) or cls.default_executable
 
     def start(self, datafile_name):
         """(datafile_name: str) -> None.
@@ -175,8 +723,12 @@ class _ItascaSoftwareConnection(object):
         the calculation.
         """
         if os.access(datafile_name, os.R_OK):
-            args = f'"{self.executable_name}" call {datafile_name}'
-            self.process = subprocess.Popen(args)
+            args = [self.executable_name, "call", datafile_name]
+            try:
+                self.process = subprocess.Popen(args)
+            except OSError as error:
+                raise ItascaConnectionError("could not launch {}: {}".format(
+                    self.executable_name, error)) from error
 
         else:
             raise ValueError("The file {} is not readable".format(datafile_name))
@@ -185,13 +737,35 @@ class _ItascaSoftwareConnection(object):
         """() -> None.
         Connect to Itasca software, read fishcode to confirm connection. Call
         this function to establish the socket connection after calling the start
-        method to launch the code.
+        method to launch the code. Raises ItascaConnectionError if the code
+        exits before it connects.
         """
         assert self.process
-        self.server.start()
-        value = self.server.get_handshake()
+        poll = getattr(self.process, "poll", None)  # True if started by hand
+        self._attach(None if poll is None else lambda: poll() is None)
+
+    def attach(self):
+        """() -> None.
+        Connect to Itasca software which was not launched by start, for
+        example an instance started by hand or by a batch system. Blocks
+        until the code opens its FISH socket to this port and sends the
+        fishcode. Raises ItascaConnectionError if the code does not connect
+        within the timeout or sends a wrong handshake.
+        """
+        self._attach()
+
+    def _attach(self, alive=None):
+        try:
+            self.server.start(alive)
+            value = self.server.get_handshake()
+        except OSError as error:  # includes TimeoutError, ConnectionError
+            raise ItascaConnectionError("no FISH socket connection on port "
+                                        "{}: {}".format(self.server.port,
+                                                        error)) from error
         print("got handshake packet")
-        assert value == self.fishcode
+        if value != self.fishcode:
+            raise ItascaConnectionError("bad FISH socket handshake {}"
+                                        .format(value))
         print("connection OK")
 
     def send(self, data):
@@ -206,6 +780,45 @@ class _ItascaSoftwareConnection(object):
         """
         return self.server.read_data()
 
+    def send_many(self, values):
+        """(values: iterable or numpy array) -> None.
+        Send many items to the Itasca code in a single socket write. 1-D
+        NumPy arrays are sent as ints or floats, (N,2) and (N,3) arrays as
+        v2 and v3 values.
+        """
+        self.server.send_many(values)
+
+    def receive_many(self, n):
+        """(n: int) -> numpy array or list.
+        Read n items from the Itasca code. Returns a NumPy array when all
+        items have the same type, otherwise a list.
+        """
+        return self.server.read_many(n)
+
+    def enable_stats(self, hook=None, trace=False):
+        """(hook=None: callable, trace=False: bool) -> TransferStats.
+        Start counting the messages, bytes and time of the traffic with the
+        Itasca code. hook is called for each send and receive, trace keeps
+        a timeline for write_trace. See TransferStats.
+        """
+        return self.server.enable_stats(hook, trace)
+
+    def stats(self):
+        """() -> dict.
+        Traffic counters since enable_stats was called: messages and bytes
+        sent and received per type code, seconds waiting, encoding,
+        decoding and sending, and a round trip latency histogram. None if
+        statistics are not enabled.
+        """
+        return self.server.stats()
+
+    def write_trace(self, filename):
+        """(filename: str) -> None.
+        Write the send and receive timeline as a Chrome trace JSON file.
+        Requires enable_stats(trace=True).
+        """
+        self.server.write_trace(filename)
+
     def end(self):
         """() -> None.
         Close the socket connection.
@@ -214,38 +827,32 @@ class _ItascaSoftwareConnection(object):
 
     def shutdown(self):
         """()-> None.
-        Shutdown running softwarecode.
+        Shutdown running softwarecode. Does nothing if the code was not
+        launched by start.
         """
-        self.process.kill()
+        if isinstance(self.process, subprocess.Popen):
+            self.process.kill()
 
 class FLAC3D_Connection(_ItascaSoftwareConnection):
     """Launch and connect to FLAC3D."""
-    def __init__(self, fish_socket_id=0):
-        """(fish_socket_id=0: int) -> Instance. Constructor."""
-        _ItascaSoftwareConnection.__init__(self, fish_socket_id)
-        self.executable_name = "C:\\Program Files\\Itasca\\FLAC3D700\\exe64\\flac3d700_gui.exe"
+    default_executable = "C:\\Program Files\\Itasca\\FLAC3D700\\exe64\\flac3d700_gui.exe"
+    executable_environment = "ITASCA_FLAC3D_EXECUTABLE"
 
 class PFC3D_Connection(_ItascaSoftwareConnection):
     """Launch and connect to PFC3D."""
-    def __init__(self, fish_socket_id=0):
-        """(fish_socket_id=0: int) -> Instance. Constructor."""
-        _ItascaSoftwareConnection.__init__(self, fish_socket_id)
-        self.executable_name = "C:\\Program Files\\Itasca\\PFC600\\exe64\\pfc3d600_gui.exe"
+    default_executable = "C:\\Program Files\\Itasca\\PFC600\\exe64\\pfc3d600_gui.exe"
+    executable_environment = "ITASCA_PFC3D_EXECUTABLE"
 
 class PFC2D_Connection(_ItascaSoftwareConnection):
     """Launch and connect to PFC2D."""
-    def __init__(self, fish_socket_id=0):
-        """(fish_socket_id=0: int) -> Instance. Constructor."""
-        _ItascaSoftwareConnection.__init__(self, fish_socket_id)
-        self.executable_name = "C:\\Program Files\\Itasca\\PFC600\\exe64\\pfc2d600_gui.exe"
+    default_executable = "C:\\Program Files\\Itasca\\PFC600\\exe64\\pfc2d600_gui.exe"
+    executable_environment = "ITASCA_PFC2D_EXECUTABLE"
 
 
 class FLAC_Connection(_ItascaSoftwareConnection):
     """Launch and connect to FLAC. """
-    def __init__(self, fish_socket_id=0):
-        """(fish_socket_id=0: int) -> Instance. Constructor."""
-        _ItascaSoftwareConnection.__init__(self, fish_socket_id)
-        self.executable_name = "C:\\Program Files\\Itasca\\FLAC800\\exe64\\flac800_64.exe"
+    default_executable = "C:\\Program Files\\Itasca\\FLAC800\\exe64\\flac800_64.exe"
+    executable_environment = "ITASCA_FLAC_EXECUTABLE"
 
     def connect(self):
         """() -> None.
@@ -256,10 +863,8 @@ class FLAC_Connection(_ItascaSoftwareConnection):
 
 class UDEC_Connection(_ItascaSoftwareConnection):
     """Launch and connect to UDEC. """
-    def __init__(self, fish_socket_id=0):
-        """(fish_socket_id=0: int) -> Instance. Constructor."""
-        _ItascaSoftwareConnection.__init__(self, fish_socket_id)
-        self.executable_name = "C:\\Program Files\\Itasca\\UDEC700\\Exe64\\udec700_gui.exe"
+    default_executable = "C:\\Program Files\\Itasca\\UDEC700\\Exe64\\udec700_gui.exe"
+    executable_environment = "ITASCA_UDEC_EXECUTABLE"
 
     def connect(self):
         """() -> None.
@@ -270,11 +875,170 @@ class UDEC_Connection(_ItascaSoftwareConnection):
 
 class ThreeDEC_Connection(_ItascaSoftwareConnection):
     """Launch and connect to 3DEC."""
-    def __init__(self, fish_socket_id=0):
-        """(fish_socket_id=0: int) -> Instance. Constructor."""
-        _ItascaSoftwareConnection.__init__(self, fish_socket_id)
-        self.executable_name = "C:\\Program Files\\Itasca\\3DEC520\\exe64\\3dec_dp520_gui_64.exe"
-
+    default_executable = "C:\\Program Files\\Itasca\\3DEC520\\exe64\\3dec_dp520_gui_64.exe"
+    executable_environment = "ITASCA_3DEC_EXECUTABLE"
+
+class ModelPool(object):
+    """Run many Itasca models in parallel, each instance on its own FISH
+    socket port. At most size instances run at a time.
+
+    Each job is a data file. For every job a small launcher data file is
+    written which defines the FISH variable itasca_pool_port and then calls
+    the job data file, so the data file should open its socket with
+    socket.open(0, 1, itasca_pool_port). Once the instance connects,
+    task(connection, datafile) is called to exchange data over the socket
+    and its return value is the result of the job. If the instance can
+    not be launched, does not connect within the timeout or exits while
+    the task runs, the job is restarted in a new instance up to retries
+    times; other errors of the task are raised right away. Set
+    launcher_template for codes with a different FISH syntax.
+
+    >>> def task(connection, datafile):
+    ...     connection.send(1.5)
+    ...     return connection.receive()
+    >>> pool = ModelPool(FLAC3D_Connection, size=6, timeout=600)
+    >>> results = pool.map(task, ["case1.f3dat", "case2.f3dat"])
+    """
+    launcher_template = '[global itasca_pool_port = {port}]\ncall "{datafile}"\n'
+
+    def __init__(self, connection_class=FLAC3D_Connection, size=None,
+                 first_socket_id=0, retries=1, timeout=None, workdir=None):
+        """(connection_class=FLAC3D_Connection, size=None: int,
+            first_socket_id=0: int, retries=1: int, timeout=None: float,
+            workdir=None: str) -> ModelPool.
+        size defaults to the number of CPUs. timeout is passed to the
+        connections and should be set so instances which hang are
+        detected; an instance which exits before it connects is detected
+        without it.
+        Launcher files are written to workdir, by default to a temporary
+        folder which is removed when map returns.
+        """
+        self.connection_class = connection_class
+        self.size = size or os.cpu_count() or 1
+        self.first_socket_id = first_socket_id
+        self.retries = retries
+        self.timeout = timeout
+        self.workdir = workdir
+        self._socket_ids = queue.Queue()
+        for i in range(self.size):
+            self._socket_ids.put(first_socket_id + i)
+
+    def map(self, task, datafiles):
+        """(task: callable, datafiles: [str]) -> [any].
+        Run each data file and return the task results in order. Raises
+        the last error of a job which fails more than retries times.
+        """
+        workdir = self.workdir or tempfile.mkdtemp(prefix="itasca_pool_")
+        try:
+            with ThreadPoolExecutor(self.size) as executor:
+                return list(executor.map(lambda datafile:
+                                         self._run_job(task, datafile,
+                                                       workdir),
+                                         datafiles))
+        finally:
+            if self.workdir is None:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    def _run_job(self, task, datafile, workdir):
+        socket_id = self._socket_ids.get()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    return self._run_instance(socket_id, task, datafile,
+                                              workdir)
+                except ItascaConnectionError:
+                    if attempt == self.retries:
+                        raise
+        finally:
+            self._socket_ids.put(socket_id)
+
+    def _run_instance(self, socket_id, task, datafile, workdir):
+        connection = self.connection_class(socket_id, self.timeout)
+        launcher = os.path.join(workdir,
+                                "pool_{}.dat".format(connection.server.port))
+        with open(launcher, "w") as f:
+            f.write(self.launcher_template.format(
+                port=connection.server.port,
+                datafile=os.path.abspath(datafile).replace("\\", "/")))
+        connection.start(launcher)
+        try:
+            connection.connect()
+            try:
+                return task(connection, datafile)
+            except OSError as error:
+                if connection.process.poll() is None:
+                    raise
+                raise ItascaConnectionError("the instance exited during "
+                                            "the task") from error
+        finally:
+            connection.end()
+            connection.shutdown()
+
+
+# value layout of the fixed size FISH binary types, keyed by type code
+_fish_record_formats = {1: "=i4",          # int
+                        2: "=f8",          # float
+                        5: ("=f8", (2,)),  # v2
+                        6: ("=f8", (3,)),  # v3
+                        8: "=i4"}          # bool
+
+def _fish_record_dtype(type_code, int_size):
+    """(type_code: int, int_size: int) -> numpy dtype or None.
+    Structured dtype of one fixed size FISH binary record (type code and
+    value) or None if records of this type do not have a fixed size.
+    """
+    if type_code not in _fish_record_formats:
+        return None
+    value_format = _fish_record_formats[type_code]
+    value_size = np.dtype(value_format).itemsize
+    return np.dtype({"names": ["code", "value"],
+                     "formats": ["=i4", value_format],
+                     "offsets": [0, int_size],
+                     "itemsize": int_size + max(value_size, int_size)})
+
+def _fish_array_records(data, int_size):
+    """(data: numpy array, int_size: int) -> numpy array or None.
+    Pack an array into FISH binary records: 1-D int, float and bool arrays
+    give int, float and bool records, (N,2) and (N,3) arrays give v2 and v3
+    records. Returns None if the array has to be packed value by value.
+    """
+    kind = data.dtype.kind
+    if data.ndim == 1 and kind == "b":
+        type_code = 8
+    elif data.ndim == 1 and kind in "iu":
+        type_code = 1
+    elif data.ndim == 1 and kind == "f":
+        type_code = 2
+    elif data.ndim == 2 and kind in "iuf" and data.shape[1] in (2, 3):
+        type_code = 5 if data.shape[1] == 2 else 6
+    else:
+        return None
+    if type_code == 1 and data.size:
+        limits = np.iinfo(np.int32)
+        if data.min() < limits.min or data.max() > limits.max:
+            raise ValueError("integer value out of range for Fish binary write")
+    records = np.zeros(len(data), dtype=_fish_record_dtype(type_code, int_size))
+    records["code"] = type_code
+    records["value"] = data
+    return records
+
+def _run_length(codes, type_code):
+    """(codes: numpy array, type_code: int) -> int.
+    Number of leading entries of codes equal to type_code. The codes are
+    compared one by one and then in probes of doubling length so a short
+    run costs little however many records follow it.
+    """
+    for i, code in enumerate(codes[:8].tolist()):
+        if code != type_code:
+            return i
+    start, size = 8, 16
+    while start < len(codes):
+        mismatch = np.flatnonzero(codes[start:start + size] != type_code)
+        if len(mismatch):
+            return start + int(mismatch[0])
+        start += size
+        size *= 2
+    return len(codes)
 
 class FishBinaryReader(object):
     """Read structured FISH binary files.
@@ -290,8 +1054,12 @@ class FishBinaryReader(object):
     "this is a string"
     [1.0,2.0,3.0]
     """
+    _int_size = 4  # bytes used to store an int (and the type codes)
+
     def __init__(self, filename):
         """(filename: str) -> FishBinaryReader object. """
+        self.filename = filename
+        self._index = None
         self.file = open(filename, "rb")
         fishcode = self._read_int()
         assert fishcode == 178278912, "invalid FISH binary file"
@@ -326,7 +1094,7 @@ class FishBinaryReader(object):
 
         if type_code == 3:
             length = self._read_int()
-            buffer_length = 4*(1+(length-1)/4) # this may be wrong
+            buffer_length = 4*(1+(length-1)//4)
             format_string = "%is" % buffer_length
             data = self.file.read(struct.calcsize(format_string))
             return data[:length].decode("utf-8")
@@ -360,14 +1128,264 @@ class FishBinaryReader(object):
         """
         return [x for x in self]
 
-    def asarray(self):
-        """() -> numpy array.
+    def _homogeneous_view(self):
+        """() -> numpy array or None.
+        Memory map the file and return a view of the values or None if
+        the file is not made of records of a single fixed size type.
+        """
+        file_size = os.path.getsize(self.filename)
+        if file_size == self._int_size:
+            return np.empty(0)
+        if file_size < 2 * self._int_size:
+            return None
+        header = np.fromfile(self.filename, dtype="=i4", count=1,
+                             offset=self._int_size)
+        type_code = int(header[0])
+        record_dtype = _fish_record_dtype(type_code, self._int_size)
+        if record_dtype is None:
+            return None
+        if (file_size - self._int_size) % record_dtype.itemsize:
+            return None
+        records = np.memmap(self.filename, dtype=record_dtype, mode="r",
+                            offset=self._int_size)
+        if not np.all(records["code"] == type_code):
+            return None
+        if type_code == 8:  # bool
+            return records["value"] != 0
+        return records["value"]
+
+    _scan_block = 1 << 20  # bytes read at a time when scanning the file
+
+    def _iter_runs(self, n):
+        """(n: int) -> iterator of (offsets, itemsize, type_code, values).
+        Scan the file in runs of at most n same-typed values. For fixed
+        size types offsets is the file offset of the first record and
+        itemsize the record size, for strings offsets is an array with
+        the offset of each record and itemsize is 0. The file is read
+        once, in blocks of _scan_block bytes, and every run in a block is
+        decoded from it.
+        """
+        assert type(n) is int and n > 0
+        int_size = self._int_size
+        with open(self.filename, "rb") as f:
+            f.seek(int_size)  # skip the magic number
+            data, base, pos = b"", int_size, 0
+            record_dtypes = {}
+
+            def have(size):
+                """Read blocks until size bytes follow pos, False at the
+                end of the file. Only the unread tail is carried over."""
+                nonlocal data, base, pos
+                while len(data) - pos < size:
+                    block = f.read(max(self._scan_block, size))
+                    if not block:
+                        return False
+                    data, base, pos = data[pos:] + block, base + pos, 0
+                return True
+
+            while have(int_size):
+                type_code, = struct.unpack_from("i", data, pos)
+                if type_code == 3:
+                    offsets, values = [], []
+                    while len(values) < n and have(2 * int_size):
+                        code, length = struct.unpack_from(
+                            "i{}xi".format(int_size - 4), data, pos)
+                        size = 2 * int_size + 4*(1+(length-1)//4)
+                        if code != 3 or not have(size):
+                            break
+                        start = pos + 2 * int_size
+                        offsets.append(base + pos)
+                        values.append(data[start:start + length]
+                                      .decode("utf-8"))
+                        pos += size
+                    if not values:
+                        return  # truncated last record
+                    yield (np.array(offsets, dtype=np.int64), 0, type_code,
+                           np.array(values))
+                    continue
+                if type_code not in record_dtypes:
+                    record_dtypes[type_code] = _fish_record_dtype(type_code,
+                                                                  int_size)
+                record_dtype = record_dtypes[type_code]
+                if record_dtype is None:
+                    raise ValueError("unknown type code {} in FISH binary "
+                                     "file".format(type_code))
+                itemsize = record_dtype.itemsize
+                position, pieces, count = base + pos, [], 0
+                while count < n and have(itemsize):
+                    available = min(n - count, (len(data) - pos) // itemsize)
+                    records = np.frombuffer(data, dtype=record_dtype,
+                                            count=available, offset=pos)
+                    length = _run_length(records["code"], type_code)
+                    pieces.append(records["value"][:length])
+                    count += length
+                    pos += length * itemsize
+                    if length < available:
+                        break
+                if not count:
+                    return  # truncated last record
+                values = pieces[0] if len(pieces) == 1 else \
+                    np.concatenate(pieces)
+                yield position, itemsize, type_code, values
+
+    def iter_chunks(self, n):
+        """(n: int) -> iterator of numpy arrays.
+        Iterate over the fish file contents in arrays of at most n values.
+        Each array holds a run of values of one type, so a file with mixed
+        types gives a new array each time the type changes. The file is
+        read once in blocks and short runs are decoded from the block
+        already read, so at most n values and one block are held in
+        memory at a time.
+        """
+        for _, _, type_code, values in self._iter_runs(n):
+            if type_code == 8:  # bool
+                yield values != 0
+            elif type_code == 3:
+                yield values
+            else:
+                yield values.copy()
+
+    def build_index(self, sidecar=None):
+        """(sidecar=None: str) -> None.
+        Build the offset index used by len(), indexing and slicing. The
+        index stores one entry per run of fixed size records, so it is
+        small for homogeneous files. If sidecar is given the index is
+        loaded from this file when it is newer than the FISH file and was
+        built for a file of the same size by a reader with the same int
+        size, otherwise the index is built and saved to it.
+        """
+        file_size = os.path.getsize(self.filename)
+        if (sidecar is not None and os.path.exists(sidecar) and
+                os.path.getmtime(sidecar) >= os.path.getmtime(self.filename)):
+            saved = np.load(sidecar)  # an array if saved by an older version
+            if isinstance(saved, np.lib.npyio.NpzFile):
+                with saved:
+                    if (saved["int_size"] == self._int_size and
+                            saved["file_size"] == file_size):
+                        self._index = saved["index"]
+                        return
+        runs = []  # rows of (first value index, file offset, record size)
+        count = 0
+        for offsets, itemsize, _, values in self._iter_runs(1 << 20):
+            if itemsize == 0:
+                runs.extend((count + i, offset, 0)
+                            for i, offset in enumerate(offsets))
+            elif (runs and runs[-1][2] == itemsize and
+                  runs[-1][1] + (count - runs[-1][0]) * itemsize == offsets):
+                pass  # continues the previous run
+            else:
+                runs.append((count, offsets, itemsize))
+            count += len(values)
+        runs.append((count, file_size, 0))
+        self._index = np.array(runs, dtype=np.int64).reshape(-1, 3)
+        if sidecar is not None:
+            with open(sidecar, "wb") as f:
+                np.savez(f, index=self._index, int_size=self._int_size,
+                         file_size=file_size)
+
+    def _offset(self, k):
+        """(k: int) -> int.
+        File offset of value k.
+        """
+        if self._index is None:
+            self.build_index()
+        run = np.searchsorted(self._index[:, 0], k, side="right") - 1
+        first, offset, itemsize = self._index[run]
+        return int(offset + (k - first) * itemsize)
+
+    def __len__(self):
+        if self._index is None:
+            self.build_index()
+        return int(self._index[-1, 0])
+
+    def __bool__(self):
+        return True  # do not build the index to test a reader
+
+    __nonzero__ = __bool__  # alias for Python 2 support.
+
+    def _read_slice(self, k):
+        """(k: slice) -> [any].
+        Read the values of slice k. The values in a run of fixed size
+        records are read with one seek and one read.
+        """
+        start, stop, step = k.indices(len(self))
+        indices = np.arange(start, stop, step)
+        if not len(indices):
+            return []
+        if step < 0:
+            indices = indices[::-1]
+        runs = np.searchsorted(self._index[:, 0], indices, side="right") - 1
+        cuts = np.flatnonzero(np.diff(runs)) + 1
+        values = []
+        for group, run in zip(np.split(indices, cuts), np.split(runs, cuts)):
+            first, offset, itemsize = (int(x) for x in self._index[run[0]])
+            if itemsize == 0:  # a string
+                self.file.seek(offset)
+                values.append(self.read())
+                continue
+            self.file.seek(offset + (int(group[0]) - first) * itemsize)
+            data = self.file.read((int(group[-1] - group[0]) + 1) * itemsize)
+            selected = group - group[0]
+            # records of different types can share a run if they have
+            # the same size, e.g. int and bool
+            codes = np.frombuffer(data, dtype="=i4")[::itemsize // 4][selected]
+            group_values = [None] * len(group)
+            for type_code in np.unique(codes).tolist():
+                records = np.frombuffer(data, dtype=_fish_record_dtype(
+                    type_code, self._int_size))
+                where = np.flatnonzero(codes == type_code)
+                typed = records["value"][selected[where]]
+                if type_code == 8:  # bool
+                    typed = typed != 0
+                for i, value in zip(where.tolist(), typed.tolist()):
+                    group_values[i] = value
+            values.extend(group_values)
+        return values[::-1] if step < 0 else values
+
+    def __getitem__(self, k):
+        """(k: int or slice) -> any.
+        Return value k, or a list of values for a slice, without reading
+        the values before it.
+        """
+        if isinstance(k, slice):
+            position = self.file.tell()
+            try:
+                return self._read_slice(k)
+            finally:
+                self.file.seek(position)
+        length = len(self)
+        if k < 0:
+            k += length
+        if not 0 <= k < length:
+            raise IndexError("FISH binary file index out of range")
+        position = self.file.tell()
+        try:
+            self.file.seek(self._offset(k))
+            return self.read()
+        finally:
+            self.file.seek(position)
+
+    def asarray(self, copy=True):
+        """(copy=True: bool) -> numpy array.
         Return fish file contents as a numpy array. Types must be homogeneous.
+
+        Files made only of int, float, bool, v2 or v3 values are memory
+        mapped and converted without reading individual values; v2 and v3
+        values give (N,2) and (N,3) arrays. If copy is False a read-only
+        view into the memory mapped file is returned instead of an
+        in-memory copy (bool values are always copied).
         """
-        return np.array(self.aslist())
+        values = self._homogeneous_view()
+        if values is None:
+            return np.array(self.aslist())
+        if copy:
+            return np.array(values)
+        return values
 
 class UDECFishBinaryReader(FishBinaryReader):
     "Special version of FishBinarReader for files generated by UDEC."
+    _int_size = 8
+
     def _read_int(self):
         data = self.file.read(struct.calcsize('i'))
         value, = struct.unpack("i", data)
@@ -376,22 +1394,53 @@ class UDECFishBinaryReader(FishBinaryReader):
 
 class FishBinaryWriter(object):
     """Write fish binary data. data can be any iterable (array, list, etc.).
+    Supports int, float, bool, string, v2 and v3 (length two or three
+    sequences). NumPy arrays are written in a single step: 1-D int, float
+    and bool arrays give int, float and bool values, (N,2) and (N,3) arrays
+    give v2 and v3 values.
     example: FishBinaryWriter("t.fis", [12.23, 1, 33.0203, 1234.4])
     """
+    _int_size = 4  # bytes used to store an int (and the type codes)
+
     def __init__(self, filename, data):
         """(filename: str, data: iterable) -> FishBinaryWriter instance."""
+        records = None
+        if isinstance(data, np.ndarray):
+            records = _fish_array_records(data, self._int_size)
+        if records is None:
+            buff = io.BytesIO()
+            for datum in data:
+                self._write_value(buff, datum)
         with open(filename, "wb") as f:
             self._write_int(f,178278912)
-            for datum in data:
-                if type(datum) is float:
-                    self._write_int(f, 2)
-                    self._write_double(f, datum)
-                elif type(datum) is int:
-                    self._write_int(f, 1)
-                    self._write_int(f, datum)
-                else:
-                    raise TypeError(
-                        "Currently unsupported type for Fish binary write ")
+            if records is None:
+                f.write(buff.getvalue())
+            else:
+                records.tofile(f)
+
+    def _write_value(self, f, datum):
+        if isinstance(datum, (bool, np.bool_)):
+            self._write_int(f, 8)
+            self._write_int(f, int(datum))
+        elif isinstance(datum, (int, np.integer)):
+            self._write_int(f, 1)
+            self._write_int(f, int(datum))
+        elif isinstance(datum, (float, np.floating)):
+            self._write_int(f, 2)
+            self._write_double(f, datum)
+        elif isinstance(datum, str):
+            data = datum.encode("utf-8")
+            self._write_int(f, 3)
+            self._write_int(f, len(data))
+            f.write(data.ljust(4*(1+(len(data)-1)//4), b"\0"))
+        elif (isinstance(datum, (list, tuple, np.ndarray))
+              and len(datum) in (2, 3)):
+            self._write_int(f, 5 if len(datum) == 2 else 6)
+            for x in datum:
+                self._write_double(f, float(x))
+        else:
+            raise TypeError(
+                "Currently unsupported type for Fish binary write ")
 
     def _write_int(self, f, datum):
         f.write(struct.pack("i", datum))
@@ -401,6 +1450,8 @@ class FishBinaryWriter(object):
 
 class UDECFishBinaryWriter(FishBinaryWriter):
     """Fish Binary writer for UDEC (which has 8 byte ints)"""
+    _int_size = 8
+
     def _write_int(self, f, datum):
         f.write(struct.pack("i", datum))
         f.write(struct.pack("i", 0))
@@ -409,149 +1460,709 @@ class UDECFishBinaryWriter(FishBinaryWriter):
 # p2pLink below here
 ######################################################################
 
-class _fileSocketAdapter(object):
-    """This object is an adapter which allows np.save and np.load to write 
-    directly to the socket. This object appears to be a file object but does
-    reading and writing over a socket connection.
-    """
-    def __init__(self, s):
-        """(s: _baseSocket) -> None.
-        Constructor.
-        """
-        self.s=s
-        self.first = True
-        self.offset = 0
-
-    def write(self, data):
-        """(data: str) -> None.
-        Write bytes to stream.
-        """
-        self.s._sendall(data)
-
-    def read(self, byte_count):
-        """(byte_count: int) -> str.
-        Read bytes from stream.
-        """
-        bytes_read = 0
-        data = b''
-        # this is a hack because we have to support seek for np.load
-        if self.offset:
-            assert self.offset <= byte_count
-            assert self.offset==6
-            assert not self.first
-            data += self.buff
-            bytes_read += self.offset
-            self.offset = 0
-
-        while bytes_read < byte_count:
-            self.s.wait_for_data()
-            data_in = self.s.conn.recv(min(4096, byte_count-bytes_read))
-            data = b"".join([data, data_in])
-            bytes_read += len(data_in)
-
-        # this is a hack because we have to support seek for np.load
-        if self.first and byte_count==6:
-            self.buff = data
-            self.first = False
-        return data
+def _array_bytes(value):
+    """(value: numpy array) -> numpy array.
+    Flat uint8 view of the memory of a C or Fortran contiguous array, in
+    the element order used by the .npy format.
+    """
+    if not value.flags.c_contiguous:
+        value = value.T  # Fortran order, the transpose is C contiguous
+    return value.reshape(-1).view(np.uint8)
+
+_structure_alignment = 16  # of the array buffers in a structured message
+_small_buffer = 65536  # smaller array buffers are copied into one frame
+
+def _structure_tree(value, buffers, offset):
+    """(value: any, buffers: [bytes-like], offset: [int]) -> any.
+    JSON compatible description of a structured message value. Lists and
+    scalars map to themselves, tuples, dicts, NumPy arrays and NumPy
+    scalars to single key objects: {"t": items}, {"d": [[key, value]]},
+    {"a": [offset, descr, shape, fortran_order]} and {"g": [...]}. The
+    array memory is appended to buffers; offset holds the length of the
+    data area so far.
+    """
+    if value is None or type(value) in (bool, int, float, str):
+        return value
+    elif type(value) == list:
+        return [_structure_tree(item, buffers, offset) for item in value]
+    elif type(value) == tuple:
+        return {"t": [_structure_tree(item, buffers, offset)
+                      for item in value]}
+    elif type(value) == dict:
+        return {"d": [[_structure_tree(key, buffers, offset),
+                       _structure_tree(item, buffers, offset)]
+                      for key, item in value.items()]}
+    elif isinstance(value, (np.ndarray, np.generic)):
+        tag = "a" if isinstance(value, np.ndarray) else "g"
+        value = np.asarray(value)
+        if value.dtype.hasobject:
+            raise ValueError("NumPy arrays of Python objects can not be sent")
+        if not (value.flags.c_contiguous or value.flags.f_contiguous):
+            value = np.ascontiguousarray(value)
+        start = -offset[0] % _structure_alignment + offset[0]
+        if start > offset[0]:
+            buffers.append(bytes(start - offset[0]))
+        buffers.append(_array_bytes(value))
+        offset[0] = start + value.nbytes
+        fortran_order = value.flags.f_contiguous and not value.flags.c_contiguous
+        return {tag: [start, np.lib.format.dtype_to_descr(value.dtype),
+                      list(value.shape), fortran_order]}
+    raise ValueError("can not send values of type {}".format(type(value)))
+
+def _descr_from_json(descr):
+    """(descr: str or list) -> str or list.
+    Restore the tuples of a structured dtype description read from JSON.
+    """
+    if isinstance(descr, str):
+        return descr
+    return [tuple([field[0], _descr_from_json(field[1])] +
+                  [tuple(item) for item in field[2:]]) for field in descr]
+
+def _structure_value(node, data):
+    """(node: any, data: uint8 array) -> any.
+    Rebuild a value from its _structure_tree description. Arrays are views
+    of data.
+    """
+    if type(node) == list:
+        return [_structure_value(item, data) for item in node]
+    elif type(node) != dict:
+        return node
+    (tag, body), = node.items()
+    if tag == "t":
+        return tuple(_structure_value(item, data) for item in body)
+    elif tag == "d":
+        return {_structure_value(key, data): _structure_value(item, data)
+                for key, item in body}
+    start, descr, shape, fortran_order = body
+    dtype = np.lib.format.descr_to_dtype(_descr_from_json(descr))
+    size = int(np.prod(shape)) * dtype.itemsize
+    if dtype.itemsize:
+        value = data[start:start + size].view(dtype)
+    else:
+        value = np.empty(int(np.prod(shape)), dtype=dtype)  # no memory
+    value = value.reshape(shape, order="F" if fortran_order else "C")
+    return value[()] if tag == "g" else value
+
+def _structure_frames(value):
+    """(value: any) -> [bytes-like].
+    Encode nested lists, tuples and dicts of scalars, strings and NumPy
+    arrays as a structured message: the type code, a JSON description of
+    the structure and the array memory, aligned and not copied for large
+    arrays.
+    """
+    buffers = []
+    offset = [0]
+    tree = json.dumps(_structure_tree(value, buffers, offset)).encode("utf-8")
+    frames = [bytearray(struct.pack("ii", 9, len(tree)) + tree +
+                        struct.pack("q", offset[0]))]
+    for buffer in buffers:
+        if memoryview(buffer).nbytes < _small_buffer:
+            frames[-1] += memoryview(buffer)
+        else:
+            frames.append(buffer)
+            frames.append(bytearray())
+    return [frame for frame in frames if len(frame)]
+
+def _p2p_frames(value):
+    """(value: any) -> [bytes-like].
+    Encode value as a p2p link message. Returns the buffers to be written
+    to the connection in order. NumPy arrays are sent as the type code and
+    a .npy format header (dtype, shape and order) followed by the array
+    memory, which is not copied if the array is contiguous. Tuples, lists
+    other than numeric v2 and v3 values and dicts which can not be sent as
+    JSON are sent as structured messages.
+    """
+    if type(value) in (int, float):
+        return [_fish_frame(value)]
+
+    elif type(value) == list and len(value) in (2, 3) and \
+            all(isinstance(item, (int, float, np.integer, np.floating))
+                for item in value):
+        return [_fish_frame(value)]
+
+    elif type(value) == str:
+        # link peers have always padded strings with three bytes
+        data = value.encode("utf-8")
+        return [struct.pack("ii", 3, len(data)) + data + b"   "]
+
+    elif type(value) == np.ndarray:
+        if value.dtype.hasobject:
+            raise ValueError("NumPy arrays of Python objects can not be sent")
+        if not (value.flags.c_contiguous or value.flags.f_contiguous):
+            value = np.ascontiguousarray(value)
+        header = io.BytesIO()
+        header.write(struct.pack("i", 7))
+        header_data = np.lib.format.header_data_from_array_1_0(value)
+        try:
+            np.lib.format.write_array_header_1_0(header, header_data)
+        except ValueError:  # header too long for format version 1.0
+            header.seek(4)
+            header.truncate()
+            np.lib.format.write_array_header_2_0(header, header_data)
+        return [header.getvalue(), _array_bytes(value)]
+
+    elif type(value) == dict:
+        try:
+            data = json.dumps(value).encode("utf-8")
+        except (TypeError, ValueError):
+            return _structure_frames(value)
+        return [struct.pack("ii", 8, len(data)) + data]
 
-    def readline(self):
-        """() -> str.
-        Read a line from the stream."""
-        data=''
+    elif type(value) in (list, tuple):
+        return _structure_frames(value)
+
+    raise Exception("unknown type in send_data")
+
+def _zlib_decompress(data, raw_length):
+    """(data: bytes-like, raw_length: int) -> bytes.
+    Decompress zlib data into at most raw_length bytes.
+    """
+    decompressor = zlib.decompressobj()
+    raw = decompressor.decompress(data, raw_length or 1)
+    if decompressor.unconsumed_tail:
+        raise ValueError("compressed message longer than its header")
+    return raw
+
+def _zstd_decompress(data, raw_length):
+    """(data: bytes-like, raw_length: int) -> bytes.
+    Decompress a zstd frame into at most raw_length bytes.
+    """
+    if zstandard.frame_content_size(data) > raw_length:
+        raise ValueError("compressed message longer than its header")
+    return zstandard.ZstdDecompressor().decompress(
+        data, max_output_size=raw_length)
+
+def _lz4_decompress(data, raw_length):
+    """(data: bytes-like, raw_length: int) -> bytes.
+    Decompress an lz4 frame into at most raw_length bytes.
+    """
+    decompressor = lz4.frame.LZ4FrameDecompressor()
+    raw = decompressor.decompress(data, max_length=raw_length)
+    if not decompressor.eof and not decompressor.needs_input:
+        raise ValueError("compressed message longer than its header")
+    return raw
+
+# p2p link compression codecs: name -> (compress, decompress). decompress
+# takes the data and the decompressed length given by the message header
+# and never returns more than that.
+_p2p_codecs = {"zlib": (lambda data: zlib.compress(data, 1),
+                        _zlib_decompress)}
+if zstandard is not None:
+    _p2p_codecs["zstd"] = (
+        lambda data: zstandard.ZstdCompressor(level=1).compress(data),
+        _zstd_decompress)
+if lz4 is not None:
+    _p2p_codecs["lz4"] = (lz4.frame.compress, _lz4_decompress)
+_p2p_codec_preference = [name for name in ("zstd", "lz4", "zlib")
+                         if name in _p2p_codecs]
+_p2p_compressible = (7, 8, 9)  # message types worth compressing
+
+def _p2p_codec_offer(compression):
+    """(compression: bool, str or [str]) -> [str] or None.
+    The codecs a link client offers in its handshake, in order of
+    preference, or None if the client does not ask for compression.
+    """
+    if not compression:
+        return None
+    if compression is True:
+        return _p2p_codec_preference
+    if isinstance(compression, str):
+        compression = [compression]
+    offer = [name for name in compression if name in _p2p_codecs]
+    if not offer:
+        raise ValueError("compression codecs {} are not available, use one "
+                         "of {}".format(compression, _p2p_codec_preference))
+    return offer
+
+def _p2p_codec_choice(offer, compression):
+    """(offer: str, compression: None, bool, str or [str]) -> str or None.
+    The codec a link server picks from the comma separated offer of a
+    client. compression None or True accepts any available codec, False
+    refuses compression.
+    """
+    if compression is False:
+        return None
+    allowed = _p2p_codec_offer(True if compression is None else compression)
+    for name in offer.split(","):
+        if name in allowed:
+            return name
+    return None
+
+def _shuffle(data, itemsize):
+    """(data: bytes-like, itemsize: int) -> bytes.
+    Byte shuffle: the first bytes of all the items, then the second bytes
+    and so on. Neighbouring float values share their sign and exponent
+    bytes, which then compress much better.
+    """
+    values = np.frombuffer(data, dtype=np.uint8).reshape(-1, itemsize)
+    return values.T.tobytes()
+
+def _unshuffle(data, itemsize, out):
+    """(data: bytes-like, itemsize: int, out: uint8 array) -> None.
+    Undo _shuffle, writing the result into out.
+    """
+    values = np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1)
+    out.reshape(-1, itemsize)[:] = values.T
+
+def _p2p_encode(value, codec=None, threshold=0):
+    """(value: any, codec=None: str, threshold=0: int) -> [bytes-like].
+    Encode value as a p2p link message, compressed with codec if it is an
+    array or dict message of at least threshold bytes which compresses.
+    The data of float arrays is byte shuffled before compression.
+    """
+    frames = _p2p_frames(value)
+    if codec is None:
+        return frames
+    type_code, = struct.unpack("i", bytes(frames[0][:4]))
+    size = sum(memoryview(frame).nbytes for frame in frames)
+    if type_code not in _p2p_compressible or size < threshold:
+        return frames
+    shuffle = 0
+    data = frames
+    if type_code == 7 and value.dtype.kind in "fc" and value.itemsize > 1:
+        shuffle = value.itemsize
+        data = frames[:-1] + [_shuffle(frames[-1], shuffle)]
+    raw = b"".join(data)
+    data = _p2p_codecs[codec][0](raw)
+    if len(data) >= len(raw):
+        return frames
+    return [struct.pack("=iiqq", 10, shuffle, len(raw), len(data)), data]
+
+def _p2p_coalesce(frames):
+    """(frames: [buffer]) -> [buffer].
+    Join the frames of a message smaller than _small_buffer so it goes out
+    in one socket write; a small header written on its own would wait for
+    the delayed acknowledgement of the peer.
+    """
+    if len(frames) > 1 and \
+       sum(memoryview(frame).nbytes for frame in frames) < _small_buffer:
+        return [b"".join(frames)]
+    return frames
+
+_created_segments = set()  # names of the segments created by this process
+
+def _create_segment(size):
+    """(size: int) -> SharedMemory. Create a shared memory segment."""
+    segment = SharedMemory(create=True, size=size)
+    _created_segments.add(segment.name)
+    return segment
+
+def _free_segment(segment):
+    """(segment: SharedMemory) -> None.
+    Close and remove a segment made by _create_segment.
+    """
+    _created_segments.discard(segment.name)
+    segment.close()
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+
+def _attach_segment(name):
+    """(name: str) -> SharedMemory.
+    Open an existing shared memory segment without handing it to the
+    resource tracker of this process; the segment belongs to the peer
+    which created it.
+    """
+    try:
+        return SharedMemory(name, track=False)
+    except TypeError:  # before Python 3.13 attaching registers the segment
+        segment = SharedMemory(name)
+        # the tracker keeps one entry per name and process, which stays
+        # with the creator if both ends of the link are in this process
+        if os.name == "posix" and name not in _created_segments:
+            resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+class _sharedSegment(object):
+    """Shared memory segment of a received message. NumPy views of the
+    segment keep this object as their base. When the last of them is gone
+    the segment is closed and its name put on the released queue of the
+    link, which tells the peer it can use the segment again.
+    """
+    def __init__(self, name, size, released):
+        """(name: str, size: int, released: deque) -> _sharedSegment."""
+        self.name = name
+        self._released = released
+        self._segment = _attach_segment(name)
+        address = ctypes.addressof(ctypes.c_char.from_buffer(
+            self._segment.buf))
+        self.__array_interface__ = {"version": 3, "shape": (size,),
+                                    "typestr": "|u1",
+                                    "data": (address, False)}
+
+    def __del__(self):
+        if hasattr(self, "_segment"):
+            self._segment.close()
+            self._released.append(self.name)
+
+def _probe_segment(name, token):
+    """(name: str, token: str) -> bool.
+    True if the shared memory segment name can be opened and starts with
+    the hex token, that is if the peer which created it runs on this
+    machine.
+    """
+    if SharedMemory is None:
+        return False
+    try:
+        segment = _attach_segment(name)
+    except (OSError, ValueError):
+        return False
+    try:
+        return bytes(segment.buf[:16]).hex() == token
+    finally:
+        segment.close()
+
+def _p2p_decoder(codec=None):
+    """(codec=None: str) -> generator.
+    Decode one p2p link message independently of how the bytes are
+    received. The generator yields either the number of bytes it needs
+    next, and is sent those bytes, or a flat uint8 array which must be
+    filled from the connection (it is then sent None). The decoded value
+    is the generator return value. codec is the compression codec of the
+    link, if any.
+    """
+    type_code, = struct.unpack("i", (yield 4))
+
+    if type_code == 1:     # int
+        value, = struct.unpack("i", (yield 4))
+        return value
+
+    elif type_code == 2:   # float
+        value, = struct.unpack("d", (yield 8))
+        return value
+
+    elif type_code == 3:   # string
+        length, = struct.unpack("i", (yield 4))
+        data = yield length + 3
+        return bytes(data[:length]).decode("utf-8")
+
+    elif type_code == 5:   # V2
+        return list(struct.unpack("dd", (yield 16)))
+
+    elif type_code == 6:   # V3
+        return list(struct.unpack("ddd", (yield 24)))
+
+    elif type_code == 7:  # NumPy array
+        magic = yield 8
+        assert magic[:6] == b"\x93NUMPY", "bad NumPy array header"
+        major_version = magic[6]
+        length_format = "<H" if major_version == 1 else "<I"
+        length, = struct.unpack(length_format,
+                                (yield struct.calcsize(length_format)))
+        encoding = "utf8" if major_version >= 3 else "latin1"
+        header = ast.literal_eval(bytes((yield length)).decode(encoding))
+        dtype = np.lib.format.descr_to_dtype(header["descr"])
+        if dtype.hasobject:
+            raise ValueError("NumPy arrays of Python objects can not be read")
+        order = "F" if header["fortran_order"] else "C"
+        value = np.empty(header["shape"], dtype=dtype, order=order)
+        yield _array_bytes(value)
+        return value
+
+    elif type_code == 8: # python dict
+        length, = struct.unpack("i", (yield 4))
+        return json.loads((yield length))
+
+    elif type_code == 9:  # structured message
+        length, = struct.unpack("i", (yield 4))
+        tree = json.loads((yield length))
+        size, = struct.unpack("q", (yield 8))
+        data = np.empty(size, dtype=np.uint8)
+        if size:
+            yield data
+        return _structure_value(tree, data)
+
+    elif type_code == 10:  # compressed message
+        shuffle, raw_length, length = struct.unpack("=iqq", (yield 20))
+        if raw_length < 0 or length < 0:
+            raise ValueError("bad compressed message header")
+        data = yield length  # read the message even if it is refused
+        if codec is None:
+            raise ValueError("compressed message on a link without "
+                             "compression")
+        raw = memoryview(_p2p_codecs[codec][1](data, raw_length))
+        assert len(raw) == raw_length, "bad compressed message length"
+        # decode the original message from the decompressed bytes
+        decoder = _p2p_decoder()
+        request = next(decoder)
+        offset = 0
         while True:
-            self.s.wait_for_data()
-            byte = self.s.conn.recv(1)
-            if byte == '\n':
-                return data
+            if isinstance(request, np.ndarray):
+                data = raw[offset:offset + len(request)]
+                if shuffle:
+                    _unshuffle(data, shuffle, request)
+                else:
+                    request[:] = np.frombuffer(data, dtype=np.uint8)
+                offset += len(request)
+                data = None
             else:
-                data += byte
-        return data
+                data = bytes(raw[offset:offset + request])
+                offset += request
+            try:
+                request = decoder.send(data)
+            except StopIteration as stop:
+                return stop.value
 
-    def seek(self, a0, a1):
-        """(offset: int, mode: int) -> None.
-        This is a hack to support np.load and np.save talking over sockets.
-        """
-        assert a1 == 1
-        assert a0 == -6
-        assert len(self.buff)==6
-        self.offset = 6
+    elif type_code == 11:  # structured message in shared memory
+        length, = struct.unpack("i", (yield 4))
+        return json.loads((yield length))  # opened by the link
+
+    elif type_code == 12:  # shared memory segment release
+        length, = struct.unpack("i", (yield 4))
+        return bytes((yield length)).decode("utf-8")
+
+    assert False, "Data read type error"
 
-class _socketBase(object):
+class _socketBase(_statsBase):
     code = 12345
+    compression_code = 12346  # handshake code followed by a codec offer
+    options_code = 12347      # handshake code followed by a dict of options
+    timeout = None  # seconds to wait for the peer, None waits forever
+    compression = None
+    codec = None        # compression codec agreed in the handshake
+    compress = False    # compress messages by default
+    compress_threshold = 16384  # smaller messages are never compressed
+    shared_memory = None
+    shared_memory_threshold = 1 << 20  # smaller messages use the socket
+    shared_memory_pool = 4  # released segments kept for reuse
+    shared_memory_segments = 16  # segments the peer may hold at once
+    _segments = None    # name -> SharedMemory sent and not yet released
+    _released = None    # names of received segments no longer in use
+    _write_wait = 0.0   # seconds blocked by the current send, with stats
+
+    def _offer_compression(self):
+        """() -> None.
+        Client side of the handshake: send the handshake code, and the
+        codecs of the compression option if it is set, then read the
+        codec picked by the server. A shared memory request goes with the
+        options handshake.
+        """
+        offer = _p2p_codec_offer(self.compression)
+        if self.shared_memory:
+            self._offer_options(offer)
+            return
+        if offer is None:
+            self.send_data(_socketBase.code)
+            return
+        self.send_data(_socketBase.compression_code)
+        self.send_data(",".join(offer))
+        reply = self.read_data()
+        self.codec = None if reply == "none" else reply
+        self.compress = self.codec is not None
+
+    def _accept_compression(self, offer):
+        """(offer: str) -> None.
+        Server side of the handshake: pick a codec from the client offer
+        and send it back.
+        """
+        self.codec = _p2p_codec_choice(offer, self.compression)
+        self.compress = self.codec is not None
+        self.send_data(self.codec or "none")
+
+    def _offer_options(self, offer):
+        """(offer: [str] or None) -> None.
+        Client side of the options handshake: offer the codecs and shared
+        memory. The server can only open the probe segment if it runs on
+        this machine.
+        """
+        probe = _create_segment(16)
+        try:
+            token = os.urandom(16)
+            probe.buf[:16] = token
+            self.send_data(_socketBase.options_code)
+            self.send_data({"compression": offer,
+                            "shared_memory": probe.name,
+                            "token": token.hex()})
+            reply = self.read_data()
+        finally:
+            _free_segment(probe)
+        self.codec = reply["codec"]
+        self.compress = self.codec is not None
+        if reply["shared_memory"]:
+            self._share()
+
+    def _accept_options(self, options):
+        """(options: dict) -> None.
+        Server side of the options handshake: pick a codec and use shared
+        memory if the client asks for it, it is not refused by the
+        shared_memory option and the client runs on this machine.
+        """
+        offer = options["compression"]
+        self.codec = (None if offer is None else
+                      _p2p_codec_choice(",".join(offer), self.compression))
+        self.compress = self.codec is not None
+        shared = (options["shared_memory"] is not None and
+                  self.shared_memory is not False and
+                  _probe_segment(options["shared_memory"], options["token"]))
+        if shared:
+            self._share()
+        self.send_data({"codec": self.codec, "shared_memory": shared})
+
+    def _share(self):
+        """() -> None. Use shared memory for large messages."""
+        self._segments = {}
+        self._free_segments = []
+        self._released = collections.deque()
+
+    def _shared_frames(self, value):
+        """(value: any) -> [bytes] or None.
+        Copy the arrays of value into a shared memory segment and return
+        the message describing it, or None if value holds less than
+        shared_memory_threshold bytes of arrays. A segment released by the
+        peer is used again if it is large enough but not more than twice
+        the size, its pages are already mapped. None is also returned
+        while the peer holds shared_memory_segments segments.
+        """
+        if type(value) not in (np.ndarray, list, tuple, dict):
+            return None
+        buffers, offset = [], [0]
+        try:
+            tree = _structure_tree(value, buffers, offset)
+        except ValueError:
+            return None
+        size = offset[0]
+        if size < self.shared_memory_threshold:
+            return None
+        self._collect_releases()
+        if len(self._segments) >= self.shared_memory_segments:
+            return None  # the peer still holds too many, use the socket
+        for segment in self._free_segments:
+            if size <= segment.size <= 2 * size:
+                self._free_segments.remove(segment)
+                break
+        else:
+            segment = _create_segment(size)
+        data = np.frombuffer(segment.buf, dtype=np.uint8, count=size)
+        position = 0
+        for buffer in buffers:
+            buffer = np.frombuffer(buffer, dtype=np.uint8)
+            data[position:position + len(buffer)] = buffer
+            position += len(buffer)
+        del data  # release the view of segment.buf
+        self._segments[segment.name] = segment
+        header = json.dumps({"name": segment.name, "size": size,
+                             "tree": tree}).encode("utf-8")
+        return [struct.pack("ii", 11, len(header)) + header]
+
+    def _release_segment(self, name):
+        """(name: str) -> None.
+        Take back a segment the peer is done with, keeping the last
+        shared_memory_pool of them for reuse.
+        """
+        self._free_segments.append(self._segments.pop(name))
+        if len(self._free_segments) > self.shared_memory_pool:
+            _free_segment(self._free_segments.pop(0))
+
+    def _send_releases(self):
+        """() -> None.
+        Tell the peer about the received segments no longer in use.
+        """
+        while self._released:
+            data = self._released.popleft().encode("utf-8")
+            self._sendall(struct.pack("ii", 12, len(data)) + data)
+
+    def _collect_releases(self):
+        """() -> None.
+        Take back the segments whose release notices are already here,
+        without blocking, so a link which sends and never reads does not
+        keep them all. Only notices at the front of the incoming data can
+        be handled.
+        """
+        buff = self._receive_buffer
+        while self._segments:
+            needed = 8
+            if len(buff) >= 4:
+                with buff.peek(4) as header:
+                    type_code, = struct.unpack("i", header)
+                if type_code != 12:
+                    return
+                if len(buff) >= 8:
+                    with buff.peek(8) as header:
+                        needed += struct.unpack("ii", header)[1]
+            if len(buff) >= needed:
+                self._release_segment(self._read_message()[1])
+                continue
+            if not select.select([self.conn], [], [], 0)[0]:
+                return
+            try:
+                buff.receive_available(needed)
+            except ConnectionError:
+                return
 
     def _sendall(self, data):
         """(bytes: str) -> None.
         Low level socket send, do not call this function directly.
         """
-        nbytes = len(data)
-        sent = 0
-        while sent < nbytes:
-            self._wait_for_write()
-            sent += self.conn.send(data[sent:])
+        with memoryview(data) as view:
+            view = view.cast("B")
+            sent = 0
+            while sent < len(view):
+                self._wait_for_write()
+                sent += self.conn.send(view[sent:])
 
     def _wait_for_write(self):
         """() -> None.
         Block until socket is write ready but let thread scheduler run.
         """
-        while True:
-            _, write_ready, _ = select.select([], [self.conn], [], 0.0)
-            if write_ready: break
-            else: time.sleep(1e-8)
-
-    def send_data(self, value):
-        """(value: any) -> None.
-        Send value. value must be a number, a string or a NumPy array.
-        """
-        if type(value) == int:
-            self._sendall(struct.pack("i", 1))
-            self._sendall(struct.pack("i", value))
-
-        elif type(value) == float:
-            self._sendall(struct.pack("i", 2))
-            self._sendall(struct.pack("d", value))
-
-        elif type(value) == list and len(value)==2:
-            float_list = [float(x) for x in value]
-            self._sendall(struct.pack("i", 5))
-            self._sendall(struct.pack("dd", float_list[0], float_list[1]))
-
-        elif type(value) == list and len(value)==3:
-            float_list = [float(x) for x in value]
-            self._sendall(struct.pack("i", 6))
-            self._sendall(struct.pack("ddd", float_list[0],
-                                          float_list[1], float_list[2]))
-
-        elif type(value) == str:
-            length = len(value)
-            self._sendall(struct.pack("ii", 3, length))
-            buffer_length = 4*(1+(length-1)/4)
-            format_string = "%is" % buffer_length
-            value += " "*int(buffer_length - length)
-            self._sendall(struct.pack(format_string, value.encode("utf-8")))
-
-        elif type(value) == np.ndarray:
-            self._sendall(struct.pack("i", 7))
-            np.save(_fileSocketAdapter(self), value)
-
-        elif type(value) == dict:
-            length = len(value)
-            data = json.dumps(value).encode("utf-8")
-            self._sendall(struct.pack("ii", 8, len(data)))
-            self._sendall(data)
-
-        else:
-            raise Exception("unknown type in send_data")
+        if self._stats is None:
+            _wait_for_socket(self.conn, write=True, timeout=self.timeout)
+            return
+        start = time.perf_counter()
+        try:
+            _wait_for_socket(self.conn, write=True, timeout=self.timeout)
+        finally:
+            self._write_wait += time.perf_counter() - start
+
+    def send_data(self, value, compress=None):
+        """(value: any, compress=None: bool) -> None.
+        Send value. value must be a number, a string, a length two or three
+        list, a dict or a NumPy array. Arrays and dicts are compressed if a
+        codec was agreed in the handshake and compress (by default the
+        compress attribute of the link) is True, unless they are smaller
+        than compress_threshold bytes. On a shared memory link, arrays (or
+        lists, tuples and dicts of them) of shared_memory_threshold bytes
+        or more are copied into a shared memory segment instead and only
+        its description goes over the socket. The peer reads them as NumPy
+        views of the segment, without another copy; the segment can be
+        used again by this end once those views are gone. While the peer
+        keeps the views of shared_memory_segments messages, later messages
+        go over the socket, so at most that many segments are alive.
+        """
+        if compress is None:
+            compress = self.compress
+        if self._released:
+            self._send_releases()
+        start = time.perf_counter() if self._stats is not None else None
+        frames = None
+        if self._segments is not None:
+            frames = self._shared_frames(value)
+        if frames is None:
+            frames = _p2p_coalesce(_p2p_encode(
+                value, self.codec if compress else None,
+                self.compress_threshold))
+        if self._stats is None:
+            for frame in frames:
+                self._sendall(frame)
+            return
+        encoded = time.perf_counter()
+        self._write_wait = 0.0
+        for frame in frames:
+            self._sendall(frame)
+        type_code, = struct.unpack_from("i", frames[0])
+        byte_count = sum(memoryview(frame).nbytes for frame in frames)
+        self._stats.record_send({type_code: (1, byte_count)}, start,
+                                encoded, self._write_wait,
+                                time.perf_counter())
 
     def wait_for_data(self):
         """() -> None.
         Block until data is available. This call allows the Python thread
-        scheduler to run.
+        scheduler to run. Raises TimeoutError if no data arrives within the
+        timeout.
         """
-        while True:
-            input_ready, _, _ = select.select([self.conn],[],[], 0.0)
-            if input_ready: return
-            else: time.sleep(1e-8)
+        if not len(self._receive_buffer):
+            _wait_for_socket(self.conn, timeout=self.timeout)
 
     def read_type(self, type_string, array_bytes=None):
         """(type: str) -> any.
@@ -563,67 +2174,69 @@ class _socketBase(object):
         else:
             byte_count = array_bytes
 
-        bytes_read = 0
-        data = b''
-        while bytes_read < byte_count:
-            self.wait_for_data()
-            data_in = self.conn.recv(min(4096,byte_count - bytes_read))
-            data = b"".join([data, data_in])
-            bytes_read += len(data_in)
-        assert len(data)==byte_count, "bad packet data"
-        return data
+        return self._receive_buffer.read(byte_count, self.timeout)
 
     def read_data(self):
         """() -> any.
         Read the next item from the socket connection.
         """
-        raw_data = self.read_type("i")
-        type_code, = struct.unpack("i", raw_data)
-
-        if type_code == 1:     # int
-            raw_data = self.read_type("i")
-            value, = struct.unpack("i", raw_data)
-            return value
-
-        elif type_code == 2:   # float
-            raw_data = self.read_type("d")
-            value, = struct.unpack("d", raw_data)
-            return value
-
-        elif type_code == 3:   # string
-            length_data = self.read_type("i")
-            length, = struct.unpack("i", length_data)
-            buffer_length = (4*(1+(length-1)/4))
-            format_string = "%is" % buffer_length
-            data = self.read_type(format_string)
-            return data[:length].decode("utf-8")
-
-        elif type_code == 5:   # V2
-            raw_data = self.read_type("dd")
-            value0, value1 = struct.unpack("dd", raw_data)
-            return [value0, value1]
-
-        elif type_code == 6:   # V3
-            raw_data = self.read_type("ddd")
-            value0, value1, value3 = struct.unpack("ddd", raw_data)
-            return [value0, value1, value3]
-
-        elif type_code == 7:  # NumPy array:
-            a = np.load(_fileSocketAdapter(self))
-            return a
-
-        elif type_code == 8: # python dict
-            raw_data = self.read_type("i")
-            length, = struct.unpack("i", raw_data)
-            data = self.read_type(None, length)
-            return json.loads(data)
+        if self._stats is None:
+            return self._read_value()[1]
+        buff = self._receive_buffer
+        start, waited, received = time.perf_counter(), buff.waited, \
+            buff.received
+        type_code, value = self._read_value()
+        self._stats.record_receive({type_code: (1, buff.received - received)},
+                                   start, buff.waited - waited,
+                                   time.perf_counter())
+        return value
 
-        assert False, "Data read type error"
+    def _read_value(self):
+        """() -> (int, any).
+        Read the next message, returns its type code and value. Shared
+        memory release notices are exchanged on the way.
+        """
+        if self._released:
+            self._send_releases()
+        while True:
+            type_code, value = self._read_message()
+            if type_code == 12:
+                self._release_segment(value)
+                continue
+            if type_code == 11:
+                segment = _sharedSegment(value["name"], value["size"],
+                                         self._released)
+                value = _structure_value(value["tree"], np.asarray(segment))
+            return type_code, value
+
+    def _read_message(self):
+        """() -> (int, any).
+        Read and decode one message.
+        """
+        decoder = _p2p_decoder(self.codec)
+        request = next(decoder)
+        data = self.read_type(None, request)
+        type_code, = struct.unpack("i", data)
+        while True:
+            try:
+                request = decoder.send(data)
+            except StopIteration as stop:
+                return type_code, stop.value
+            if isinstance(request, np.ndarray):
+                self._receive_buffer.read_into(request, self.timeout)
+                data = None
+            else:
+                data = self.read_type(None, request)
 
     def close(self):
         """() -> None.
         Close the active socket connection.
         """
+        if self._segments is not None:
+            for segment in (list(self._segments.values()) +
+                            self._free_segments):
+                _free_segment(segment)
+            self._segments, self._free_segments = {}, []
         if hasattr(self, "conn"):
             self.conn.shutdown(socket.SHUT_RDWR)
             self.conn.close()
@@ -642,11 +2255,23 @@ class _socketBase(object):
 class p2pLinkServer(_socketBase):
     """Python to Python socket link server. Send and receive numbers, strings
     and NumPy arrays between Python instances."""
-    def __init__(self, port=5000):
-        """(port=5000) -> None. Create a Python to Python socket server. Call
-        the start() method to open the connection."""
+    def __init__(self, port=5000, timeout=None, compression=None,
+                 shared_memory=None):
+        """(port=5000, timeout=None, compression=None, shared_memory=None)
+        -> None. Create a
+        Python to Python socket server. Call the start() method to open the
+        connection. timeout is the number of seconds to wait for the peer
+        before TimeoutError is raised, None waits forever. Compression is
+        used if the client asks for it, unless compression is False; it
+        can also be a codec name or list of names to accept. Likewise
+        shared memory is used if a client on the same machine asks for it,
+        unless shared_memory is False."""
         assert type(port) is int
         self.port = port
+        self.timeout = timeout
+        self.compression = compression
+        self.shared_memory = shared_memory
+        _p2p_codec_offer(compression)  # ValueError for unavailable codecs
 
     def start(self):
         """() -> None. Open the socket connection. Blocks but allows the
@@ -656,33 +2281,628 @@ class p2pLinkServer(_socketBase):
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind(("", self.port))
         self.socket.listen(1)
-
-        while True:
-            connected, _, _ = select.select([self.socket], [], [], 0.0)
-            if connected:
-                break
-
-            else:
-                time.sleep(1e-8)
-
+        _wait_for_socket(self.socket, timeout=self.timeout)
         self.conn, addr = self.socket.accept()
-        assert self.read_data() == _socketBase.code
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._receive_buffer = _socketReceiveBuffer(self.conn)
+        code = self.read_data()
+        if code == _socketBase.compression_code:
+            self._accept_compression(self.read_data())
+        elif code == _socketBase.options_code:
+            self._accept_options(self.read_data())
+        else:
+            assert code == _socketBase.code
         print("got code")
 
 class p2pLinkClient(_socketBase):
     """Python to Python socket link client. Send and receive numbers, strings
     and NumPy arrays between Python instances."""
-    def __init__(self,port=5000):
-        """(port=5000) -> None. Create a Python to Python socket link client.
-        Call the start() method to open the connection.""
+    def __init__(self,port=5000, timeout=None, compression=None,
+                 shared_memory=False):
+        """(port=5000, timeout=None, compression=None, shared_memory=False)
+        -> None. Create a
+        Python to Python socket link client. Call the start() method to open
+        the connection. timeout is the number of seconds to wait for the
+        peer before TimeoutError is raised, None waits forever. compression
+        True asks the server to compress arrays and dicts with the best
+        codec both ends have ("zstd" or "lz4" if installed, else "zlib"),
+        a codec name or list of names asks for those codecs. shared_memory
+        True asks the server to pass large arrays in shared memory
+        segments, which it does if it runs on the same machine; see
+        send_data.
         """
         assert type(port) is int
         self.port = port
+        self.timeout = timeout
+        self.compression = compression
+        if shared_memory and SharedMemory is None:
+            raise ValueError("shared memory needs Python 3.8 or later")
+        self.shared_memory = shared_memory
+        _p2p_codec_offer(compression)  # ValueError for unavailable codecs
     def connect(self, machine):
         """(machine: str) -> None. Connect to a Python to Python link server.
         """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.connect((machine,self.port))
         self.conn = self.socket
-        self.send_data(_socketBase.code)
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._receive_buffer = _socketReceiveBuffer(self.conn)
+        self._offer_compression()
         print("sent code")
+
+class AsyncP2PLink(_statsBase):
+    """asyncio version of the Python to Python socket link. Uses the same
+    wire format as p2pLinkServer and p2pLinkClient so either end of a link
+    can be an AsyncP2PLink. Many links can be driven from one event loop.
+
+    >>> async with AsyncP2PLink(5000) as link:
+    ...     await link.connect("localhost")
+    ...     await link.send(np.arange(10))
+    ...     reply = await link.recv()
+    """
+    codec = None
+    compress = False
+    compress_threshold = _socketBase.compress_threshold
+
+    def __init__(self, port=5000, timeout=None, compression=None):
+        """(port=5000, timeout=None, compression=None) -> None. Create an
+        asyncio Python to Python socket link. Call connect() to connect to a
+        link server or start() to wait for a client. timeout is the number
+        of seconds to wait for the peer before TimeoutError is raised, None
+        waits forever. compression works as for p2pLinkClient and
+        p2pLinkServer."""
+        assert type(port) is int
+        self.port = port
+        self.timeout = timeout
+        self.compression = compression
+        _p2p_codec_offer(compression)  # ValueError for unavailable codecs
+        self.reader = None
+        self.writer = None
+
+    async def connect(self, machine):
+        """(machine: str) -> None. Connect to a Python to Python link server.
+        """
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(machine, self.port), self.timeout)
+        offer = _p2p_codec_offer(self.compression)
+        if offer is None:
+            await self.send(_socketBase.code)
+            return
+        await self.send(_socketBase.compression_code)
+        await self.send(",".join(offer))
+        reply = await self.recv()
+        self.codec = None if reply == "none" else reply
+        self.compress = self.codec is not None
+
+    async def start(self):
+        """() -> None. Wait for a single Python to Python link client to
+        connect to port.
+        """
+        connected = asyncio.get_running_loop().create_future()
+
+        def accept(reader, writer):
+            if connected.done():
+                writer.close()
+            else:
+                connected.set_result((reader, writer))
+
+        server = await asyncio.start_server(accept, port=self.port,
+                                            reuse_address=True)
+        try:
+            self.reader, self.writer = await asyncio.wait_for(connected,
+                                                              self.timeout)
+        finally:
+            server.close()
+            await server.wait_closed()
+        code = await self.recv()
+        if code == _socketBase.compression_code:
+            self.codec = _p2p_codec_choice(await self.recv(), self.compression)
+            self.compress = self.codec is not None
+            await self.send(self.codec or "none")
+        elif code == _socketBase.options_code:
+            # shared memory is not supported, the link works over the socket
+            offer = (await self.recv())["compression"]
+            self.codec = (None if offer is None else _p2p_codec_choice(
+                ",".join(offer), self.compression))
+            self.compress = self.codec is not None
+            await self.send({"codec": self.codec, "shared_memory": False})
+        else:
+            assert code == _socketBase.code
+
+    async def send(self, value, compress=None):
+        """(value: any, compress=None: bool) -> None.
+        Send value. value must be a number, a string, a length two or three
+        list, a dict or a NumPy array. compress works as for
+        p2pLinkClient.send_data.
+        """
+        if compress is None:
+            compress = self.compress
+        stats = self._stats
+        if stats is not None:
+            start = time.perf_counter()
+        frames = _p2p_coalesce(_p2p_encode(
+            value, self.codec if compress else None, self.compress_threshold))
+        if stats is not None:
+            encoded = time.perf_counter()
+        for frame in frames:
+            self.writer.write(memoryview(frame))
+        if stats is not None:
+            written = time.perf_counter()
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+        if stats is not None:
+            end = time.perf_counter()
+            type_code, = struct.unpack_from("i", frames[0])
+            byte_count = sum(memoryview(frame).nbytes for frame in frames)
+            stats.record_send({type_code: (1, byte_count)}, start, encoded,
+                              end - written, end)
+
+    async def recv(self):
+        """() -> any.
+        Read the next item from the link.
+        """
+        return await asyncio.wait_for(self._recv(), self.timeout)
+
+    async def _recv(self):
+        stats = self._stats
+        if stats is not None:
+            start = time.perf_counter()
+            wait, byte_count, type_code = 0.0, 0, None
+        decoder = _p2p_decoder(self.codec)
+        request = next(decoder)
+        while True:
+            if stats is not None:
+                waiting = time.perf_counter()
+            if isinstance(request, np.ndarray):
+                data = await self.reader.readexactly(len(request))
+            else:
+                data = await self.reader.readexactly(request)
+            if stats is not None:
+                # awaiting the reader is counted as waiting for the socket
+                wait += time.perf_counter() - waiting
+                byte_count += len(data)
+                if type_code is None:
+                    type_code, = struct.unpack("i", data)
+            if isinstance(request, np.ndarray):
+                request[:] = np.frombuffer(data, np.uint8)
+                data = None
+            try:
+                request = decoder.send(data)
+            except StopIteration as stop:
+                if stats is not None:
+                    stats.record_receive({type_code: (1, byte_count)},
+                                         start, wait, time.perf_counter())
+                return stop.value
+
+    async def close(self):
+        """() -> None.
+        Close the link.
+        """
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.writer = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, eType, eValue, eTrace):
+        await self.close()
+
+class _p2pLinkPeer(_socketBase):
+    """One client connection of a p2pLinkMultiServer. Use send_data to reply
+    to the client. Incoming messages are decoded incrementally as data
+    arrives and replies the client does not take right away are queued and
+    written by the selector loop, so a slow client never blocks the others.
+    """
+    def __init__(self, conn, address, timeout=None, compression=None,
+                 want_write=None):
+        """(conn: socket, address: tuple, timeout=None, compression=None,
+            want_write=None: callable) -> None.
+        conn must be non-blocking. want_write(client) is called when
+        replies are queued.
+        """
+        self.conn = conn
+        self.address = address
+        self.timeout = timeout
+        self.compression = compression
+        self.connected = False  # True once the handshake code is read
+        self.shared_memory = False  # not supported by the selector loop
+        self._offered = None    # handshake code followed by an offer
+        self._receive_buffer = _socketReceiveBuffer(conn)
+        self._decoder = None
+        self._request = None
+        self._filled = 0
+        self._message = None  # (start, bytes received, type code), stats
+        self._want_write = want_write
+        self._outgoing = collections.deque()  # memoryviews not yet written
+        self._send_lock = threading.Lock()  # replies may come from threads
+        self._stalled = None  # time.monotonic() of the last write progress
+        self._dead = False  # set when a write fails, dropped by poll()
+
+    def _sendall(self, data):
+        """(data: bytes-like) -> None.
+        Write what the socket takes now and queue the rest (as a copy) for
+        the selector loop. Does not block. If the connection has failed the
+        data is discarded and the client is dropped by the selector loop.
+        """
+        with self._send_lock:
+            if self._dead:
+                return
+            with memoryview(data) as view:
+                view = view.cast("B")
+                sent = 0
+                if not self._outgoing:
+                    try:
+                        sent = self.conn.send(view)
+                    except BlockingIOError:
+                        pass
+                    except OSError:  # includes ConnectionResetError
+                        self._dead = True
+                        self._outgoing.clear()
+                if sent == len(view):
+                    return
+                if not self._dead:
+                    if not self._outgoing:
+                        self._stalled = time.monotonic()
+                    self._outgoing.append(memoryview(bytes(view[sent:])))
+        if self._want_write is not None:
+            self._want_write(self)
+
+    @property
+    def pending(self):
+        """Number of bytes of queued replies."""
+        with self._send_lock:
+            return sum(len(data) for data in self._outgoing)
+
+    def _flush(self):
+        """() -> bool.
+        Write queued replies until the socket would block. Returns True if
+        the queue is empty.
+        """
+        with self._send_lock:
+            while self._outgoing:
+                data = self._outgoing[0]
+                try:
+                    sent = self.conn.send(data)
+                except BlockingIOError:
+                    return False
+                self._stalled = time.monotonic()
+                if sent < len(data):
+                    self._outgoing[0] = data[sent:]
+                    return False
+                self._outgoing.popleft()
+            return True
+
+    def _receive(self):
+        """() -> [any].
+        Receive the data queued on the socket and return the messages
+        completed by it. Raises ConnectionError if the client has closed
+        the connection.
+        """
+        request = self._request
+        needed = 0 if isinstance(request, np.ndarray) else request or 0
+        self._receive_buffer.receive_available(needed)
+        messages = []
+        called = time.perf_counter() if self._stats is not None else None
+        while True:
+            if self._decoder is None:
+                if not len(self._receive_buffer):
+                    return messages
+                # created when its first bytes are here, after any
+                # handshake message before it has been handled
+                self._decoder = _p2p_decoder(self.codec)
+                self._request = next(self._decoder)
+                self._filled = 0
+                self._message = None if self._stats is None else (
+                    time.perf_counter(), self._receive_buffer.received, None)
+            request = self._request
+            if isinstance(request, np.ndarray):
+                count = min(len(self._receive_buffer),
+                            len(request) - self._filled)
+                self._receive_buffer.read_into(
+                    request[self._filled:self._filled + count])
+                self._filled += count
+                if self._filled < len(request):
+                    return messages
+                data = None
+            elif len(self._receive_buffer) < request:
+                return messages
+            else:
+                data = self._receive_buffer.read(request)
+                if self._message is not None and self._message[2] is None:
+                    self._message = self._message[:2] + (
+                        struct.unpack("i", data)[0],)
+            try:
+                self._request = self._decoder.send(data)
+            except StopIteration as stop:
+                messages.append(stop.value)
+                self._decoder = None
+                if self._message is not None:
+                    self._record_message(called)
+
+    def _record_message(self, called):
+        """(called: float) -> None.
+        Count the message just decoded. Time before the _receive call
+        (started at called) which completed it was spent waiting for the
+        rest of the message.
+        """
+        start, received, type_code = self._message
+        self._message = None
+        end = time.perf_counter()
+        self._stats.record_receive(
+            {type_code: (1, self._receive_buffer.received - received)},
+            start, max(0.0, called - start), end)
+
+    def __repr__(self):
+        return "<p2pLink client {}:{}>".format(*self.address[:2])
+
+class p2pLinkMultiServer(object):
+    """Python to Python socket link server for many clients. Clients connect
+    with p2pLinkClient (or AsyncP2PLink) as usual. Connections and messages
+    are handled by a selector loop in the thread calling poll() or
+    serve_forever(). Each message is passed to handler(client, value), or
+    put on the messages queue as a (client, value) tuple if no handler is
+    given. Reply to a client with client.send_data(value).
+
+    >>> with p2pLinkMultiServer(5000, handler=lambda c, v: c.send_data(v)) as s:
+    ...     s.start()
+    ...     s.serve_forever()
+    """
+    def __init__(self, port=5000, handler=None, timeout=None, backlog=64,
+                 compression=None):
+        """(port=5000, handler=None, timeout=None, backlog=64,
+            compression=None) -> None.
+        Create a multi client link server. Call the start() method to
+        listen for connections. A client whose queued replies make no
+        progress for timeout seconds is dropped (None never drops it).
+        compression works as for p2pLinkServer, for each client."""
+        assert type(port) is int
+        self.port = port
+        self.handler = handler
+        self.timeout = timeout
+        self.backlog = backlog
+        self.compression = compression
+        _p2p_codec_offer(compression)  # ValueError for unavailable codecs
+        self.clients = []
+        self.messages = queue.Queue()
+        self._stop = threading.Event()
+        self._stats_options = None  # enable_stats arguments for new clients
+        self._selector_lock = threading.RLock()
+        self._thread = None  # thread running the selector loop
+
+    def start(self):
+        """() -> None. Listen for client connections. Does not block."""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(("", self.port))
+        self.socket.listen(self.backlog)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.socket, selectors.EVENT_READ)
+        # written to by other threads to wake up the selector loop
+        self._wake_receiver, self._wake_sender = socket.socketpair()
+        self._wake_receiver.setblocking(False)
+        self._wake_sender.setblocking(False)
+        self._selector.register(self._wake_receiver, selectors.EVENT_READ)
+
+    def poll(self, timeout=None):
+        """(timeout=None: float) -> int.
+        Wait up to timeout seconds (None waits forever) for activity, accept
+        new clients, write queued replies and dispatch the complete
+        messages. Returns the number of messages dispatched. Clients whose
+        replies have not moved for the server timeout, or could not be
+        written, are dropped.
+        """
+        self._thread = threading.get_ident()
+        dispatched = 0
+        for key, events in self._selector.select(timeout):
+            if key.fileobj is self.socket:
+                self._accept()
+                continue
+            if key.fileobj is self._wake_receiver:
+                try:
+                    self._wake_receiver.recv(4096)
+                except BlockingIOError:
+                    pass
+                continue
+            client = key.data
+            if client not in self.clients:
+                continue  # dropped earlier in this loop
+            if events & selectors.EVENT_WRITE:
+                try:
+                    if client._flush():
+                        self._watch(client, False)
+                except OSError:
+                    self._drop(client)
+                    continue
+            if not events & selectors.EVENT_READ:
+                continue
+            try:
+                messages = client._receive()
+            except BlockingIOError:
+                continue
+            except (ConnectionError, OSError):
+                self._drop(client)
+                continue
+            for message in messages:
+                if not client.connected:
+                    if client._offered == _socketBase.compression_code:
+                        client._accept_compression(message)
+                    elif client._offered == _socketBase.options_code:
+                        client._accept_options(message)
+                    elif message in (_socketBase.compression_code,
+                                     _socketBase.options_code):
+                        client._offered = message
+                        continue
+                    elif message != _socketBase.code:
+                        self._drop(client)
+                        break
+                    client.connected = True
+                    continue
+                self._dispatch(client, message)
+                dispatched += 1
+                if client._dead:  # a reply failed, the client has gone
+                    self._drop(client)
+                    break
+        now = time.monotonic()
+        for client in list(self.clients):
+            stalled = client._stalled
+            if client._dead or (self.timeout is not None and
+                                client._outgoing and
+                                now - stalled > self.timeout):
+                self._drop(client)
+        return dispatched
+
+    def serve_forever(self):
+        """() -> None.
+        Handle clients until stop() is called (from a handler or another
+        thread).
+        """
+        self._stop.clear()
+        while not self._stop.is_set():
+            self.poll(_wait_slice)
+
+    def stop(self):
+        """() -> None. Make serve_forever return."""
+        self._stop.set()
+
+    def enable_stats(self, hook=None, trace=False):
+        """(hook=None: callable, trace=False: bool) -> None.
+        Enable traffic statistics on each client connection, the current
+        ones and those accepted later. Read them with client.stats(), see
+        TransferStats.
+        """
+        self._stats_options = (hook, trace)
+        for client in self.clients:
+            client.enable_stats(hook, trace)
+
+    def _accept(self):
+        conn, address = self.socket.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.setblocking(False)
+        client = _p2pLinkPeer(conn, address, self.timeout, self.compression,
+                              self._want_write)
+        if self._stats_options is not None:
+            client.enable_stats(*self._stats_options)
+        self.clients.append(client)
+        self._selector.register(conn, selectors.EVENT_READ, client)
+
+    def _want_write(self, client):
+        """(client: _p2pLinkPeer) -> None.
+        Write the queued replies of client when its socket is writable.
+        Called from send_data, maybe from another thread.
+        """
+        with self._selector_lock:
+            if client not in self.clients:
+                return
+            self._watch(client, True)
+        if threading.get_ident() != self._thread:
+            try:
+                self._wake_sender.send(b"\0")
+            except BlockingIOError:
+                pass  # a wake up is already pending
+
+    def _watch(self, client, write):
+        """(client: _p2pLinkPeer, write: bool) -> None.
+        Select on client for reading, and for writing if write is True.
+        """
+        with self._selector_lock:
+            events = selectors.EVENT_READ
+            if write:
+                events |= selectors.EVENT_WRITE
+            if self._selector.get_key(client.conn).events != events:
+                self._selector.modify(client.conn, events, client)
+
+    def _drop(self, client):
+        with self._selector_lock:
+            self._selector.unregister(client.conn)
+            self.clients.remove(client)
+        client.conn.close()
+
+    def _dispatch(self, client, message):
+        if self.handler is None:
+            self.messages.put((client, message))
+        else:
+            self.handler(client, message)
+
+    def close(self):
+        """() -> None.
+        Close all client connections and stop listening.
+        """
+        for client in list(self.clients):
+            self._drop(client)
+        if hasattr(self, "socket"):
+            self._selector.close()
+            self.socket.close()
+            self._wake_receiver.close()
+            self._wake_sender.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, eType, eValue, eTrace):
+        self.close()
+
+class p2pLinkClientPool(object):
+    """Pool of reusable p2pLinkClient connections to one link server. Use
+    connection() to borrow a connected client; at most size clients are
+    open at a time.
+
+    >>> pool = p2pLinkClientPool("localhost", 5000, size=32)
+    >>> with pool.connection() as link:
+    ...     link.send_data(parameters)
+    ...     result = link.read_data()
+    """
+    def __init__(self, machine, port=5000, size=8, timeout=None,
+                 compression=None):
+        """(machine: str, port=5000, size=8, timeout=None, compression=None)
+            -> None. compression is passed to the clients."""
+        self.machine = machine
+        self.port = port
+        self.timeout = timeout
+        self.compression = compression
+        _p2p_codec_offer(compression)  # ValueError for unavailable codecs
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """() -> context manager giving a connected p2pLinkClient.
+        Blocks while size clients are in use. A client is returned to the
+        pool when the block exits normally and closed if it raises, since
+        the state of the link is then unknown.
+        """
+        self._slots.acquire()
+        try:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                client = p2pLinkClient(self.port, self.timeout,
+                                       self.compression)
+                client.connect(self.machine)
+            try:
+                yield client
+            except BaseException:
+                client.close()
+                raise
+            self._idle.put(client)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """() -> None.
+        Close the idle connections.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, eType, eValue, eTrace):
+        self.close()
@@ -1,4 +1,11 @@
+import collections
+import contextlib
+import io
+import itertools
+import struct
+from concurrent.futures import ProcessPoolExecutor
 import itasca as it
+import numpy as np
 gmsh_template = r"""$MeshFormat
 2.2 0 8
 $EndMeshFormat
@@ -13,41 +20,595 @@ flac3d_brick_to_gmsh = [2,4,7,5,0,1,6,3]
 flac3d_wedge_to_gmsh = [5,2,4,3,0,1]
 flac3d_tet_to_gmsh = [0,2,3,1]
 flac3d_pyramid_to_gmsh = [2,0,1,4,3]
+# a degenerate brick is a brick without gridpoint 7, it is written as a
+# Gmsh hexahedron with that corner collapsed onto gridpoint 6
+flac3d_dbrick_to_gmsh = [2,4,6,5,0,1,6,3]
 
+# zone type: (gridpoint count, Gmsh element type, FLAC3D to Gmsh permutation)
+zone_types = {"brick": (8, 5, flac3d_brick_to_gmsh),
+              "dbrick": (7, 5, flac3d_dbrick_to_gmsh),
+              "wedge": (6, 6, flac3d_wedge_to_gmsh),
+              "pyramid": (5, 7, flac3d_pyramid_to_gmsh),
+              "tetra": (4, 4, flac3d_tet_to_gmsh)}
 
-def FLAC3D_to_gmsh(filename="tmp.gmsh"):
+# FLAC3D grid file (.f3grid) keyword of each zone type
+f3grid_zone_types = {"brick": "B8", "dbrick": "B7", "wedge": "W6",
+                     "pyramid": "P5", "tetra": "T4"}
+
+f3grid_import_command = 'zone import "{}"'
+
+_rows_per_write = 65536
+_blocks_ahead = 16  # blocks queued on the worker processes
+
+# A mesh is a dict of NumPy arrays, the layout of the .npz container:
+#   positions      (N,3) gridpoint positions
+#   gridpoint_ids  (N,) gridpoint ids
+#   zone_ids       (M,) zone ids, in zone order
+#   <type>         (m,k) zero based gridpoint indices of the zones of one
+#                  type (brick, dbrick, wedge, pyramid, tetra), in FLAC3D
+#                  order
+#   <type>_zones   (m,) zero based positions of these zones in zone order
+
+def _model_arrays():
+    """() -> (positions, gridpoint_ids, connectivity, zone_ids).
+    Gridpoint positions as an (N,3) array and zone connectivity as an
+    (M,8) array of zero based gridpoint indices, padded with -1 for zones
+    with fewer than 8 gridpoints. Uses the FLAC3D array interface when it
+    is available, otherwise one pass over the gridpoint and zone lists.
     """
-    Convert the current FLAC3D model in to the Gmsh format. Returns a mesh filename.
+    try:
+        from itasca import gridpointarray, zonearray
+        return (np.array(gridpointarray.pos(), dtype=np.float64),
+                np.asarray(gridpointarray.ids(), dtype=np.int64),
+                np.asarray(zonearray.gridpoints(), dtype=np.int64),
+                np.asarray(zonearray.ids(), dtype=np.int64))
+    except (ImportError, AttributeError):
+        pass
+    gp_ids = []
+    positions = []
+    for gp in it.gridpoint.list():
+        gp_ids.append(gp.id())
+        positions.append(gp.pos())
+    gp_id_to_index = {gp_id: i for i, gp_id in enumerate(gp_ids)}
+    zone_ids = []
+    connectivity = []
+    for z in it.zone.list():
+        zone_ids.append(z.id())
+        gp_list = [gp_id_to_index[gp.id()] for gp in z.gridpoints()]
+        connectivity.append(gp_list + [-1] * (8 - len(gp_list)))
+    return (np.array(positions, dtype=np.float64).reshape(-1, 3),
+            np.array(gp_ids, dtype=np.int64),
+            np.array(connectivity, dtype=np.int64).reshape(-1, 8),
+            np.array(zone_ids, dtype=np.int64))
+
+def _model_positions():
+    """() -> (N,3) array.
+    Gridpoint positions of the current FLAC3D model.
     """
+    try:
+        from itasca import gridpointarray
+        return np.array(gridpointarray.pos(), dtype=np.float64)
+    except (ImportError, AttributeError):
+        pass
+    return np.array([gp.pos() for gp in it.gridpoint.list()],
+                    dtype=np.float64).reshape(-1, 3)
 
-    gp_id_to_index = { gp.id() : i+1 for i,gp in enumerate(it.gridpoint.list())}
+def FLAC3D_mesh(topology=None):
+    """(topology=None: dict) -> dict.
+    The gridpoints and zones of the current FLAC3D model as a mesh dict.
+    If topology is a mesh dict from an earlier call only the gridpoint
+    positions are read again; its zones, ids and index maps are reused.
+    """
+    if topology is not None:
+        mesh = dict(topology)
+        mesh["positions"] = _model_positions()
+        if len(mesh["positions"]) != len(topology["positions"]):
+            raise ValueError("the number of gridpoints has changed")
+        return mesh
+    positions, gridpoint_ids, connectivity, zone_ids = _model_arrays()
+    gridpoint_count = (connectivity >= 0).sum(axis=1)
+    mesh = {"positions": positions, "gridpoint_ids": gridpoint_ids,
+            "zone_ids": zone_ids}
+    for zone_type, (count, _, _) in zone_types.items():
+        zones = np.flatnonzero(gridpoint_count == count)
+        if len(zones):
+            mesh[zone_type] = connectivity[zones, :count].astype(np.int32)
+            mesh[zone_type + "_zones"] = zones.astype(np.int32)
+    return mesh
 
-    gp_data = ""
-    for i,gp in enumerate(it.gridpoint.list()):
-        gp_data +="{} {} {} {}\n".format(i+1, *gp.pos())
+def _element_groups(mesh):
+    """(mesh: dict) -> [(element_type, zone_numbers, nodes)].
+    The zones of each type with their gridpoints in Gmsh order.
+    zone_numbers are one based zone positions and nodes one based Gmsh
+    node numbers.
+    """
+    groups = []
+    for zone_type, (_, element_type, permutation) in zone_types.items():
+        if zone_type in mesh and len(mesh[zone_type]):
+            groups.append((element_type, mesh[zone_type + "_zones"] + 1,
+                           mesh[zone_type][:, permutation] + 1))
+    return groups
 
-    element_data = ""
-    for i,z in enumerate(it.zone.list()):
-        element_type = None
-        gp_list = [gp_id_to_index[gp.id()] for gp in z.gridpoints()]
+def _format_rows(row_format, columns):
+    """(row_format: str, columns: [1-D array]) -> str.
+    Rows of values, one from each column, formatted with a %-format string
+    for one row with a single % operation.
+    """
+    block = [column.tolist() for column in columns]
+    values = tuple(itertools.chain.from_iterable(zip(*block)))
+    return (row_format * len(block[0])) % values
+
+def _write_rows(f, row_format, columns, executor=None):
+    """(f: file, row_format: str, columns: [1-D array],
+        executor=None: ProcessPoolExecutor) -> None.
+    Write rows of values, a block of rows at a time. With an executor the
+    blocks are formatted by its worker processes and written in order.
+    """
+    blocks = ([column[start:start + _rows_per_write] for column in columns]
+              for start in range(0, len(columns[0]), _rows_per_write))
+    if executor is None:
+        for block in blocks:
+            f.write(_format_rows(row_format, block))
+        return
+    pending = collections.deque()
+    for block in blocks:
+        pending.append(executor.submit(_format_rows, row_format, block))
+        if len(pending) >= _blocks_ahead:
+            f.write(pending.popleft().result())
+    while pending:
+        f.write(pending.popleft().result())
+
+def _executor(workers):
+    """(workers: int or None) -> context manager.
+    A process pool with workers processes, or a null context giving None
+    when workers is None or 1.
+    """
+    if workers is None or workers <= 1:
+        return contextlib.nullcontext()
+    return ProcessPoolExecutor(workers)
+
+def write_gmsh(filename, mesh, binary=False, workers=None):
+    """(filename: str, mesh: dict, binary=False: bool, workers=None: int)
+        -> str.
+    Write a mesh dict as a Gmsh 2.2 mesh file, ASCII or binary. Nodes are
+    numbered by gridpoint position and elements by zone position, grouped
+    by type. ASCII text is formatted by workers processes when workers is
+    more than one; the worker processes need a standalone Python, for
+    example to convert an .npz mesh saved by FLAC3D_to_npz. Returns
+    filename.
+    """
+    positions = mesh["positions"]
+    groups = _element_groups(mesh)
+    element_count = sum(len(zones) for _, zones, _ in groups)
+    if not binary:
+        with open(filename, "w") as f, _executor(workers) as executor:
+            f.write("$MeshFormat\n2.2 0 8\n$EndMeshFormat\n$Nodes\n")
+            f.write("{}\n".format(len(positions)))
+            _write_rows(f, "%d %r %r %r\n",
+                        [np.arange(1, len(positions) + 1)] + list(positions.T),
+                        executor)
+            f.write("$EndNodes\n$Elements\n")
+            f.write("{}\n".format(element_count))
+            for element_type, zones, nodes in groups:
+                row_format = "%d {} 2 99 2{}\n".format(
+                    element_type, " %d" * nodes.shape[1])
+                _write_rows(f, row_format, [zones] + list(nodes.T), executor)
+            f.write("$EndElements\n\n")
+        return filename
+
+    with open(filename, "wb") as f:
+        f.write(b"$MeshFormat\n2.2 1 8\n" + struct.pack("=i", 1) +
+                b"\n$EndMeshFormat\n$Nodes\n")
+        f.write("{}\n".format(len(positions)).encode())
+        nodes = np.empty(len(positions),
+                         dtype=[("number", "=i4"), ("position", "=f8", 3)])
+        nodes["number"] = np.arange(1, len(positions) + 1)
+        nodes["position"] = positions
+        nodes.tofile(f)
+        f.write("\n$EndNodes\n$Elements\n{}\n".format(element_count).encode())
+        for element_type, zones, nodes in groups:
+            # block header: element type, element count, tag count
+            np.array([element_type, len(zones), 2], dtype="=i4").tofile(f)
+            records = np.empty((len(zones), 3 + nodes.shape[1]), dtype="=i4")
+            records[:, 0] = zones
+            records[:, 1] = 99
+            records[:, 2] = 2
+            records[:, 3:] = nodes
+            records.tofile(f)
+        f.write(b"\n$EndElements\n")
+    return filename
+
+def write_npz(filename, mesh, compressed=False):
+    """(filename: str, mesh: dict, compressed=False: bool) -> str.
+    Write a mesh dict to a NumPy .npz file. Returns filename.
+    """
+    if compressed:
+        np.savez_compressed(filename, **mesh)
+    else:
+        np.savez(filename, **mesh)
+    return filename
+
+def _index_of(numbers, values):
+    """(numbers: 1-D array, values: array) -> array.
+    Zero based positions of values in numbers.
+    """
+    if np.array_equal(numbers, np.arange(1, len(numbers) + 1)):
+        return values - 1
+    order = np.argsort(numbers, kind="stable")
+    return order[np.searchsorted(numbers, values, sorter=order)]
+
+def _section(data, name, start=0):
+    """(data: bytes, name: bytes, start=0: int) -> (int, int).
+    Item count of the $name section and offset of its data.
+    """
+    begin = data.index(b"$" + name, start)
+    line_end = data.index(b"\n", begin)
+    count_end = data.index(b"\n", line_end + 1)
+    return int(data[line_end + 1:count_end]), count_end + 1
+
+def _gmsh_header(data):
+    """(data: bytes) -> (bool, str).
+    Whether a Gmsh 2.2 file is binary and the NumPy byte order of its
+    binary data.
+    """
+    begin = data.index(b"$MeshFormat")
+    line_end = data.index(b"\n", begin)
+    header_end = data.index(b"\n", line_end + 1)
+    version, file_type, data_size = data[line_end + 1:header_end].split()
+    if not version.startswith(b"2"):
+        raise ValueError("only Gmsh 2.2 mesh files are supported")
+    binary = int(file_type) == 1
+    order = "="
+    if binary:
+        one, = struct.unpack("=i", data[header_end + 1:header_end + 5])
+        if one != 1:
+            order = ">" if struct.pack("=i", 1) == struct.pack("<i", 1) \
+                else "<"
+    return binary, order
+
+def read_gmsh(filename):
+    """(filename: str) -> dict.
+    Read the volume elements (brick, wedge, pyramid and tetra) of an ASCII
+    or binary Gmsh 2.2 mesh file into a mesh dict. Other elements are
+    ignored. Hexahedra collapsed as written for degenerate bricks are read
+    as degenerate bricks. Zone ids are the element numbers and gridpoint
+    ids the node numbers.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    binary, order = _gmsh_header(data)
+
+    node_count, offset = _section(data, b"Nodes")
+    if binary:
+        nodes = np.frombuffer(data, dtype=[("number", order + "i4"),
+                                           ("position", order + "f8", 3)],
+                              count=node_count, offset=offset)
+        numbers = nodes["number"].astype(np.int64)
+        positions = nodes["position"].astype(np.float64)
+        # the node records may contain the bytes of "$Elements"
+        offset += nodes.nbytes
+    else:
+        end = data.index(b"$EndNodes", offset)
+        values = np.array(data[offset:end].split(), dtype=np.float64)
+        values = values.reshape(node_count, 4)
+        numbers = values[:, 0].astype(np.int64)
+        positions = values[:, 1:].copy()
+        offset = end
+
+    element_count, offset = _section(data, b"Elements", offset)
+    blocks = []  # (element_type, element numbers, nodes)
+    if binary:
+        int_type = np.dtype(order + "i4")
+        read = 0
+        while read < element_count:
+            element_type, count, tag_count = np.frombuffer(
+                data, dtype=int_type, count=3, offset=offset)
+            offset += 3 * int_type.itemsize
+            node_number = _gmsh_node_count(element_type)
+            width = 1 + tag_count + node_number
+            records = np.frombuffer(data, dtype=int_type, count=count * width,
+                                    offset=offset).reshape(count, width)
+            offset += records.nbytes
+            blocks.append((element_type, records[:, 0],
+                           records[:, 1 + tag_count:]))
+            read += count
+    else:
+        end = data.index(b"$EndElements", offset)
+        lines = data[offset:end].splitlines()
+        widths = np.array([len(line.split()) for line in lines])
+        values = np.array(b" ".join(lines).split(), dtype=np.int64)
+        starts = np.concatenate(([0], np.cumsum(widths)[:-1]))
+        for width in np.unique(widths):
+            rows = starts[widths == width]
+            records = values[rows[:, None] + np.arange(width)]
+            for element_type in np.unique(records[:, 1]):
+                typed = records[records[:, 1] == element_type]
+                tag_count = typed[0, 2]
+                blocks.append((element_type, typed[:, 0],
+                               typed[:, 3 + tag_count:]))
+
+    gmsh_types = {element_type for _, element_type, _ in zone_types.values()}
+    blocks = [block for block in blocks if block[0] in gmsh_types]
+    zone_ids = np.sort(np.concatenate(
+        [np.zeros(0, dtype=np.int64)] +
+        [block[1].astype(np.int64) for block in blocks]))
+    mesh = {"positions": positions, "gridpoint_ids": numbers,
+            "zone_ids": zone_ids}
+    for zone_type, (_, element_type, permutation) in zone_types.items():
+        typed = [block for block in blocks if block[0] == element_type]
+        if not typed or zone_type == "dbrick":
+            continue
+        # inverse of the FLAC3D to Gmsh permutation
+        nodes = np.concatenate([block[2] for block in typed])
+        nodes = nodes[:, np.argsort(permutation)].astype(np.int64)
+        zones = np.concatenate([block[1] for block in typed])
+        zones = np.searchsorted(zone_ids, zones).astype(np.int32)
+        nodes = _index_of(numbers, nodes).astype(np.int32)
+        if zone_type == "brick":
+            # hexahedra with corner 7 collapsed onto 6 are degenerate bricks
+            collapsed = nodes[:, 7] == nodes[:, 6]
+            if np.any(collapsed):
+                mesh["dbrick"] = nodes[collapsed, :7]
+                mesh["dbrick_zones"] = zones[collapsed]
+                nodes, zones = nodes[~collapsed], zones[~collapsed]
+        mesh[zone_type] = nodes
+        mesh[zone_type + "_zones"] = zones
+    return mesh
 
-        if z.type() == "brick":
-            element_type = 5
-            gp_list = [gp_list[j] for j in flac3d_brick_to_gmsh]
-        elif z.type() == "wedge":
-            element_type = 6
-            gp_list = [gp_list[j] for j in flac3d_wedge_to_gmsh]
-        elif z.type() == "pyramid":
-            gp_list = [gp_list[j] for j in flac3d_pyramid_to_gmsh]
-            element_type = 7
-        elif z.type() == "tetra":
-            element_type = 4
-            gp_list = [gp_list[j] for j in flac3d_tet_to_gmsh]
-        elif z.type() == "dbrick":
-            raise ValueError("Degenerate bricks are not supported.")
-
-        element_data += "{} {} 2 99 2 {}\n".format(i+1, element_type, " ".join(map(str,gp_list)))
-
-    with open(filename, "w") as f:
-        print(gmsh_template.format(it.gridpoint.count(), gp_data, it.zone.count(), element_data), file=f)
+def _gmsh_node_count(element_type):
+    """(element_type: int) -> int.
+    Number of nodes of a Gmsh element type.
+    """
+    counts = {1: 2, 2: 3, 3: 4, 4: 4, 5: 8, 6: 6, 7: 5, 8: 3, 9: 6, 10: 9,
+              11: 10, 12: 27, 13: 18, 14: 14, 15: 1, 16: 8, 17: 20, 18: 15,
+              19: 13}
+    if element_type not in counts:
+        raise ValueError("unsupported Gmsh element type {}"
+                         .format(element_type))
+    return counts[element_type]
+
+def _gmsh_line(data, offset):
+    """(data: bytes, offset: int) -> (bytes, int).
+    The line starting at offset and the offset of the next line.
+    """
+    end = data.index(b"\n", offset)
+    return data[offset:end], end + 1
+
+def read_gmsh_fields(filename):
+    """(filename: str) -> dict.
+    Read the $NodeData and $ElementData blocks of a Gmsh 2.2 file, as
+    written by GmshSeries. Returns a dict of field name to a list of
+    (time, values) pairs, one per block, with values in node or element
+    number order.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    binary, order = _gmsh_header(data)
+    fields = {}
+    for section in (b"NodeData", b"ElementData"):
+        offset = data.index(b"$EndElements")
+        while True:
+            offset = data.find(b"$" + section + b"\n", offset)
+            if offset < 0:
+                break
+            offset += len(section) + 2
+            tags = []  # string, real and integer tags
+            for _ in range(3):
+                count, offset = _gmsh_line(data, offset)
+                tags.append([])
+                for _ in range(int(count)):
+                    tag, offset = _gmsh_line(data, offset)
+                    tags[-1].append(tag)
+            name = tags[0][0].strip().strip(b'"').decode()
+            time = float(tags[1][0]) if tags[1] else 0.0
+            components, count = int(tags[2][1]), int(tags[2][2])
+            if binary:
+                records = np.frombuffer(data, dtype=[
+                    ("number", order + "i4"),
+                    ("value", order + "f8", components)],
+                    count=count, offset=offset)
+                offset += records.nbytes
+                numbers = records["number"]
+                values = records["value"].astype(np.float64)
+            else:
+                end = data.index(b"$End" + section, offset)
+                values = np.array(data[offset:end].split(), dtype=np.float64)
+                values = values.reshape(count, 1 + components)
+                numbers = values[:, 0]
+                values = values[:, 1:]
+                offset = end
+            values = values[np.argsort(numbers, kind="stable")]
+            if components == 1:
+                values = values[:, 0]
+            elif components == 9:
+                values = values.reshape(count, 3, 3)
+            fields.setdefault(name, []).append((time, values))
+    return fields
+
+def read_npz(filename):
+    """(filename: str) -> dict.
+    Read a mesh dict written by write_npz.
+    """
+    with np.load(filename) as data:
+        return {key: data[key] for key in data.files}
+
+def read_mesh(filename):
+    """(filename: str) -> dict.
+    Read a .npz mesh container or a Gmsh mesh file into a mesh dict.
+    """
+    if filename.endswith(".npz"):
+        return read_npz(filename)
+    return read_gmsh(filename)
+
+def write_f3grid(filename, mesh, workers=None):
+    """(filename: str, mesh: dict, workers=None: int) -> str.
+    Write a mesh dict as a FLAC3D grid file, using its gridpoint and zone
+    ids. Gridpoints which are not used by a zone are left out. The text is
+    formatted by workers processes when workers is more than one, which
+    needs a standalone Python as for write_gmsh. Returns filename.
+    """
+    gridpoint_ids = mesh["gridpoint_ids"]
+    used = np.zeros(len(gridpoint_ids), dtype=bool)
+    for zone_type in zone_types:
+        if zone_type in mesh:
+            used[mesh[zone_type].ravel()] = True
+    used = np.flatnonzero(used)
+    positions = mesh["positions"][used]
+    with open(filename, "w") as f, _executor(workers) as executor:
+        f.write("* FLAC3D grid written by itasca.meshConvert\n")
+        f.write("* GRIDPOINTS\n")
+        _write_rows(f, "G %d %r %r %r\n",
+                    [gridpoint_ids[used]] + list(positions.T), executor)
+        f.write("* ZONES\n")
+        for zone_type, keyword in f3grid_zone_types.items():
+            if zone_type not in mesh or not len(mesh[zone_type]):
+                continue
+            gridpoints = gridpoint_ids[mesh[zone_type]]
+            row_format = "Z {} %d{}\n".format(
+                keyword, " %d" * gridpoints.shape[1])
+            _write_rows(f, row_format,
+                        [mesh["zone_ids"][mesh[zone_type + "_zones"]]] +
+                        list(gridpoints.T), executor)
     return filename
+
+def gmsh_to_FLAC3D(filename, grid_filename="tmp.f3grid"):
+    """
+    Create FLAC3D zones from the volume elements of a Gmsh file (ASCII or
+    binary) or a .npz mesh container. The mesh is written to a FLAC3D grid
+    file which is imported with a single command. Returns the grid
+    filename.
+    """
+    write_f3grid(grid_filename, read_mesh(filename))
+    it.command(f3grid_import_command.format(grid_filename))
+    return grid_filename
+
+def FLAC3D_to_gmsh(filename="tmp.gmsh", binary=False):
+    """
+    Convert the current FLAC3D model in to the Gmsh format. Returns a mesh filename.
+    Elements are written grouped by type and numbered by zone position.
+    binary=True writes a binary Gmsh file, which is smaller and faster.
+    """
+    return write_gmsh(filename, FLAC3D_mesh(), binary)
+
+def FLAC3D_to_npz(filename="tmp.npz", compressed=False):
+    """
+    Save the current FLAC3D model gridpoints and zones to a NumPy .npz
+    mesh container, see read_npz. Returns a mesh filename.
+    """
+    return write_npz(filename, FLAC3D_mesh(), compressed)
+
+def _model_field(array_module, object_list, name):
+    """(array_module: str, object_list: callable, name: str) -> array.
+    A gridpoint or zone quantity for the whole model, from the FLAC3D
+    array interface if it has the quantity, otherwise by calling the
+    method name of each object.
+    """
+    try:
+        module = __import__("itasca." + array_module,
+                            fromlist=[array_module])
+        return np.asarray(getattr(module, name)(), dtype=np.float64)
+    except (ImportError, AttributeError):
+        pass
+    return np.array([getattr(item, name)() for item in object_list()],
+                    dtype=np.float64)
+
+def gridpoint_field(name):
+    """(name: str) -> array.
+    A gridpoint quantity (for example "disp" or "vel") of the current model
+    in gridpoint order.
+    """
+    return _model_field("gridpointarray", it.gridpoint.list, name)
+
+def zone_field(name):
+    """(name: str) -> array.
+    A zone quantity (for example "density" or "stress") of the current
+    model in zone order.
+    """
+    return _model_field("zonearray", it.zone.list, name)
+
+def _write_gmsh_data(f, section, name, time, step, values, binary):
+    """(f: binary file, section: str, name: str, time: float, step: int,
+        values: array, binary: bool) -> None.
+    Append a $NodeData or $ElementData block with one row per gridpoint or
+    zone. values has shape (n,), (n,3) or (n,3,3).
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(len(values), -1)
+    components = values.shape[1]
+    if components not in (1, 3, 9):
+        raise ValueError("{} must have 1, 3 or 9 components".format(name))
+    f.write('${}\n1\n"{}"\n1\n{!r}\n3\n{}\n{}\n{}\n'.format(
+        section, name, float(time), step, components, len(values)).encode())
+    numbers = np.arange(1, len(values) + 1)
+    if binary:
+        records = np.empty(len(values), dtype=[("number", "=i4"),
+                                               ("value", "=f8", components)])
+        records["number"] = numbers
+        records["value"] = values
+        records.tofile(f)
+        f.write("\n$End{}\n".format(section).encode())
+    else:
+        text = io.StringIO()
+        _write_rows(text, "%d" + " %r" * components + "\n",
+                    [numbers] + list(values.T))
+        f.write(text.getvalue().encode())
+        f.write("$End{}\n".format(section).encode())
+
+class GmshSeries(object):
+    """Save a sequence of model states to one Gmsh 2.2 file. The mesh is
+    written once, by the first call to write_step. Every step then appends
+    only its fields as $NodeData and $ElementData blocks, and a
+    "displacement" node field once the gridpoints have moved.
+
+    >>> series = GmshSeries("run.msh", binary=True)
+    >>> for i in range(200):
+    ...     it.command("model cycle 100")
+    ...     series.write_step(gridpoint_fields=["vel"],
+    ...                       zone_fields=["density"])
+    """
+    def __init__(self, filename="series.msh", binary=False):
+        """(filename="series.msh": str, binary=False: bool) -> GmshSeries."""
+        self.filename = filename
+        self.binary = binary
+        self.mesh = None
+        self.step = 0
+        self._moved = False  # gridpoints moved since the first step
+
+    def write_step(self, time=None, gridpoint_fields=(), zone_fields=()):
+        """(time=None: float, gridpoint_fields=(): dict or [str],
+            zone_fields=(): dict or [str]) -> None.
+        Save the current model state. Fields are given as a dict of name to
+        array (in gridpoint or zone order) or a list of quantity names read
+        with gridpoint_field and zone_field. time defaults to the step
+        number.
+        """
+        if time is None:
+            time = self.step
+        if self.mesh is None:
+            self.mesh = FLAC3D_mesh()
+            write_gmsh(self.filename, self.mesh, self.binary)
+            positions = self.mesh["positions"]
+        else:
+            positions = FLAC3D_mesh(self.mesh)["positions"]
+            # once written, the displacement is written at every step so
+            # no step shows the displacement of an earlier one
+            self._moved = (self._moved or
+                           not np.array_equal(positions,
+                                              self.mesh["positions"]))
+        if not isinstance(gridpoint_fields, dict):
+            gridpoint_fields = {name: gridpoint_field(name)
+                                for name in gridpoint_fields}
+        if not isinstance(zone_fields, dict):
+            zone_fields = {name: zone_field(name) for name in zone_fields}
+        with open(self.filename, "ab") as f:
+            if self._moved:
+                _write_gmsh_data(f, "NodeData", "displacement", time,
+                                 self.step,
+                                 positions - self.mesh["positions"],
+                                 self.binary)
+            for name, values in gridpoint_fields.items():
+                _write_gmsh_data(f, "NodeData", name, time, self.step,
+                                 values, self.binary)
+            for name, values in zone_fields.items():
+                _write_gmsh_data(f, "ElementData", name, time, self.step,
+                                 values, self.binary)
+        self.step += 1
@@ -0,0 +1,56 @@
+"""Fixtures shared by the tests which run without an Itasca code."""
+import socket
+import threading
+
+import pytest
+
+from itasca import p2pLinkClient, p2pLinkServer
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("", 0))
+        return s.getsockname()[1]
+
+def _retry_connect(connect):
+    """Call connect until the server it connects to is listening."""
+    for _ in range(100):
+        try:
+            return connect()
+        except ConnectionRefusedError:
+            threading.Event().wait(0.05)
+    return connect()
+
+@pytest.fixture
+def free_port():
+    """A function returning a TCP port no server listens on."""
+    return _free_port
+
+@pytest.fixture
+def retry_connect():
+    """A function calling connect() until the server is listening and
+    returning its result."""
+    return _retry_connect
+
+@pytest.fixture
+def p2p_link():
+    """A function returning a p2pLinkServer and a p2pLinkClient connected
+    to it. The keyword dicts server_options and client_options go to the
+    constructors. Links still open at the end of the test are closed.
+    """
+    ends = []
+
+    def link(server_options={}, client_options={}):
+        port = _free_port()
+        server = p2pLinkServer(port, timeout=10.0, **server_options)
+        thread = threading.Thread(target=server.start)
+        thread.start()
+        client = p2pLinkClient(port, timeout=10.0, **client_options)
+        _retry_connect(lambda: client.connect("localhost"))
+        thread.join()
+        ends.extend((client, server))
+        return server, client
+
+    yield link
+    for end in ends:
+        if end.conn.fileno() != -1:
+            end.close()
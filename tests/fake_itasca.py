@@ -0,0 +1,140 @@
+"""Fake FLAC3D model for running itasca.meshConvert outside FLAC3D.
+
+Inside FLAC3D the itasca module has the gridpoint and zone modules (object
+access) and the gridpointarray and zonearray modules (array access) of the
+embedded Python. FakeModel builds a block of nx*ny*nz zones and installs
+the same functions on the itasca package so meshConvert can run
+headless. Zones cycle through brick, wedge, pyramid and tetra shapes when
+mixed is True.
+
+>>> with FakeModel(50, 50, 20):
+...     mesh = meshConvert.FLAC3D_mesh()
+"""
+
+from __future__ import print_function
+import sys
+import types
+
+import numpy as np
+
+import itasca
+
+# gridpoint offsets (i, j, k) of a brick in FLAC3D order; the first 6, 5
+# and 4 of them make the wedge, pyramid and tetra zones of the block
+_brick_corners = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1),
+                  (1, 1, 0), (0, 1, 1), (1, 0, 1), (1, 1, 1)]
+_shapes = [("brick", 8), ("wedge", 6), ("pyramid", 5), ("tetra", 4)]
+
+class _gridpoint(object):
+    def __init__(self, model, index):
+        self._model, self._index = model, index
+
+    def id(self):
+        return int(self._model.gridpoint_ids[self._index])
+
+    def pos(self):
+        return tuple(self._model.positions[self._index])
+
+class _zone(object):
+    def __init__(self, model, index):
+        self._model, self._index = model, index
+
+    def id(self):
+        return int(self._model.zone_ids[self._index])
+
+    def type(self):
+        return self._model.zone_shape(self._index)
+
+    def gridpoints(self):
+        return [self._model.gridpoints[i]
+                for i in self._model.connectivity[self._index] if i >= 0]
+
+class FakeModel(object):
+    """A block model installed as itasca.gridpoint, itasca.zone,
+    itasca.gridpointarray and itasca.zonearray. With arrays False only the
+    object modules are installed, which makes meshConvert use its slower
+    fallback path.
+    """
+    _modules = ("gridpoint", "zone", "gridpointarray", "zonearray",
+                "command")
+
+    def __init__(self, nx=10, ny=10, nz=10, mixed=True, arrays=True):
+        """(nx=10: int, ny=10: int, nz=10: int, mixed=True: bool,
+            arrays=True: bool) -> FakeModel. Constructor.
+        """
+        self.arrays = arrays
+        i, j, k = np.meshgrid(np.arange(nx + 1), np.arange(ny + 1),
+                              np.arange(nz + 1), indexing="ij")
+        grid = np.stack([i.ravel(order="F"), j.ravel(order="F"),
+                         k.ravel(order="F")], axis=1)
+        self.positions = grid * np.array([1.0, 1.5, 0.5])
+        self.gridpoint_ids = np.arange(1, len(grid) + 1, dtype=np.int64)
+
+        def index(i, j, k):
+            return i + (nx + 1) * (j + (ny + 1) * k)
+        i, j, k = np.meshgrid(np.arange(nx), np.arange(ny), np.arange(nz),
+                              indexing="ij")
+        i, j, k = i.ravel(order="F"), j.ravel(order="F"), k.ravel(order="F")
+        self.connectivity = np.stack([index(i + a, j + b, k + c)
+                                      for a, b, c in _brick_corners], axis=1)
+        self.shape_index = ((i + j + k) % len(_shapes) if mixed
+                            else np.zeros(len(i), dtype=np.int64))
+        for shape, (_, count) in enumerate(_shapes):
+            self.connectivity[self.shape_index == shape, count:] = -1
+        self.zone_ids = np.arange(1, len(i) + 1, dtype=np.int64)
+        self.gridpoints = [_gridpoint(self, n) for n in range(len(grid))]
+        self.commands = []  # commands passed to itasca.command
+
+    def zone_shape(self, index):
+        """(index: int) -> str. Shape name of zone index."""
+        return _shapes[self.shape_index[index]][0]
+
+    def _module_functions(self):
+        modules = {
+            "gridpoint": types.SimpleNamespace(
+                list=lambda: list(self.gridpoints),
+                count=lambda: len(self.gridpoints)),
+            "zone": types.SimpleNamespace(
+                list=lambda: [_zone(self, n)
+                              for n in range(len(self.zone_ids))],
+                count=lambda: len(self.zone_ids)),
+            "command": self.commands.append}
+        if self.arrays:
+            modules["gridpointarray"] = types.SimpleNamespace(
+                pos=lambda: self.positions,
+                ids=lambda: self.gridpoint_ids)
+            modules["zonearray"] = types.SimpleNamespace(
+                gridpoints=lambda: self.connectivity,
+                ids=lambda: self.zone_ids)
+        return modules
+
+    def install(self):
+        """() -> None. Install the model on the itasca package."""
+        self._saved = {name: getattr(itasca, name, None)
+                       for name in self._modules}
+        for name in self._modules:
+            if hasattr(itasca, name):
+                delattr(itasca, name)
+            sys.modules.pop("itasca." + name, None)
+        for name, module in self._module_functions().items():
+            setattr(itasca, name, module)
+            if name != "command":
+                sys.modules["itasca." + name] = module
+
+    def uninstall(self):
+        """() -> None. Restore the itasca package."""
+        for name, value in self._saved.items():
+            sys.modules.pop("itasca." + name, None)
+            if hasattr(itasca, name):
+                delattr(itasca, name)
+            if value is not None:
+                setattr(itasca, name, value)
+                if isinstance(value, types.ModuleType):
+                    sys.modules["itasca." + name] = value
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, eType, eValue, eTrace):
+        self.uninstall()
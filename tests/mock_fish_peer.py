@@ -0,0 +1,137 @@
+"""Headless stand-in for an Itasca code on the FISH socket.
+
+The Itasca codes connect to the Python side as a client
+(socket.open(0,1,3333) in FISH), send the handshake 178278912 and then
+exchange values framed as a type code followed by the value. MockFishPeer
+does the same from a background thread and echoes back every value it
+receives until it gets the integer -1. This allows the socket code to be
+exercised and timed without FLAC3D, PFC or UDEC.
+"""
+
+from __future__ import print_function
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+fishcode = 178278912
+
+def read_value(f):
+    """(f: file) -> any.
+    Read one framed FISH value from the binary file object f.
+    """
+    header = f.read(4)
+    if len(header) < 4:
+        raise EOFError("FISH socket closed")
+    type_code, = struct.unpack("i", header)
+    if type_code == 1:
+        return struct.unpack("i", f.read(4))[0]
+    if type_code == 2:
+        return struct.unpack("d", f.read(8))[0]
+    if type_code == 3:
+        length, = struct.unpack("i", f.read(4))
+        data = f.read(4*(1+(length-1)//4))
+        return data[:length].decode("utf-8")
+    if type_code == 5:
+        return list(struct.unpack("dd", f.read(16)))
+    if type_code == 6:
+        return list(struct.unpack("ddd", f.read(24)))
+    raise ValueError("unknown FISH type code {}".format(type_code))
+
+def frame_value(value):
+    """(value: any) -> bytes.
+    Frame value as the Itasca code would write it to the socket.
+    """
+    if type(value) is int:
+        return struct.pack("ii", 1, value)
+    if type(value) is float:
+        return struct.pack("=id", 2, value)
+    if type(value) is str:
+        data = value.encode("utf-8")
+        return (struct.pack("ii", 3, len(data)) +
+                data.ljust(4*(1+(len(data)-1)//4), b" "))
+    if len(value) == 2:
+        return struct.pack("=idd", 5, *value)
+    return struct.pack("=iddd", 6, *value)
+
+class MockFishPeer(threading.Thread):
+    """Connect to a FISH socket server and echo values back.
+
+    >>> peer = MockFishPeer(3333)
+    >>> peer.start()        # then call connect() on the Python side
+    """
+    def __init__(self, port=3333, host="localhost", connect_timeout=10.0):
+        """(port=3333: int, host="localhost": str,
+            connect_timeout=10.0: float) -> MockFishPeer. Constructor."""
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.host = host
+        self.connect_timeout = connect_timeout
+        self.count = 0  # number of values echoed
+
+    def _connect(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                return socket.create_connection((self.host, self.port))
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    def handle(self, value):
+        """(value: any) -> any.
+        Value sent back for each received value. Override to change the
+        echo behaviour.
+        """
+        return value
+
+    def run(self):
+        sock = self._connect()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        f = sock.makefile("rb")
+        self.sock, self.file = sock, f  # for handle() in subclasses
+        try:
+            sock.sendall(struct.pack("i", fishcode))
+            while True:
+                value = read_value(f)
+                if type(value) is int and value == -1:
+                    break
+                sock.sendall(frame_value(self.handle(value)))
+                self.count += 1
+        except EOFError:
+            pass
+        finally:
+            f.close()
+            sock.close()
+
+class FishStreamPeer(MockFishPeer):
+    """MockFishPeer which also moves float arrays in bulk, for throughput
+    measurements. Two string requests are understood besides the echo:
+
+    "sink" followed by an int n and n floats: the floats are read in one
+    go and n is sent back.
+
+    "source" followed by an int n: n floats are sent back in one write,
+    followed by n.
+    """
+    record = np.dtype([("code", "=i4"), ("value", "=f8")])  # float message
+
+    def handle(self, value):
+        if value == "sink":
+            n = read_value(self.file)
+            records = np.frombuffer(self.file.read(n * self.record.itemsize),
+                                    dtype=self.record)
+            assert len(records) == n and (records["code"] == 2).all()
+            return n
+        if value == "source":
+            n = read_value(self.file)
+            records = np.empty(n, dtype=self.record)
+            records["code"] = 2
+            records["value"] = np.arange(n)
+            self.sock.sendall(records.tobytes())
+            return n
+        return value
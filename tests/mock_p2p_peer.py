@@ -0,0 +1,71 @@
+"""Headless far end of a Python to Python socket link.
+
+MockP2PPeer connects to a p2pLinkServer from a background thread, the way
+a second Python instance would, and answers every value it receives until
+it gets the integer -1. By default it echoes the value back; with
+echo=False arrays are answered with their size in bytes so only one
+direction carries the data.
+"""
+
+from __future__ import print_function
+import threading
+import time
+
+import numpy as np
+
+from itasca import p2pLinkClient
+
+class MockP2PPeer(threading.Thread):
+    """Connect to a p2p link server and answer values.
+
+    >>> peer = MockP2PPeer(5000)
+    >>> peer.start()        # then call start() on the p2pLinkServer
+    """
+    def __init__(self, port=5000, host="localhost", echo=True,
+                 compression=None, connect_timeout=10.0):
+        """(port=5000: int, host="localhost": str, echo=True: bool,
+            compression=None, connect_timeout=10.0: float) -> MockP2PPeer.
+        Constructor. compression is passed to p2pLinkClient.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.host = host
+        self.echo = echo
+        self.compression = compression
+        self.connect_timeout = connect_timeout
+        self.count = 0  # number of values answered
+
+    def _connect(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            link = p2pLinkClient(self.port, compression=self.compression)
+            try:
+                link.connect(self.host)
+                return link
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    def handle(self, value):
+        """(value: any) -> any.
+        Value sent back for each received value.
+        """
+        if not self.echo and isinstance(value, np.ndarray):
+            return value.nbytes
+        return value
+
+    def run(self):
+        link = self._connect()
+        try:
+            while True:
+                value = link.read_data()
+                if type(value) is int and value == -1:
+                    break
+                link.send_data(self.handle(value))
+                self.count += 1
+        except ConnectionError:
+            pass
+        finally:
+            link.close()
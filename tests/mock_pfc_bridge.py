@@ -0,0 +1,120 @@
+"""Headless stand-in for PFC3D running pfc_bridge_server.p3dat.
+
+MockPFCBridge answers the bridge requests on the FISH socket the way the
+server loop in pfc_bridge_server.p3dat does, against a small model held in
+Python: a list of balls and a dict of FISH variables. This allows
+itasca.bridge to be tested without PFC3D.
+
+10 records the command and returns 0. 11 returns the value of a FISH
+variable or of a ball property like b_rad(find_ball(3)), pointers are
+returned as ":ball: 3" strings and None as ":null:". 12 assigns a FISH
+variable or a ball property and returns 0. 13 sends the ball count, the
+values of a ball quantity in writes of up to 999 values and 0. 14 reads
+a ball quantity and returns the ball count; the values are assigned only
+if their count is the ball count.
+"""
+
+import re
+
+from .mock_fish_peer import MockFishPeer, frame_value, read_value
+
+# FISH ball property of each component of the array quantities
+_ball_quantities = {"positions": ("x", "y", "z"),
+                    "velocities": ("xvel", "yvel", "zvel"),
+                    "radii": ("rad",),
+                    "ids": ("id",)}
+
+_ball_property = re.compile(r"^b_(\w+)\(find_ball\((\d+)\)\)$")
+
+class MockPFCBridge(MockFishPeer):
+    """MockFishPeer answering the PFC bridge requests 10 to 14.
+
+    >>> peer = MockPFCBridge(3333, balls=[{"id": 1, "rad": 0.5}])
+    >>> peer.start()        # then attach a PFC3D_Connection
+    """
+    buffer_size = 999  # values per write of the ball arrays, as in FISH
+
+    def __init__(self, port=3333, balls=(), fish=None, **kwargs):
+        """(port=3333: int, balls=(): [dict], fish=None: dict, ...)
+            -> MockPFCBridge.
+        balls are dicts of ball properties (id, x, y, z, xvel, yvel, zvel,
+        rad), fish maps FISH variable names to values; a value
+        ("ball", 3) is a pointer to ball 3.
+        """
+        MockFishPeer.__init__(self, port, **kwargs)
+        self.balls = []
+        for ball in balls:
+            properties = dict.fromkeys(("x", "y", "z", "xvel", "yvel",
+                                        "zvel", "rad"), 0.0)
+            properties.update(ball)
+            self.balls.append(properties)
+        self.fish = dict(fish or {})
+        self.commands = []  # text of the 10 requests
+        self.requests = []  # (code, text) of every request
+
+    def _ball(self, ball_id):
+        return next(ball for ball in self.balls if ball["id"] == ball_id)
+
+    def _evaluate(self, expression):
+        match = _ball_property.match(expression)
+        if match:
+            value = self._ball(int(match.group(2)))[match.group(1)]
+        else:
+            value = self.fish[expression]
+        if value is None:
+            return ":null:"
+        if type(value) is tuple:
+            return ":{}: {}".format(*value)
+        return value
+
+    def _assign(self, statement):
+        name, _, text = statement.partition("=")
+        name, text = name.strip(), text.strip()
+        for convert in (int, float, str):
+            try:
+                value = convert(text)
+                break
+            except ValueError:
+                pass
+        match = _ball_property.match(name)
+        if match:
+            self._ball(int(match.group(2)))[match.group(1)] = value
+        else:
+            self.fish[name] = value
+
+    def _send_ball_array(self, quantity):
+        self.sock.sendall(frame_value(len(self.balls)))
+        values = [ball[name] for ball in self.balls
+                  for name in _ball_quantities[quantity]]
+        for start in range(0, len(values), self.buffer_size):
+            self.sock.sendall(b"".join(
+                frame_value(value)
+                for value in values[start:start + self.buffer_size]))
+
+    def _receive_ball_array(self, quantity):
+        names = _ball_quantities[quantity]
+        n = read_value(self.file)
+        values = [read_value(self.file) for _ in range(n * len(names))]
+        if n == len(self.balls):
+            for i, ball in enumerate(self.balls):
+                for j, name in enumerate(names):
+                    ball[name] = values[i * len(names) + j]
+        return len(self.balls)
+
+    def handle(self, code):
+        text = read_value(self.file)
+        self.requests.append((code, text))
+        if code == 10:
+            self.commands.append(text)
+            return 0
+        if code == 11:
+            return self._evaluate(text)
+        if code == 12:
+            self._assign(text)
+            return 0
+        if code == 13:
+            self._send_ball_array(text)
+            return 0
+        if code == 14:
+            return self._receive_ball_array(text)
+        raise ValueError("unknown input to PFC/python bridge server")
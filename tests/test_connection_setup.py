@@ -0,0 +1,77 @@
+"""Executable lookup and FISH socket port selection of the Itasca
+connections. These tests do not need an Itasca code."""
+import os
+import stat
+
+import pytest
+
+from itasca import FLAC3D_Connection, UDEC_Connection
+from itasca.main import _fish_base_port
+from .mock_fish_peer import MockFishPeer
+
+def _program(folder, name):
+    filename = str(folder / name)
+    with open(filename, "w") as f:
+        f.write("#!/bin/sh\n")
+    os.chmod(filename, os.stat(filename).st_mode | stat.S_IXUSR)
+    return filename
+
+@pytest.fixture
+def code_class(tmp_path, monkeypatch):
+    class ItascaTestCode(FLAC3D_Connection):
+        default_executable = ("C:\\Program Files\\Itasca\\Missing\\"
+                              "itasca_test_code.exe")
+        executable_environment = "ITASCA_TEST_CODE_EXECUTABLE"
+
+    monkeypatch.delenv("ITASCA_TEST_CODE_EXECUTABLE", raising=False)
+    monkeypatch.setenv("PATH", str(tmp_path))
+    return ItascaTestCode
+
+def test_environment_overrides_executable(code_class, tmp_path, monkeypatch):
+    _program(tmp_path, "itasca_test_code.exe")
+    monkeypatch.setenv("ITASCA_TEST_CODE_EXECUTABLE", "/opt/itasca/code")
+    assert code_class.find_executable() == "/opt/itasca/code"
+    monkeypatch.setenv("ITASCA_FLAC3D_EXECUTABLE", "/opt/itasca/flac3d")
+    assert FLAC3D_Connection().executable_name == "/opt/itasca/flac3d"
+    assert FLAC3D_Connection(executable="flac3d").executable_name == "flac3d"
+
+def test_executable_on_path(code_class, tmp_path):
+    filename = _program(tmp_path, "itasca_test_code.exe")
+    assert code_class.find_executable() == filename
+
+def test_default_install_location(code_class, tmp_path):
+    _program(tmp_path, "itasca_test_code.exe")
+    (tmp_path / "install").mkdir()
+    code_class.default_executable = _program(tmp_path / "install",
+                                             "itasca_test_code.exe")
+    assert code_class.find_executable() == code_class.default_executable
+
+def test_executable_not_found(code_class):
+    assert code_class.find_executable() == code_class.default_executable
+    code_class.default_executable = None
+    assert code_class.find_executable() is None
+
+def test_fish_base_port(monkeypatch):
+    monkeypatch.delenv("ITASCA_FISH_BASE_PORT", raising=False)
+    assert _fish_base_port() == 3333
+    assert UDEC_Connection(2).server.port == 3335
+    monkeypatch.setenv("ITASCA_FISH_BASE_PORT", "4000")
+    assert _fish_base_port() == 4000
+    assert FLAC3D_Connection(2).server.port == 4002
+    # an explicit port ignores the base port and the socket id
+    assert FLAC3D_Connection(2, port=5000).server.port == 5000
+
+def test_explicit_port_and_host(free_port):
+    port = free_port()
+    connection = FLAC3D_Connection(port=port, host="127.0.0.1", timeout=10.0)
+    peer = MockFishPeer(port, host="127.0.0.1")
+    peer.start()
+    connection.attach()
+    try:
+        assert connection.server.socket.getsockname() == ("127.0.0.1", port)
+        connection.send(1.5)
+        assert connection.receive() == 1.5
+    finally:
+        connection.send(-1)
+        peer.join()
+        connection.end()
@@ -0,0 +1,204 @@
+"""FishBinaryWriter and FishBinaryReader round trips. These tests do not
+need an Itasca code."""
+import os
+import time
+
+import numpy as np
+import pytest
+
+from itasca import (FishBinaryReader, FishBinaryWriter,
+                    UDECFishBinaryReader, UDECFishBinaryWriter)
+
+mixed = [1, -7, 2.5, "James", "", "abcd", "abcde", [1.0, 2.0],
+         [7.0, 8.0, 9.0], True, False, 3]
+
+def _write(tmp_path, data, writer=FishBinaryWriter, name="data.fish"):
+    filename = str(tmp_path / name)
+    writer(filename, data)
+    return filename
+
+@pytest.mark.parametrize("data", [
+    [1, 2, -3, 2147483647],
+    [1.5, -2.25, 1e300],
+    ["a", "James", "", "four", "héllo"],
+    [[1.0, 2.0], [3.0, -4.0]],
+    [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]],
+    [True, False, True],
+    mixed,
+])
+@pytest.mark.parametrize("writer,reader", [
+    (FishBinaryWriter, FishBinaryReader),
+    (UDECFishBinaryWriter, UDECFishBinaryReader),
+])
+def test_round_trip(tmp_path, data, writer, reader):
+    filename = _write(tmp_path, data, writer)
+    assert reader(filename).aslist() == data
+
+def test_udec_ints_are_eight_bytes(tmp_path):
+    filename = _write(tmp_path, [1, 2], UDECFishBinaryWriter)
+    with open(filename, "rb") as f:
+        assert len(f.read()) == 8 + 2 * 16
+
+@pytest.mark.parametrize("array", [
+    np.arange(10, dtype=np.int32),
+    np.arange(10, dtype=np.int64),
+    np.linspace(0.0, 1.0, 11),
+    np.array([True, False, True]),
+    np.arange(20.0).reshape(10, 2),
+    np.arange(30.0).reshape(10, 3),
+])
+@pytest.mark.parametrize("writer,reader", [
+    (FishBinaryWriter, FishBinaryReader),
+    (UDECFishBinaryWriter, UDECFishBinaryReader),
+])
+def test_array_round_trip(tmp_path, array, writer, reader):
+    filename = _write(tmp_path, array, writer)
+    values = reader(filename).asarray()
+    assert values.shape == array.shape
+    assert np.array_equal(values, array)
+    # the bulk path writes the same bytes as the value by value path
+    other = _write(tmp_path, array.tolist(), writer, "list.fish")
+    with open(filename, "rb") as f, open(other, "rb") as g:
+        assert f.read() == g.read()
+
+def test_asarray_view(tmp_path):
+    filename = _write(tmp_path, np.linspace(0.0, 1.0, 100))
+    values = FishBinaryReader(filename).asarray(copy=False)
+    assert isinstance(values, np.memmap)
+    assert not values.flags.writeable
+    assert np.array_equal(values, np.linspace(0.0, 1.0, 100))
+
+def test_asarray_mixed_types(tmp_path):
+    filename = _write(tmp_path, [1, 2.5, 3])
+    assert FishBinaryReader(filename).asarray().tolist() == [1, 2.5, 3]
+    filename = _write(tmp_path, ["a", "bc"], name="strings.fish")
+    assert FishBinaryReader(filename).asarray().tolist() == ["a", "bc"]
+
+def test_out_of_range_int(tmp_path):
+    with pytest.raises(ValueError):
+        _write(tmp_path, np.array([2 ** 40]))
+
+def test_unsupported_type(tmp_path):
+    with pytest.raises(TypeError):
+        _write(tmp_path, [{"a": 1}])
+
+@pytest.mark.parametrize("reader,writer", [
+    (FishBinaryReader, FishBinaryWriter),
+    (UDECFishBinaryReader, UDECFishBinaryWriter),
+])
+def test_empty_file(tmp_path, reader, writer):
+    fish_file = reader(_write(tmp_path, [], writer))
+    assert fish_file.aslist() == []
+    assert len(fish_file.asarray()) == 0
+    assert list(fish_file.iter_chunks(10)) == []
+    assert len(fish_file) == 0
+    assert fish_file[:] == []
+
+def test_iter_chunks(tmp_path):
+    data = list(range(25)) + [0.5, 1.5] + ["x", "yz"] + [[1.0, 2.0]] * 3
+    fish_file = FishBinaryReader(_write(tmp_path, data))
+    chunks = list(fish_file.iter_chunks(10))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5, 2, 2, 3]
+    assert np.concatenate(chunks[:3]).tolist() == list(range(25))
+    assert chunks[3].tolist() == [0.5, 1.5]
+    assert chunks[4].tolist() == ["x", "yz"]
+    assert chunks[5].shape == (3, 2)
+    bools = FishBinaryReader(_write(tmp_path, [True, False], name="b.fish"))
+    chunk, = bools.iter_chunks(10)
+    assert chunk.dtype == bool and chunk.tolist() == [True, False]
+
+@pytest.mark.parametrize("writer,reader", [
+    (FishBinaryWriter, FishBinaryReader),
+    (UDECFishBinaryWriter, UDECFishBinaryReader),
+])
+def test_iter_chunks_mixed_types(tmp_path, writer, reader):
+    pattern = [[7, 8, 9], [0.5], ["ab", "cde"], [-1, 2], [], ["", "f"]]
+    data = [value for i in range(1 << 13)
+            for value in pattern[i % len(pattern)]]
+    fish_file = reader(_write(tmp_path, data, writer))
+    start = time.perf_counter()
+    chunks = list(fish_file.iter_chunks(2))
+    assert time.perf_counter() - start < 2.0
+    assert [value for chunk in chunks for value in chunk.tolist()] == data
+    assert all(0 < len(chunk) <= 2 for chunk in chunks)
+    # a new chunk starts at each type change and runs are not split early
+    assert [len(chunk) for chunk in chunks[:6]] == [2, 1, 1, 2, 2, 2]
+
+def test_index(tmp_path):
+    fish_file = FishBinaryReader(_write(tmp_path, mixed))
+    assert len(fish_file) == len(mixed)
+    assert [fish_file[i] for i in range(len(mixed))] == mixed
+    assert fish_file[-1] == mixed[-1]
+    assert fish_file[2:9:3] == mixed[2:9:3]
+    with pytest.raises(IndexError):
+        fish_file[len(mixed)]
+    # indexing does not move the sequential reader
+    assert fish_file.read() == mixed[0]
+    assert fish_file[5] == mixed[5]
+    assert fish_file.read() == mixed[1]
+
+def test_index_sidecar(tmp_path):
+    filename = _write(tmp_path, list(range(100)) + ["a"] + [0.5] * 10)
+    sidecar = str(tmp_path / "data.idx.npy")
+    fish_file = FishBinaryReader(filename)
+    fish_file.build_index(sidecar)
+    # one run of ints, the string, one run of floats and the end
+    assert len(fish_file._index) == 4
+    other = FishBinaryReader(filename)
+    other.build_index(sidecar)
+    assert np.array_equal(other._index, fish_file._index)
+    assert other[100] == "a" and other[110] == 0.5
+
+def test_index_sidecar_checks_reader_and_size(tmp_path):
+    # both files are 40 bytes: 3 FLAC floats and 2 UDEC floats
+    flac = _write(tmp_path, [0.5] * 3, name="flac.fish")
+    udec = _write(tmp_path, [1.5, 2.5], UDECFishBinaryWriter, "udec.fish")
+    sidecar = str(tmp_path / "data.idx.npy")
+    FishBinaryReader(flac).build_index(sidecar)
+    fish_file = UDECFishBinaryReader(udec)
+    fish_file.build_index(sidecar)
+    assert len(fish_file) == 2 and fish_file[1] == 2.5
+    # an index for a file of another size is not used either
+    other = _write(tmp_path, [1.5, 2.5, 3.5], UDECFishBinaryWriter,
+                   "other.fish")
+    os.utime(other, (0, 0))
+    fish_file = UDECFishBinaryReader(other)
+    fish_file.build_index(sidecar)
+    assert len(fish_file) == 3
+
+def test_index_of_alternating_types_is_linear(tmp_path):
+    data = [i if i % 2 else i + 0.5 for i in range(1 << 16)]
+    fish_file = FishBinaryReader(_write(tmp_path, data))
+    start = time.perf_counter()
+    assert len(fish_file) == len(data)
+    assert time.perf_counter() - start < 2.0
+    assert fish_file[-1] == data[-1] and fish_file[1000] == data[1000]
+
+def test_runs_across_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(FishBinaryReader, "_scan_block", 7)
+    data = list(range(5)) + ["abcde", "", "xy"] + [0.5] * 4 + [[1.0, 2.0]]
+    fish_file = FishBinaryReader(_write(tmp_path, data))
+    assert [chunk.tolist() for chunk in fish_file.iter_chunks(3)] == [
+        [0, 1, 2], [3, 4], ["abcde", "", "xy"], [0.5] * 3, [0.5],
+        [[1.0, 2.0]]]
+    assert len(fish_file) == len(data)
+    assert [fish_file[i] for i in range(len(data))] == data
+
+def test_bool_does_not_build_index(tmp_path):
+    fish_file = FishBinaryReader(_write(tmp_path, [1, 2]))
+    assert fish_file
+    assert fish_file._index is None
+
+@pytest.mark.parametrize("writer,reader", [
+    (FishBinaryWriter, FishBinaryReader),
+    (UDECFishBinaryWriter, UDECFishBinaryReader),
+])
+def test_slices(tmp_path, writer, reader):
+    # ints and bools (and UDEC floats) have records of the same size
+    data = [1, True, 2.5, 3, False, "ab", [1.0, 2.0], 4, 5, 6, [1.0, 2.0, 3.0]]
+    fish_file = reader(_write(tmp_path, data, writer))
+    for k in (slice(None), slice(1, 9, 2), slice(None, None, -1),
+              slice(-3, 2, -3), slice(5, 5), slice(0, 100, 4)):
+        values = fish_file[k]
+        assert values == data[k]
+        assert [type(v) for v in values] == [type(v) for v in data[k]]
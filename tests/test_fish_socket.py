@@ -0,0 +1,108 @@
+"""FISH socket tests against the headless MockFishPeer. These tests do not
+need an Itasca code."""
+import struct
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from itasca import FLAC3D_Connection, ItascaConnectionError
+from .mock_fish_peer import MockFishPeer, fishcode
+
+@pytest.fixture
+def connection(free_port):
+    port = free_port()
+    connection = FLAC3D_Connection(port=port, timeout=10.0)
+    peer = MockFishPeer(port)
+    peer.start()
+    connection.attach()
+    yield connection
+    connection.send(-1)
+    peer.join()
+    connection.end()
+
+def test_echo(connection):
+    for value in (1, -2.5, "James", "", "abcd", [1.0, 2.0], [1.0, 2.0, 3.0]):
+        connection.send(value)
+        assert connection.receive() == value
+
+def test_send_many(connection):
+    values = [1, 2.5, "abc", [1.0, 2.0], np.arange(3.0),
+              np.array(["de", "fgh"]), np.int64(4), np.float32(0.5)]
+    connection.send_many(values)
+    expected = [1, 2.5, "abc", [1.0, 2.0], 0.0, 1.0, 2.0, "de", "fgh", 4,
+                0.5]
+    assert connection.receive_many(len(expected)) == expected
+
+def test_stats_count_every_value(connection):
+    stats = connection.enable_stats()
+    connection.send_many(np.array(["ab", "cde", "f"]))
+    assert connection.receive_many(3).tolist() == ["ab", "cde", "f"]
+    connection.send_many([1, 2, np.array([1.5, 2.5]), np.array([3, 4]),
+                          np.array([5, "gh"], dtype=object)])
+    assert connection.receive_many(8) == [1, 2, 1.5, 2.5, 3, 4, 5, "gh"]
+    assert stats.sent == {1: [5, 40], 2: [2, 24], 3: [4, 48]}
+    assert stats.sent == stats.received
+
+def test_bool_is_rejected(connection):
+    with pytest.raises(TypeError):
+        connection.send(True)
+    with pytest.raises(TypeError):
+        connection.send_many([1, np.bool_(False)])
+    with pytest.raises(TypeError):
+        connection.send_many(np.array([True, False]))
+    with pytest.raises(TypeError):
+        connection.send_many([1, np.zeros(2, dtype=bool)])
+    connection.send(3)  # nothing was sent by the failed calls
+    assert connection.receive() == 3
+
+class _silentPeer(MockFishPeer):
+    """Sends the handshake and then neither reads nor writes until done is
+    set."""
+    def __init__(self, port):
+        MockFishPeer.__init__(self, port)
+        self.done = threading.Event()
+
+    def run(self):
+        sock = self._connect()
+        try:
+            sock.sendall(struct.pack("i", fishcode))
+            self.done.wait(30.0)
+        finally:
+            sock.close()
+
+@pytest.fixture
+def silent(free_port):
+    port = free_port()
+    connection = FLAC3D_Connection(port=port, timeout=0.5)
+    peer = _silentPeer(port)
+    peer.start()
+    connection.attach()
+    yield connection
+    peer.done.set()
+    peer.join()
+    connection.end()
+
+def test_accept_timeout(free_port):
+    connection = FLAC3D_Connection(port=free_port(), timeout=0.2)
+    start = time.monotonic()
+    with pytest.raises(ItascaConnectionError) as error:
+        connection.attach()
+    assert time.monotonic() - start < 5.0
+    assert isinstance(error.value.__cause__, TimeoutError)
+    connection.server.socket.close()
+
+def test_read_timeout(silent):
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        silent.receive()
+    with pytest.raises(TimeoutError):
+        silent.receive_many(3)
+    assert time.monotonic() - start < 5.0
+
+def test_send_timeout(silent):
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        silent.send_many(np.zeros(5 * 10 ** 6))  # more than the buffers hold
+    assert time.monotonic() - start < 5.0
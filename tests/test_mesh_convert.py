@@ -0,0 +1,203 @@
+"""meshConvert tests on a FakeModel. These tests do not need FLAC3D."""
+import struct
+
+import numpy as np
+import pytest
+
+from itasca import meshConvert
+from .fake_itasca import FakeModel
+
+def _mesh(model):
+    with model:
+        return meshConvert.FLAC3D_mesh()
+
+def test_single_brick_layout(tmp_path):
+    filename = str(tmp_path / "brick.msh")
+    with FakeModel(1, 1, 1, mixed=False):
+        meshConvert.FLAC3D_to_gmsh(filename)
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    assert lines[:5] == ["$MeshFormat", "2.2 0 8", "$EndMeshFormat",
+                         "$Nodes", "8"]
+    assert lines[5] == "1 0.0 0.0 0.0"
+    assert lines[13:17] == ["$EndNodes", "$Elements", "1",
+                            "1 5 2 99 2 3 4 8 7 1 2 6 5"]
+
+def test_array_and_object_paths_agree(tmp_path):
+    model = FakeModel(4, 3, 2)
+    files = []
+    for arrays in (True, False):
+        model.arrays = arrays
+        files.append(str(tmp_path / "mesh_{}.msh".format(arrays)))
+        with model:
+            meshConvert.FLAC3D_to_gmsh(files[-1])
+    with open(files[0]) as f, open(files[1]) as g:
+        assert f.read() == g.read()
+    mesh = _mesh(model)
+    for zone_type in ("brick", "wedge", "pyramid", "tetra"):
+        count = meshConvert.zone_types[zone_type][0]
+        assert mesh[zone_type].shape[1] == count
+        assert np.array_equal(mesh[zone_type],
+                              model.connectivity[mesh[zone_type + "_zones"],
+                                                 :count])
+
+def _assert_same_mesh(mesh, other):
+    assert sorted(mesh) == sorted(other)
+    for key in mesh:
+        assert np.array_equal(mesh[key], other[key]), key
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_gmsh_round_trip(tmp_path, binary):
+    mesh = _mesh(FakeModel(5, 4, 3))
+    filename = str(tmp_path / "mesh.msh")
+    meshConvert.write_gmsh(filename, mesh, binary=binary)
+    _assert_same_mesh(meshConvert.read_mesh(filename), mesh)
+
+def test_binary_gmsh_other_byte_order(tmp_path):
+    mesh = _mesh(FakeModel(2, 2, 2))
+    filename = str(tmp_path / "mesh.msh")
+    meshConvert.write_gmsh(filename, mesh, binary=True)
+    with open(filename, "rb") as f:
+        data = f.read()
+    # swap the byte order of every binary record
+    swapped = data.replace(struct.pack("=i", 1) + b"\n$EndMeshFormat",
+                           struct.pack("=i", 1)[::-1] + b"\n$EndMeshFormat")
+    node_count, offset = meshConvert._section(swapped, b"Nodes")
+    nodes = np.frombuffer(swapped, dtype=[("number", "=i4"),
+                                          ("position", "=f8", 3)],
+                          count=node_count, offset=offset)
+    _, element_offset = meshConvert._section(swapped, b"Elements")
+    end = swapped.index(b"\n$EndElements")
+    elements = np.frombuffer(swapped[element_offset:end], dtype="=i4")
+    swapped = (swapped[:offset] + nodes.byteswap().tobytes() +
+               swapped[offset + nodes.nbytes:element_offset] +
+               elements.byteswap().tobytes() + swapped[end:])
+    with open(filename, "wb") as f:
+        f.write(swapped)
+    _assert_same_mesh(meshConvert.read_gmsh(filename), mesh)
+
+def test_binary_gmsh_node_bytes_like_a_section(tmp_path):
+    mesh = _mesh(FakeModel(2, 2, 2))
+    # coordinates whose bytes spell "$Elements"
+    mesh["positions"] = mesh["positions"].copy()
+    mesh["positions"][0, :2] = np.frombuffer(b"$Elements".ljust(16, b"\0"),
+                                             dtype="=f8")
+    filename = str(tmp_path / "mesh.msh")
+    meshConvert.write_gmsh(filename, mesh, binary=True)
+    with open(filename, "rb") as f:
+        data = f.read()
+    assert data.index(b"$Elements") < data.index(b"$EndNodes")
+    _assert_same_mesh(meshConvert.read_gmsh(filename), mesh)
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_npz_round_trip(tmp_path, compressed):
+    filename = str(tmp_path / "mesh.npz")
+    with FakeModel(5, 4, 3) as model:
+        meshConvert.FLAC3D_to_npz(filename, compressed)
+    _assert_same_mesh(meshConvert.read_mesh(filename), _mesh(model))
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_series_displacement(tmp_path, binary):
+    filename = str(tmp_path / "series.msh")
+    series = meshConvert.GmshSeries(filename, binary)
+    with FakeModel(3, 2, 2) as model:
+        original = model.positions
+        density = np.arange(len(model.zone_ids), dtype=np.float64)
+        series.write_step(zone_fields={"density": density})
+        series.write_step()
+        model.positions = original + [0.0, 0.0, 0.5]
+        series.write_step(time=5.0)
+        series.write_step()  # the model has not moved since the last step
+        model.positions = original
+        series.write_step()
+    _assert_same_mesh(meshConvert.read_gmsh(filename), series.mesh)
+    fields = meshConvert.read_gmsh_fields(filename)
+    assert [time for time, _ in fields["displacement"]] == [5.0, 3.0, 4.0]
+    moved, still, back = [values for _, values in fields["displacement"]]
+    assert np.array_equal(moved, np.tile([0.0, 0.0, 0.5],
+                                         (len(original), 1)))
+    assert np.array_equal(still, moved)
+    assert not back.any()
+    time, values = fields["density"][0]
+    assert time == 0.0 and np.array_equal(values, density)
+
+def _read_f3grid(filename):
+    """(filename: str) -> (dict, dict).
+    Gridpoint positions by id and (keyword, gridpoint ids) by zone id."""
+    gridpoints, zones = {}, {}
+    with open(filename) as f:
+        for line in f:
+            fields = line.split()
+            if fields[0] == "G":
+                gridpoints[int(fields[1])] = tuple(map(float, fields[2:]))
+            elif fields[0] == "Z":
+                zones[int(fields[2])] = (fields[1],
+                                         tuple(map(int, fields[3:])))
+    return gridpoints, zones
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_gmsh_to_FLAC3D(tmp_path, binary):
+    mesh = _mesh(FakeModel(4, 3, 2))
+    filename = str(tmp_path / "mesh.msh")
+    grid_filename = str(tmp_path / "mesh.f3grid")
+    meshConvert.write_gmsh(filename, mesh, binary=binary)
+    with FakeModel(1, 1, 1) as target:
+        assert meshConvert.gmsh_to_FLAC3D(filename,
+                                          grid_filename) == grid_filename
+    assert target.commands == ['zone import "{}"'.format(grid_filename)]
+    gridpoints, zones = _read_f3grid(grid_filename)
+    expected, used = {}, set()
+    for zone_type, keyword in meshConvert.f3grid_zone_types.items():
+        if zone_type in mesh:
+            for zone, nodes in zip(mesh[zone_type + "_zones"],
+                                   mesh[zone_type]):
+                expected[int(mesh["zone_ids"][zone])] = (
+                    keyword, tuple(int(i) for i in
+                                   mesh["gridpoint_ids"][nodes]))
+                used.update(nodes.tolist())
+    assert zones == expected
+    assert gridpoints == {int(mesh["gridpoint_ids"][i]):
+                          tuple(mesh["positions"][i].tolist())
+                          for i in used}
+
+def test_f3grid_leaves_out_unused_gridpoints(tmp_path):
+    mesh = _mesh(FakeModel(2, 1, 1, mixed=False))
+    for key in ("brick", "brick_zones"):
+        mesh[key] = mesh[key][:1]
+    filename = meshConvert.write_f3grid(str(tmp_path / "mesh.f3grid"), mesh)
+    gridpoints, zones = _read_f3grid(filename)
+    used = mesh["gridpoint_ids"][mesh["brick"][0]]
+    assert sorted(gridpoints) == sorted(used.tolist())
+    assert list(zones) == [1]
+
+def test_degenerate_bricks(tmp_path):
+    model = FakeModel(3, 2, 2, mixed=False)
+    model.connectivity[::2, 7] = -1  # every other brick loses gridpoint 7
+    mesh = _mesh(model)
+    assert len(mesh["dbrick"]) == len(mesh["brick"]) == 6
+    filename = meshConvert.write_gmsh(str(tmp_path / "mesh.msh"), mesh)
+    with open(filename) as f:
+        elements = f.read().split("$Elements\n")[1].splitlines()[1:13]
+    # the hexahedron of a degenerate brick repeats gridpoint 6 for corner 7
+    for line in elements:
+        nodes = line.split()[5:]
+        zone = int(line.split()[0]) - 1
+        assert (nodes[2] == nodes[6]) == (zone % 2 == 0)
+    for binary in (False, True):
+        meshConvert.write_gmsh(filename, mesh, binary=binary)
+        _assert_same_mesh(meshConvert.read_gmsh(filename), mesh)
+    _, zones = _read_f3grid(meshConvert.write_f3grid(
+        str(tmp_path / "mesh.f3grid"), mesh))
+    assert [zones[i][0] for i in sorted(zones)] == ["B7", "B8"] * 6
+    assert all(len(nodes) == 7 for keyword, nodes in zones.values()
+               if keyword == "B7")
+
+def test_parallel_formatting(tmp_path, monkeypatch):
+    monkeypatch.setattr(meshConvert, "_rows_per_write", 100)
+    monkeypatch.setattr(meshConvert, "_blocks_ahead", 2)
+    mesh = _mesh(FakeModel(8, 7, 6))
+    for write in (meshConvert.write_gmsh, meshConvert.write_f3grid):
+        serial = write(str(tmp_path / "serial"), mesh)
+        parallel = write(str(tmp_path / "parallel"), mesh, workers=2)
+        with open(serial, "rb") as f, open(parallel, "rb") as g:
+            assert f.read() == g.read()
@@ -0,0 +1,84 @@
+"""ModelPool tests with the headless MockFishPeer in place of the Itasca
+code. These tests do not need an Itasca code."""
+import os
+import time
+
+import pytest
+
+from itasca import FLAC3D_Connection, ItascaConnectionError, ModelPool
+from .mock_fish_peer import MockFishPeer
+
+class _runningPeer(object):
+    """Stands in for the Popen object of a launched instance."""
+    def __init__(self, peer):
+        self.peer = peer
+
+    def poll(self):
+        return None if self.peer.is_alive() else 0
+
+class MockConnection(FLAC3D_Connection):
+    """Starts a MockFishPeer thread instead of launching FLAC3D."""
+    def start(self, datafile_name):
+        with open(datafile_name) as f:
+            assert "itasca_pool_port = {}".format(self.server.port) in f.read()
+        peer = MockFishPeer(self.server.port)
+        peer.start()
+        self.process = _runningPeer(peer)
+
+class _exitedProcess(object):
+    def poll(self):
+        return 1
+
+class CrashingConnection(FLAC3D_Connection):
+    """The launched instance exits before it connects."""
+    def start(self, datafile_name):
+        self.process = _exitedProcess()
+
+class MissingConnection(FLAC3D_Connection):
+    executable_environment = None
+    default_executable = "/nonexistent/itasca_pool_test_executable"
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch, free_port):
+    monkeypatch.setenv("ITASCA_FISH_BASE_PORT", str(free_port()))
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    return tmp_path
+
+def echo(connection, datafile):
+    connection.send(datafile)
+    value = connection.receive()
+    connection.send(-1)
+    return value
+
+def test_map(workdir):
+    pool = ModelPool(MockConnection, size=1, timeout=10.0)
+    assert pool.map(echo, ["a.dat", "b.dat"]) == ["a.dat", "b.dat"]
+    # the temporary launcher folder is removed
+    assert os.listdir(str(workdir)) == []
+
+def test_launch_failure_is_retried(workdir):
+    pool = ModelPool(MissingConnection, size=1, retries=2, timeout=1.0)
+    with pytest.raises(ItascaConnectionError):
+        pool.map(echo, ["a.dat"])
+    assert os.listdir(str(workdir)) == []
+
+def test_exit_before_connecting(workdir):
+    pool = ModelPool(CrashingConnection, size=1, retries=1)  # no timeout
+    start = time.monotonic()
+    with pytest.raises(ItascaConnectionError):
+        pool.map(echo, ["a.dat"])
+    assert time.monotonic() - start < 5.0
+
+def test_task_error_is_not_retried(workdir):
+    calls = []
+
+    def task(connection, datafile):
+        calls.append(datafile)
+        connection.send(-1)
+        raise OSError("not a connection problem")
+
+    pool = ModelPool(MockConnection, size=1, retries=2, timeout=10.0)
+    with pytest.raises(OSError) as error:
+        pool.map(task, ["a.dat"])
+    assert not isinstance(error.value, ItascaConnectionError)
+    assert calls == ["a.dat"]
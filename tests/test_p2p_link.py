@@ -0,0 +1,334 @@
+"""Python to Python link tests over local sockets. These tests do not need
+an Itasca code."""
+import asyncio
+import json
+import socket
+import struct
+import threading
+
+import numpy as np
+import pytest
+
+from itasca import (AsyncP2PLink, p2pLinkClient, p2pLinkMultiServer,
+                    p2pLinkServer)
+from itasca.main import (_descr_from_json, _p2p_decoder, _p2p_encode,
+                         _p2p_frames, _shuffle, _structure_frames,
+                         _unshuffle)
+
+def _recv_exactly(sock, byte_count):
+    data = b""
+    while len(data) < byte_count:
+        chunk = sock.recv(byte_count - len(data))
+        assert chunk
+        data += chunk
+    return data
+
+@pytest.fixture
+def raw_link(free_port, retry_connect):
+    """A p2pLinkServer connected to a plain socket which speaks the
+    original wire format."""
+    port = free_port()
+    server = p2pLinkServer(port, timeout=10.0)
+    thread = threading.Thread(target=server.start)
+    thread.start()
+    sock = retry_connect(lambda: socket.create_connection(("localhost", port),
+                                                          timeout=10.0))
+    sock.sendall(struct.pack("ii", 1, p2pLinkServer.code))
+    thread.join()
+    yield server, sock
+    sock.close()
+    server.close()
+
+@pytest.mark.parametrize("text", ["", "a", "abcd", "James", "héllo"])
+def test_string_wire_layout(raw_link, text):
+    # strings are followed by three pad bytes, as sent by existing peers
+    server, sock = raw_link
+    data = text.encode("utf-8")
+    server.send_data(text)
+    frame = _recv_exactly(sock, 8 + len(data) + 3)
+    assert frame[:8 + len(data)] == struct.pack("ii", 3, len(data)) + data
+    sock.sendall(frame[:8 + len(data)] + b"   " +
+                 struct.pack("ii", 1, 42))
+    assert server.read_data() == text
+    assert server.read_data() == 42
+
+def test_scalar_wire_layout(raw_link):
+    server, sock = raw_link
+    server.send_data(7)
+    server.send_data(2.5)
+    server.send_data([1.0, 2.0])
+    server.send_data([1.0, 2.0, 3.0])
+    expected = (struct.pack("ii", 1, 7) + struct.pack("=id", 2, 2.5) +
+                struct.pack("=idd", 5, 1.0, 2.0) +
+                struct.pack("=iddd", 6, 1.0, 2.0, 3.0))
+    assert _recv_exactly(sock, len(expected)) == expected
+
+@pytest.fixture
+def link(p2p_link):
+    """A connected p2pLinkServer and p2pLinkClient."""
+    return p2p_link()
+
+def test_round_trip(link):
+    server, client = link
+    values = [1, -2.5, "James", "", [1.0, 2.0], [1.0, 2.0, 3.0], {"a": 1}]
+    for value in values:
+        client.send_data(value)
+    assert [server.read_data() for _ in values] == values
+    array = np.arange(12.0).reshape(3, 4)
+    server.send_data(array)
+    server.send_data(np.asfortranarray(array))
+    assert np.array_equal(client.read_data(), array)
+    fortran = client.read_data()
+    assert fortran.flags.f_contiguous and np.array_equal(fortran, array)
+
+def test_async_link(free_port):
+    port = free_port()
+
+    async def serve():
+        async with AsyncP2PLink(port, timeout=10.0) as link:
+            await link.start()
+            await link.send(await link.recv())
+
+    async def main():
+        for _ in range(2):  # the port can be used again right away
+            server = asyncio.ensure_future(serve())
+            await asyncio.sleep(0.1)
+            async with AsyncP2PLink(port, timeout=10.0) as link:
+                await link.connect("localhost")
+                await link.send(np.arange(5.0))
+                assert np.array_equal(await link.recv(), np.arange(5.0))
+            await server
+
+    asyncio.run(main())
+
+def _connect(retry_connect, port):
+    client = p2pLinkClient(port, timeout=10.0)
+    retry_connect(lambda: client.connect("localhost"))
+    return client
+
+def test_multi_server_slow_client(free_port, retry_connect):
+    port = free_port()
+    server = p2pLinkMultiServer(port, handler=lambda c, v: c.send_data(v),
+                                timeout=2.0)
+    server.start()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        slow = _connect(retry_connect, port)
+        fast = _connect(retry_connect, port)
+        big = np.zeros(10 ** 6)
+        for _ in range(20):  # far more than the socket buffers hold
+            slow.send_data(big)
+        for i in range(20):
+            fast.send_data(i)
+            assert fast.read_data() == i
+        assert any(client.pending for client in server.clients)
+        # replies which do not move for the timeout drop the client
+        for _ in range(100):
+            if len(server.clients) == 1:
+                break
+            threading.Event().wait(0.1)
+        assert len(server.clients) == 1
+        fast.send_data("still here")
+        assert fast.read_data() == "still here"
+    finally:
+        server.stop()
+        thread.join()
+        server.close()
+        slow.close()
+        fast.close()
+
+def test_multi_server_client_reset(free_port, retry_connect):
+    closed = threading.Event()
+
+    def handler(client, value):
+        if value == "reset":
+            closed.wait(10.0)  # the reply goes to a reset connection
+        client.send_data(value)
+
+    port = free_port()
+    server = p2pLinkMultiServer(port, handler=handler, timeout=10.0)
+    server.start()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        gone = _connect(retry_connect, port)
+        other = _connect(retry_connect, port)
+        gone.send_data("reset")
+        # close with a reset instead of the normal shutdown
+        gone.conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                             struct.pack("ii", 1, 0))
+        gone.conn.close()
+        threading.Event().wait(0.1)
+        closed.set()
+        for i in range(5):
+            other.send_data(i)
+            assert other.read_data() == i
+        assert thread.is_alive()
+        assert len(server.clients) == 1
+    finally:
+        server.stop()
+        thread.join()
+        server.close()
+        other.close()
+
+@pytest.mark.parametrize("server_compression,client_compression,codec", [
+    (None, True, "zlib"),
+    (None, "zlib", "zlib"),
+    (True, None, None),     # the client does not ask for compression
+    (False, True, None),    # the server refuses it
+    ("zlib", ["nothing", "zlib"], "zlib"),  # unknown codecs are skipped
+])
+def test_codec_handshake(p2p_link, server_compression, client_compression,
+                         codec):
+    server, client = p2p_link({"compression": server_compression},
+                              {"compression": client_compression})
+    if codec == "zlib" and client_compression is True:
+        codec = server.codec  # the best codec both ends have
+    assert server.codec == client.codec == codec
+    field = np.linspace(0.0, 1.0, 100000)
+    client.send_data(field)
+    client.send_data({"a": list(range(5000))})
+    client.send_data(np.arange(10.0))  # under the threshold
+    assert np.array_equal(server.read_data(), field)
+    assert server.read_data() == {"a": list(range(5000))}
+    assert np.array_equal(server.read_data(), np.arange(10.0))
+    server.send_data(field[::-1].copy())
+    assert np.array_equal(client.read_data(), field[::-1])
+
+def test_unknown_codec_offer(free_port):
+    with pytest.raises(ValueError):
+        p2pLinkClient(free_port(), compression="nothing")
+
+@pytest.mark.parametrize("dtype", ["f8", "f4", "c16", "i2", "u1"])
+def test_shuffle_round_trip(dtype):
+    values = (np.arange(1000) * 1.7).astype(dtype)
+    data = values.tobytes()
+    shuffled = _shuffle(data, values.itemsize)
+    assert len(shuffled) == len(data)
+    if values.itemsize > 1:
+        # the first bytes of every value come first
+        assert shuffled[:len(values)] == data[::values.itemsize]
+    out = np.empty(len(data), dtype=np.uint8)
+    _unshuffle(shuffled, values.itemsize, out)
+    assert out.tobytes() == data
+
+def _compressed_frame(value):
+    frames = _p2p_encode(value, "zlib")
+    assert struct.unpack("i", frames[0][:4])[0] == 10
+    return b"".join(bytes(frame) for frame in frames)
+
+def test_compressed_message_without_codec(raw_link):
+    server, sock = raw_link
+    sock.sendall(_compressed_frame(np.zeros(10000)) + struct.pack("ii", 1, 42))
+    with pytest.raises(ValueError):
+        server.read_data()
+    # the refused message was read to its end
+    assert server.read_data() == 42
+
+def test_compressed_message_longer_than_header(p2p_link):
+    server, client = p2p_link({}, {"compression": "zlib"})
+    frame = _compressed_frame(np.zeros(10000))
+    shuffle, raw_length, length = struct.unpack("=iqq", frame[4:24])
+    frame = (frame[:4] + struct.pack("=iqq", shuffle, 100, length) +
+             frame[24:])
+    client.conn.sendall(frame + struct.pack("ii", 1, 42))
+    with pytest.raises(ValueError):
+        server.read_data()
+    assert server.read_data() == 42
+
+def _decode(frames):
+    """Decode a message from its frames with the p2p link decoder."""
+    data = memoryview(b"".join(bytes(memoryview(frame).cast("B"))
+                               for frame in frames))
+    decoder = _p2p_decoder()
+    request = next(decoder)
+    offset = 0
+    try:
+        while True:
+            if isinstance(request, np.ndarray):
+                request[:] = np.frombuffer(data[offset:offset + len(request)],
+                                           dtype=np.uint8)
+                offset += len(request)
+                request = decoder.send(None)
+            else:
+                chunk = bytes(data[offset:offset + request])
+                offset += request
+                request = decoder.send(chunk)
+    except StopIteration as stop:
+        assert offset == len(data)  # the whole message was read
+        return stop.value
+
+def _assert_same(value, other):
+    assert type(value) is type(other)
+    if isinstance(value, (list, tuple)):
+        assert len(value) == len(other)
+        for item, other_item in zip(value, other):
+            _assert_same(item, other_item)
+    elif isinstance(value, dict):
+        assert list(value) == list(other)
+        for key in value:
+            _assert_same(value[key], other[key])
+    elif isinstance(value, np.ndarray):
+        assert value.dtype == other.dtype and value.shape == other.shape
+        assert value.tobytes(order="A") == other.tobytes(order="A")
+        if value.flags.c_contiguous or value.flags.f_contiguous:
+            assert value.flags.c_contiguous == other.flags.c_contiguous
+    else:
+        assert value == other
+
+structured = np.zeros(4, dtype=[("id", "<i4"), ("pos", "<f8", (3,)),
+                                ("tag", "S3"),
+                                ("inner", [("a", "<u2"), ("b", ">f4")])])
+structured["id"] = np.arange(4)
+structured["pos"] = np.arange(12.0).reshape(4, 3)
+structured["tag"] = b"abc"
+structured["inner"]["b"] = 0.5
+
+@pytest.mark.parametrize("value", [
+    (1, 2.5, "a", None, True),
+    [np.arange(5), [np.zeros((2, 3)), (np.ones(2, dtype=np.float32),)]],
+    {"step": 120, "disp": np.random.random((10, 3)),
+     "stress": (np.arange(3.0), np.arange(4, dtype=np.int16))},
+    {"nested": {"deeper": [1, {"x": np.arange(3)}]}, 5: "int key"},
+    (np.asfortranarray(np.arange(12.0).reshape(3, 4)),
+     np.arange(24).reshape(2, 3, 4).T),
+    [structured, structured[::2]],
+    (np.float32(1.5), np.int64(-3), np.bool_(True), np.complex128(1j)),
+    (np.zeros(3, dtype="V0"), np.zeros((0, 4)), np.empty(0, dtype="S0")),
+    [np.arange(1e5), np.arange(7, dtype=np.uint8), np.arange(3.0)],
+])
+def test_structured_message_round_trip(value):
+    frames = _p2p_frames(value)
+    assert struct.unpack("i", bytes(memoryview(frames[0])[:4]))[0] == 9
+    _assert_same(value, _decode(frames))
+
+def test_structured_message_alignment():
+    frames = _structure_frames((np.arange(3, dtype=np.uint8),
+                                np.arange(1e5), np.arange(5.0)))
+    tree_length, = struct.unpack("i", bytes(frames[0][4:8]))
+    tree = json.loads(bytes(frames[0][8:8 + tree_length]))
+    starts = [item["a"][0] for item in tree["t"]]
+    assert starts == [0, 16, 16 + 8 * 10 ** 5]
+    # the large array is sent from its own memory, the others are copied
+    assert len(frames) == 3
+
+def test_structured_descr_from_json():
+    descr = np.lib.format.dtype_to_descr(structured.dtype)
+    restored = _descr_from_json(json.loads(json.dumps(descr)))
+    assert np.lib.format.descr_to_dtype(restored) == structured.dtype
+
+def test_structured_message_of_objects():
+    with pytest.raises(ValueError):
+        _p2p_frames((np.array([{}, None]),))
+    with pytest.raises(ValueError):
+        _p2p_frames([np.arange(3), object()])
+
+def test_structured_message_views(link):
+    server, client = link
+    client.send_data({"a": np.arange(1e5), "b": np.arange(10)})
+    value = server.read_data()
+    # the arrays are views of one receive buffer
+    assert value["a"].base is not None
+    assert np.shares_memory(value["a"].base, value["b"].base)
+    assert np.array_equal(value["a"], np.arange(1e5))
@@ -0,0 +1,111 @@
+"""Shared memory transfers of the Python to Python link, with both ends in
+this process. These tests do not need an Itasca code."""
+import gc
+import os
+
+import numpy as np
+import pytest
+
+from itasca.main import SharedMemory
+
+pytestmark = pytest.mark.skipif(SharedMemory is None,
+                                reason="needs multiprocessing.shared_memory")
+
+@pytest.fixture
+def link(p2p_link):
+    """A p2pLinkServer and a p2pLinkClient which asks for shared memory."""
+    return p2p_link({}, {"shared_memory": True})
+
+def _segment_exists(name):
+    try:
+        SharedMemory(name).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+big = np.arange(1 << 18, dtype=np.float64)  # 2 MB
+
+def test_array_round_trip(link):
+    server, client = link
+    client.send_data(big)
+    assert len(client._segments) == 1
+    value = server.read_data()
+    assert np.array_equal(value, big)
+    # the received array is a view of the segment, not a copy
+    assert not value.flags.owndata
+    fortran = np.asfortranarray(big.reshape(512, 512))
+    server.send_data(fortran)
+    value = client.read_data()
+    assert value.flags.f_contiguous and np.array_equal(value, fortran)
+
+def test_dict_round_trip(link):
+    server, client = link
+    message = {"step": 3, "disp": big.reshape(-1, 2),
+               "stress": (big[:1000], np.arange(10, dtype=np.int32))}
+    client.send_data(message)
+    assert len(client._segments) == 1
+    value = server.read_data()
+    assert value["step"] == 3
+    assert np.array_equal(value["disp"], message["disp"])
+    assert np.array_equal(value["stress"][0], message["stress"][0])
+    assert value["stress"][1].dtype == np.int32
+
+def test_small_messages_use_the_socket(link):
+    server, client = link
+    client.send_data(np.arange(10.0))
+    assert not client._segments
+    assert np.array_equal(server.read_data(), np.arange(10.0))
+
+def test_segment_reuse(link):
+    server, client = link
+    client.send_data(big)
+    name, = client._segments
+    value = server.read_data()
+    del value
+    gc.collect()
+    # the release notice goes out with the next message of the server
+    server.send_data("released")
+    assert client.read_data() == "released"
+    assert not client._segments
+    client.send_data(big * 2)
+    assert list(client._segments) == [name]
+    assert np.array_equal(server.read_data(), big * 2)
+
+def test_segment_limit(link):
+    server, client = link
+    client.shared_memory_segments = 2
+    client.shared_memory_threshold = 4096
+    small = np.arange(1024.0)  # fits in the socket buffers
+    for i in range(4):
+        client.send_data(small + i)
+    # the server has not read the first two, later messages use the socket
+    assert len(client._segments) == 2
+    values = [server.read_data() for _ in range(4)]
+    for i, value in enumerate(values):
+        assert np.array_equal(value, small + i)
+    assert not values[0].flags.owndata and values[3].flags.owndata
+
+def test_close_removes_segments(link):
+    server, client = link
+    for i in range(3):
+        client.send_data(big + i)
+        server.send_data(big - i)
+    names = list(client._segments) + list(server._segments)
+    assert len(set(names)) == 6
+    # the views are still held when the links are closed
+    held = ([server.read_data() for _ in range(3)] +
+            [client.read_data() for _ in range(3)])
+    client.close()
+    server.close()
+    assert not any(_segment_exists(name) for name in names)
+    if os.path.isdir("/dev/shm"):
+        assert not set(names) & set(os.listdir("/dev/shm"))
+    del held
+
+def test_refused(p2p_link):
+    server, client = p2p_link({"shared_memory": False},
+                              {"shared_memory": True})
+    assert client._segments is None and server._segments is None
+    client.send_data(big)
+    value = server.read_data()
+    assert np.array_equal(value, big) and value.flags.owndata
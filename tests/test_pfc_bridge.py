@@ -0,0 +1,130 @@
+"""pfcBridge tests against the headless MockPFCBridge. These tests do not
+need PFC3D."""
+import pytest
+
+from itasca import PFC3D_Connection
+from itasca.bridge import pfcBridge, pfcObject
+from .mock_pfc_bridge import MockPFCBridge
+
+@pytest.fixture
+def bridge(free_port):
+    """A function returning a pfcBridge connected to a MockPFCBridge made
+    with the given arguments, and the mock."""
+    opened = []
+
+    def connect(**kwargs):
+        port = free_port()
+        peer = MockPFCBridge(port, **kwargs)
+        peer.start()
+        connection = PFC3D_Connection(port=port, timeout=10.0)
+        connection.attach()
+        opened.append((pfcBridge(connection=connection), peer))
+        return opened[-1]
+
+    yield connect
+    for pfc, peer in opened:
+        pfc.close()
+        peer.join()
+
+def test_pipelined_batches_keep_order(bridge, monkeypatch):
+    fish = {"v{}".format(i): i * 0.5 for i in range(10)}
+    pfc, peer = bridge(fish=fish)
+    pfc.pipeline_depth = 3
+    sends = []
+    send_many = pfc.connection.send_many
+    monkeypatch.setattr(pfc.connection, "send_many",
+                        lambda values: sends.append(len(values)) or
+                        send_many(values))
+    names = sorted(fish, key=lambda name: -fish[name])
+    assert pfc.eval_many(names) == [fish[name] for name in names]
+    assert sends == [6, 6, 6, 2]  # a code and a string per request
+    assert [text for _, text in peer.requests] == names
+    pfc.cmd_many(["ball id {} rad 1".format(i) for i in range(7)])
+    assert peer.commands == ["ball id {} rad 1".format(i) for i in range(7)]
+    assert pfc.eval("v3") == 1.5
+
+def test_pointers_are_mapped(bridge):
+    pfc, _ = bridge(balls=[{"id": 4, "rad": 0.25}],
+                    fish={"ball_head": ("ball", 4), "wall_head": ("wall", 2),
+                          "clump_head": ("clump", 7),
+                          "meas_head": ("meas", 1), "nothing": None,
+                          "label": ":not a pointer"})
+    ball, wall, clump, meas, nothing, label = pfc.eval_many(
+        ["ball_head", "wall_head", "clump_head", "meas_head", "nothing",
+         "label"])
+    assert ball == pfcObject(pfc, "ball", 4)
+    assert (wall.kind, wall.id) == ("wall", 2)
+    assert (clump.kind, clump.id) == ("clump", 7)
+    assert (meas.kind, meas.id) == ("meas", 1)
+    assert nothing is None and label == ":not a pointer"
+    assert ball.rad() == 0.25
+    ball.rad(0.5)
+    assert ball.rad() == 0.5
+
+def test_eval_classifies_assignments(bridge):
+    pfc, peer = bridge(fish={"a": 1, "a >= 3": 0, "f(a=1)": 2,
+                             "x(1) == 2": 0})
+    expressions = ["a = 3", "x(1) = 2", "b_rad(find_ball(1)) = 1",
+                   "a", "a >= 3", "f(a=1)", "x(1) == 2", "  a2=1"]
+    peer.balls.append({"id": 1, "rad": 0.0})
+    pfc.eval_many(expressions)
+    assert [code for code, _ in peer.requests] == [12, 12, 12, 11, 11, 11,
+                                                   11, 12]
+    assert pfc.eval("a") == 3 and pfc.eval("a2") == 1
+    assert pfc.execute("a = 4") == 0 and pfc.eval("a") == 4
+
+def test_get_and_set_many(bridge):
+    pfc, peer = bridge(balls=[{"id": i, "rad": i / 10.0}
+                              for i in range(1, 6)])
+    pfc.pipeline_depth = 2
+    balls = [pfcObject(pfc, "ball", i) for i in range(1, 6)]
+    assert pfc.get_many(balls, "rad") == [0.1, 0.2, 0.3, 0.4, 0.5]
+    pfc.set_many(balls, "rad", [1, 2, 3, 4, 5])
+    assert pfc.get_many(balls, "rad") == [1, 2, 3, 4, 5]
+    pfc.set_many(balls[1:3], "xvel", 2.5)  # one value for all
+    assert [ball["xvel"] for ball in peer.balls] == [0.0, 2.5, 2.5, 0.0, 0.0]
+    assert pfc.get_many([], "rad") == []
+
+def _balls(count):
+    return [{"id": 100 + i, "x": i, "y": -i, "z": i / 2.0, "xvel": 1.0,
+             "rad": 0.5 + i} for i in range(count)]
+
+@pytest.mark.parametrize("count", [0, 1, 333, 334, 1000])
+def test_get_ball_arrays(bridge, count):
+    # 333 positions fill the 999 value server buffer, 334 do not
+    pfc, peer = bridge(balls=_balls(count))
+    positions = pfc.ball_positions()
+    assert positions.shape == (count, 3)
+    assert positions.tolist() == [[i, -i, i / 2.0] for i in range(count)]
+    assert pfc.ball_velocities().tolist() == [[1.0, 0.0, 0.0]] * count
+    assert pfc.ball_radii().tolist() == [0.5 + i for i in range(count)]
+    assert pfc.ball_ids().tolist() == [100 + i for i in range(count)]
+    assert pfc.ball_list() == [pfcObject(pfc, "ball", 100 + i)
+                               for i in range(count)]
+    # the trailing 0 of each array reply was read
+    assert [code for code, _ in peer.requests] == [13] * 5
+    peer.fish["n"] = count
+    assert pfc.eval("n") == count
+
+@pytest.mark.parametrize("count", [0, 2, 1000])
+def test_set_ball_arrays(bridge, count):
+    pfc, peer = bridge(balls=_balls(count))
+    positions = [[i, i + 0.5, -1.0] for i in range(count)]
+    pfc.set_ball_positions(positions)
+    pfc.set_ball_velocities([[0.0, 0.0, 9.0]] * count)
+    pfc.set_ball_radii([2.0] * count)
+    assert pfc.ball_positions().tolist() == positions
+    assert pfc.ball_velocities().tolist() == [[0.0, 0.0, 9.0]] * count
+    assert pfc.ball_radii().tolist() == [2.0] * count
+
+def test_set_ball_array_length_mismatch(bridge):
+    pfc, peer = bridge(balls=_balls(3))
+    with pytest.raises(ValueError):
+        pfc.set_ball_radii([1.0, 2.0])
+    with pytest.raises(ValueError):
+        pfc.set_ball_positions([[1.0, 2.0, 3.0]] * 4)
+    # nothing was assigned and the replies were all read
+    assert pfc.ball_radii().tolist() == [0.5, 1.5, 2.5]
+    with pytest.raises(ValueError):
+        pfc.set_ball_positions([1.0, 2.0, 3.0])  # not an (N,3) array
+    assert peer.requests[-1] == (13, "radii")